@@ -0,0 +1,323 @@
+"""Screen capture and analysis in a separate process.
+
+AnalysisService starts a child process that owns the frame source and the analysis
+Processor and runs them in a loop, independent of the UI process and its GIL. Every
+frame's segment records, and optionally the frame itself, are published through
+multiprocessing.shared_memory double buffers (see SharedDoubleBuffer). The UI process
+only reads the newest results, encodes the commands of the changed segments and drives
+the device.
+
+The child reports a segment as changed until the UI has read a result containing that
+change, so results the UI skips while it is busy sending do not lose color changes.
+"""
+import multiprocessing
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_sources import CaptureThread, get_monitors, open_frame_source
+import time_numpy
+
+HEADER_SIZE = 128  # Bytes reserved for the sequence counter and per-slot metadata
+SNAPSHOT_INTERVAL = 30.0  # Seconds between saves of the child's previous colors
+ON_DEMAND_RATE = 30  # Frames per second analyzed when the capture rate is 0 (on demand)
+
+# Shared control block written by the UI process and read by the child.
+CONTROL_DTYPE = np.dtype([
+    ("monitor_index", np.int64),
+    ("letterbox", np.uint8),  # Letterbox detection enabled
+    ("acked", np.int64),  # Sequence number of the newest result the UI has read
+    ("forget", np.uint8, time_numpy.SEGMENT_SLOTS),  # Segments whose colors were not delivered
+])
+
+
+class SharedDoubleBuffer:
+    """Two slots of a fixed-capacity array in shared memory, published with a sequence counter.
+
+    The writer fills the slot the readers are not looking at, then increments the counter;
+    slot seq % 2 always holds the newest complete value. A reader copies that slot and
+    checks that the counter did not move meanwhile, since the writer's next write goes to
+    the other slot and only the one after that reuses this one. Each slot also stores its
+    actual shape (at most the capacity) and a perf_counter() timestamp, which is comparable
+    across processes.
+
+    There is a single writer. Readers never write, so the buffer needs no locks.
+    """
+
+    def __init__(self, capacity, dtype, name=None):
+        self.capacity = tuple(capacity)
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.capacity)) * self.dtype.itemsize
+        ndim = len(self.capacity)
+        if 8 + 2 * 8 * (1 + ndim) > HEADER_SIZE:
+            raise ValueError("Too many dimensions for the shared buffer header.")
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + 2 * self.slot_size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        buffer = self.memory.buf
+        self.seq = np.ndarray((1,), dtype=np.int64, buffer=buffer)
+        self.stamps = np.ndarray((2,), dtype=np.float64, buffer=buffer, offset=8)
+        self.shapes = np.ndarray((2, ndim), dtype=np.int64, buffer=buffer, offset=24)
+        self.slots = [np.ndarray(self.capacity, dtype=self.dtype, buffer=buffer,
+                                 offset=HEADER_SIZE + i * self.slot_size) for i in range(2)]
+        if self.owner:
+            self.seq[0] = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def sequence(self):
+        """Number of values published so far; 0 means none yet."""
+        return int(self.seq[0])
+
+    def write(self, value, stamp=None):
+        """Publish a copy of value. Returns False if it is larger than the capacity."""
+        value = np.asarray(value)
+        if value.ndim != len(self.capacity) or any(n > c for n, c in zip(value.shape, self.capacity)):
+            return False
+        index = (int(self.seq[0]) + 1) % 2
+        self.slots[index][tuple(slice(0, n) for n in value.shape)] = value
+        self.shapes[index] = value.shape
+        self.stamps[index] = time.perf_counter() if stamp is None else stamp
+        self.seq[0] += 1  # Publish; 8-byte aligned stores are not torn
+        return True
+
+    def read(self, after=0):
+        """Return (seq, value copy, stamp) of the newest value newer than after, or None."""
+        while True:
+            seq = int(self.seq[0])
+            if seq <= after:
+                return None
+            index = seq % 2
+            shape = tuple(int(n) for n in self.shapes[index])
+            value = self.slots[index][tuple(slice(0, n) for n in shape)].copy()
+            stamp = float(self.stamps[index])
+            if int(self.seq[0]) == seq:
+                return seq, value, stamp
+            # The writer overtook this read; try again with the newer value.
+
+    def close(self):
+        self.slots = self.seq = self.stamps = self.shapes = None  # Release views of the buffer
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Names a usable time_bindings build must export. Builds from before the Processor API still
+# import but lack them.
+NATIVE_API = ("Processor", "encodeCommand")
+
+
+def load_native_engine():
+    """Import the compiled time_bindings module, or return None if it is missing or outdated."""
+    try:
+        import time_bindings
+    except ImportError:
+        return None
+    missing = [name for name in NATIVE_API if not hasattr(time_bindings, name)]
+    if missing:
+        print(f"Warning: time_bindings is an outdated build without {', '.join(missing)}; "
+              f"using the NumPy backend. Rebuild the module to use the native engine.", file=sys.stderr)
+        return None
+    return time_bindings
+
+
+def load_engine(backend):
+    """The analysis module for the backend name, falling back to NumPy without a usable native module."""
+    if backend != "numpy":
+        engine = load_native_engine()
+        if engine is not None:
+            return engine
+    return time_numpy
+
+
+def run_analysis(names, backend, capture, stop):
+    """Child process: capture, analyze and publish results until stop is set.
+
+    Frames are analyzed at the capture rate, or ON_DEMAND_RATE when it is 0; the UI only
+    reads the newest result, so analyzing faster would just keep a core busy.
+    """
+    results = SharedDoubleBuffer((time_numpy.MAX_SEGMENTS,), time_numpy.SEGMENT_DTYPE, names["results"])
+    frames = None
+    if names.get("frames"):
+        frames = SharedDoubleBuffer(names["frame_capacity"], np.uint8, names["frames"])
+    control_memory = shared_memory.SharedMemory(name=names["control"])
+    control = np.ndarray((), dtype=CONTROL_DTYPE, buffer=control_memory.buf)
+
+    engine = load_engine(backend)
+    engine.initScreenCapture()
+    processor = engine.Processor()
+    monitor_index = int(control["monitor_index"])
+    letterbox = bool(control["letterbox"])
+    engine.set_letterbox_detection(letterbox)
+    source = open_frame_source(monitor_index=monitor_index, **capture)
+    pending = np.zeros(time_numpy.SEGMENT_SLOTS, dtype=bool)  # Changes the UI has not read yet
+    published = 0
+    frames_dropped = False
+    interval = 1.0 / (capture.get("rate") or ON_DEMAND_RATE)
+    next_frame = time.perf_counter()
+    last_snapshot = time.perf_counter()
+    try:
+        while not stop.is_set():
+            if int(control["monitor_index"]) != monitor_index:
+                monitor_index = int(control["monitor_index"])
+                engine.switchMonitorCapture()
+                if source is not None:
+                    source.set_monitor(monitor_index)
+            if bool(control["letterbox"]) != letterbox:
+                letterbox = bool(control["letterbox"])
+                engine.set_letterbox_detection(letterbox)
+            forget = np.flatnonzero(control["forget"])
+            if forget.size:
+                control["forget"][forget] = 0
+                processor.forget(forget.tolist())
+
+            frame = None
+            captured_at = time.perf_counter()
+            if source is not None:
+                frame = source.grab()
+                if frame is None:
+                    time.sleep(0.01)
+                    continue
+                if isinstance(source, CaptureThread):
+                    captured_at = source.frame_time
+            segments, _ = processor.analyze(frame)
+
+            if int(control["acked"]) >= published:
+                pending[:] = False
+            in_table = (segments["segment"] > 0) & (segments["segment"] < time_numpy.SEGMENT_SLOTS)
+            pending[segments["segment"][in_table & (segments["changed"] != 0)]] = True
+            segments["changed"] = in_table & pending[np.where(in_table, segments["segment"], 0)]
+            if frames is not None and frame is not None:
+                if not frames.write(frame, captured_at) and not frames_dropped:
+                    print(f"Warning: {frame.shape} frames do not fit the shared frame buffer "
+                          f"{frames.capacity} and are not published.", file=sys.stderr)
+                    frames_dropped = True
+            if not results.write(segments, captured_at):
+                raise RuntimeError(f"{len(segments)} segment records do not fit the shared result "
+                                   f"buffer of {results.capacity[0]}.")
+            published = results.sequence
+
+            if time.perf_counter() - last_snapshot >= SNAPSHOT_INTERVAL:
+                processor.snapshot()
+                last_snapshot = time.perf_counter()
+            next_frame = max(next_frame + interval, time.perf_counter())
+            stop.wait(next_frame - time.perf_counter())
+    finally:
+        processor.snapshot()
+        processor.close()
+        if source is not None:
+            source.close()
+        del control
+        control_memory.close()
+        results.close()
+        if frames is not None:
+            frames.close()
+
+
+class AnalysisService:
+    """Run capture and analysis in a child process and read its newest results.
+
+    capture holds the keyword arguments of frame_sources.open_frame_source() except
+    monitor_index. With publish_frames, the captured frames are published too (only when
+    a Python frame source is used; the engine's own capture does not return its frames).
+    Letterbox detection is a module flag of the engine, so the child's copy is set through
+    the control block (see set_letterbox_detection()).
+    """
+
+    def __init__(self, backend="native", monitor_index=1, capture=None, publish_frames=False,
+                 letterbox_detection=True):
+        self.backend = backend
+        self.capture = dict(capture or {})
+        # Segment layouts are limited to MAX_SEGMENTS segments, so that many records fit any result.
+        self.results = SharedDoubleBuffer((time_numpy.MAX_SEGMENTS,), time_numpy.SEGMENT_DTYPE)
+        self.frames = None
+        if publish_frames:
+            width = max(monitor["width"] for monitor in get_monitors()[1:])
+            height = max(monitor["height"] for monitor in get_monitors()[1:])
+            self.frames = SharedDoubleBuffer((height, width, 4), np.uint8)
+        self.control_memory = shared_memory.SharedMemory(create=True, size=CONTROL_DTYPE.itemsize)
+        self.control = np.ndarray((), dtype=CONTROL_DTYPE, buffer=self.control_memory.buf)
+        self.control["monitor_index"] = monitor_index
+        self.control["letterbox"] = bool(letterbox_detection)
+        self.control["acked"] = 0
+        self.control["forget"] = 0
+        self.last_seq = 0
+        self.last_frame_seq = 0
+        # spawn on every platform: forking a process with Qt and capture threads is not safe.
+        context = multiprocessing.get_context("spawn")
+        self.stop_event = context.Event()
+        names = {"results": self.results.name, "control": self.control_memory.name}
+        if self.frames is not None:
+            names.update(frames=self.frames.name, frame_capacity=self.frames.capacity)
+        self.process = context.Process(target=run_analysis, name="AnalysisProcess", daemon=True,
+                                       args=(names, backend, self.capture, self.stop_event))
+        self.process.start()
+
+    def read(self, timeout=1.0):
+        """Wait for a result newer than the last one read and return (segments, captured_at).
+
+        Returns None if no new result arrived in time or the child process has exited.
+        Reading acknowledges the result, so its changed segments are not reported again.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            latest = self.results.read(self.last_seq)
+            if latest is not None:
+                self.last_seq, segments, captured_at = latest
+                self.control["acked"] = self.last_seq
+                return segments, captured_at
+            if time.perf_counter() >= deadline or not self.process.is_alive():
+                return None
+            time.sleep(0.002)
+
+    def read_frame(self):
+        """Return (frame, captured_at) of the newest published frame not read yet, or None."""
+        if self.frames is None:
+            return None
+        latest = self.frames.read(self.last_frame_seq)
+        if latest is None:
+            return None
+        self.last_frame_seq, frame, captured_at = latest
+        return frame, captured_at
+
+    def forget(self, segments):
+        """Report the segments as changed again, e.g. after their commands failed to send."""
+        for segment in segments:
+            if 0 < segment < time_numpy.SEGMENT_SLOTS:
+                self.control["forget"][segment] = 1
+
+    def set_monitor(self, monitor_index):
+        """Switch the child's capture to another monitor (settings.json must already select it)."""
+        self.control["monitor_index"] = monitor_index
+
+    def set_letterbox_detection(self, enable):
+        """Enable or disable the child's letterbox detection."""
+        self.control["letterbox"] = bool(enable)
+
+    def close(self, timeout=5.0):
+        """Stop the child process, which saves its previous colors, and free the shared memory."""
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.control = None
+        self.control_memory.close()
+        self.control_memory.unlink()
+        self.results.close()
+        if self.frames is not None:
+            self.frames.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,768 @@
+"""Frame sources for the analysis engines.
+
+A FrameSource produces HxWx3 BGR uint8 frames of one monitor. Sources keep their capture
+session and frame buffer between grabs, so a frame may be a view into a buffer that is
+overwritten by the next grab; copy it if it has to outlive that grab.
+
+Available sources:
+    MssFrameSource       - cross-platform capture with one persistent mss session
+    XShmFrameSource      - X11 MIT-SHM capture into a reused shared-memory buffer (Linux)
+    SyntheticFrameSource - animated test pattern, for benchmarks and testing without a display
+    ReplayFrameSource    - frames recorded with FrameRecorder, memory-mapped from disk
+
+CaptureThread runs any of these on a background thread at a fixed rate, so the analyzer
+always takes the newest frame instead of capturing on demand.
+"""
+import abc
+import ctypes
+import ctypes.util
+import json
+import os
+import sys
+import threading
+import time
+
+import mss
+import numpy as np
+from mss.exception import ScreenShotError
+
+# Capture regions start and end on multiples of the largest analysis divisor.
+CAPTURE_ALIGN = 8
+# Two areas are captured together if their bounding box costs at most this much extra.
+REGION_MERGE_SLACK = 1.25
+
+# mss sessions hold per-thread display resources, so every thread keeps its own session.
+_sessions = threading.local()
+
+
+def screen_session():
+    """Return the calling thread's persistent mss session."""
+    sct = getattr(_sessions, "sct", None)
+    if sct is None:
+        sct = _sessions.sct = mss.mss()
+    return sct
+
+
+def get_monitors():
+    """List of monitors as reported by mss; entry 0 is the full virtual screen."""
+    return screen_session().monitors
+
+
+def monitor_geometry(monitor_index):
+    """Geometry dict (left, top, width, height) of a monitor, falling back to the primary monitor."""
+    monitors = get_monitors()
+    if monitor_index < 1 or monitor_index >= len(monitors):
+        monitor_index = 1
+    return monitors[monitor_index]
+
+
+def plan_capture_regions(segments):
+    """Group segment rectangles into capture regions packed into one compact frame.
+
+    Segments in the same row share a region when capturing their bounding box wastes little,
+    which typically turns the top and bottom edges into one strip each. Stacked segments are
+    not merged so a side column packs as a row of short regions instead of one tall strip.
+    Regions are aligned to CAPTURE_ALIGN on the screen and in the packed frame, so
+    downscaling the packed frame gives the same pixels as downscaling the full frame.
+    They are placed on shelves, tallest first.
+
+    Returns (regions, canvas, packed_segments) where regions is a list of
+    ((x, y, width, height), (target_x, target_y)), canvas is (width, height) and
+    packed_segments maps every segment to its rectangle in the packed frame.
+    """
+    align = CAPTURE_ALIGN
+    areas, members = [], []
+    for segment, (x, y, width, height) in segments.items():
+        if width > 0 and height > 0:
+            areas.append((x // align * align, y // align * align,
+                          -(-(x + width) // align) * align, -(-(y + height) // align) * align))
+            members.append([segment])
+
+    def area(box):
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(areas)):
+            for j in range(i + 1, len(areas)):
+                a, b = areas[i], areas[j]
+                bounds = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                overlap = (max(0, min(a[2], b[2]) - max(a[0], b[0])) *
+                           max(0, min(a[3], b[3]) - max(a[1], b[1])))
+                same_row = bounds[3] - bounds[1] <= max(a[3] - a[1], b[3] - b[1])
+                if same_row and area(bounds) <= (area(a) + area(b) - overlap) * REGION_MERGE_SLACK:
+                    areas[i] = bounds
+                    members[i] += members.pop(j)
+                    del areas[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    order = sorted(range(len(areas)), key=lambda index: areas[index][1] - areas[index][3])
+    canvas_width = max((box[2] - box[0] for box in areas), default=0)
+    regions, packed = [], {}
+    x = y = shelf_height = 0
+    for index in order:
+        left, top, right, bottom = areas[index]
+        width, height = right - left, bottom - top
+        if x > 0 and x + width > canvas_width:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        regions.append(((left, top, width, height), (x, y)))
+        for segment in members[index]:
+            sx, sy, sw, sh = segments[segment]
+            packed[segment] = (sx - left + x, sy - top + y, sw, sh)
+        x += width
+        shelf_height = max(shelf_height, height)
+    return regions, (canvas_width, y + shelf_height), packed
+
+
+def pack_capture_regions(frame, regions, canvas, out=None):
+    """Copy the regions of a full frame into a packed frame; areas outside the frame stay black."""
+    width, height = canvas
+    if out is None or out.shape[:2] != (height, width):
+        out = np.zeros((height, width, 3), dtype=np.uint8)
+    rows, cols = frame.shape[:2]
+    for (x, y, w, h), (tx, ty) in regions:
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + w, cols), min(y + h, rows)
+        if right > left and bottom > top:
+            tx, ty = tx + left - x, ty + top - y
+            out[ty:ty + bottom - top, tx:tx + right - left] = frame[top:bottom, left:right, :3]
+    return out
+
+
+class FrameSource(abc.ABC):
+    """Base class for frame sources; subclasses implement grab()."""
+
+    def __init__(self, monitor_index=1):
+        self.monitor_index = monitor_index
+        self.packed = None  # Reused output of grab_regions()
+
+    @abc.abstractmethod
+    def grab(self):
+        """Return the newest frame as an HxWx3 BGR uint8 array, or None if capture failed."""
+
+    def grab_regions(self, regions, canvas):
+        """Return only the given regions packed into a (canvas height, canvas width, 3) frame.
+
+        The default grabs the full frame and packs it; sources that can capture parts of the
+        screen override this. Returns None if capture failed.
+        """
+        frame = self.grab()
+        if frame is None:
+            return None
+        self.packed = pack_capture_regions(frame, regions, canvas, self.packed)
+        return self.packed
+
+    def set_monitor(self, monitor_index):
+        """Capture a different monitor from the next grab on. Safe to call from another thread."""
+        self.monitor_index = monitor_index
+
+    def close(self):
+        """Release the capture resources."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+        ########################
+        #         MSS          #
+        ########################
+
+class MssFrameSource(FrameSource):
+    """Capture with the grabbing thread's persistent mss session.
+
+    mss returns every screenshot in a new buffer; its BGR channels are copied into one frame
+    buffer that is reused by every grab, and the screenshot is released right away.
+    """
+
+    def __init__(self, monitor_index=1):
+        super().__init__(monitor_index)
+        self.frame = None
+
+    def grab(self):
+        sct = screen_session()
+        try:
+            shot = sct.grab(monitor_geometry(self.monitor_index))
+        except ScreenShotError:
+            return None
+        pixels = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        if self.frame is None or self.frame.shape[:2] != pixels.shape[:2]:
+            self.frame = np.empty((shot.height, shot.width, 3), dtype=np.uint8)
+        np.copyto(self.frame, pixels[:, :, :3])  # BGRA -> BGR
+        return self.frame
+
+    def grab_regions(self, regions, canvas):
+        """Grab each region separately so only the covered pixels are captured."""
+        sct = screen_session()
+        monitor = monitor_geometry(self.monitor_index)
+        width, height = canvas
+        packed = self.packed
+        if packed is None or packed.shape[:2] != (height, width):
+            packed = self.packed = np.zeros((height, width, 3), dtype=np.uint8)
+        for (x, y, w, h), (tx, ty) in regions:
+            left, top = max(x, 0), max(y, 0)
+            right, bottom = min(x + w, monitor["width"]), min(y + h, monitor["height"])
+            if right <= left or bottom <= top:
+                continue
+            area = {"left": monitor["left"] + left, "top": monitor["top"] + top,
+                    "width": right - left, "height": bottom - top}
+            try:
+                shot = sct.grab(area)
+            except ScreenShotError:
+                return None
+            pixels = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+            tx, ty = tx + left - x, ty + top - y
+            packed[ty:ty + shot.height, tx:tx + shot.width] = pixels[:, :, :3]
+        return packed
+
+
+        ########################
+        #      X11 MIT-SHM     #
+        ########################
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class XImage(ctypes.Structure):
+    # Leading fields of the Xlib XImage structure; only these are read.
+    _fields_ = [
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("xoffset", ctypes.c_int),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int),
+        ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+    ]
+
+
+ZPIXMAP = 2
+ALL_PLANES = 0xFFFFFFFF
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+
+def _load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError(f"lib{name} not found")
+    return ctypes.CDLL(path)
+
+
+class XShmFrameSource(FrameSource):
+    """X11 capture through the MIT shared-memory extension.
+
+    The X server writes every frame straight into one shared-memory segment that stays
+    attached for the lifetime of the source, so grabbing neither reopens the display nor
+    allocates a new frame. Raises OSError if X11 or the extension is not available.
+    """
+
+    def __init__(self, monitor_index=1):
+        super().__init__(monitor_index)
+        if not sys.platform.startswith("linux"):
+            raise OSError("X11 shared-memory capture is only available on Linux")
+        self.x11 = _load_library("X11")
+        self.xext = _load_library("Xext")
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self._declare_functions()
+
+        self.display = self.x11.XOpenDisplay(None)
+        if not self.display:
+            raise OSError("Cannot open the X display")
+        if not self.xext.XShmQueryExtension(self.display):
+            self.x11.XCloseDisplay(self.display)
+            raise OSError("The X server does not support MIT-SHM")
+        screen = self.x11.XDefaultScreen(self.display)
+        self.root = self.x11.XRootWindow(self.display, screen)
+        self.visual = self.x11.XDefaultVisual(self.display, screen)
+        self.depth = self.x11.XDefaultDepth(self.display, screen)
+        self.image = None
+        self.shminfo = XShmSegmentInfo()
+        self.frame = None
+        self._create_image()
+
+    def _declare_functions(self):
+        x11, xext, libc = self.x11, self.xext, self.libc
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(XImage)]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def _create_image(self):
+        """Create the shared-memory image for the current monitor's size."""
+        self.image_monitor = self.monitor_index
+        monitor = monitor_geometry(self.image_monitor)
+        self.left, self.top = monitor["left"], monitor["top"]
+        width, height = monitor["width"], monitor["height"]
+
+        image = self.xext.XShmCreateImage(self.display, self.visual, self.depth, ZPIXMAP, None,
+                                          ctypes.byref(self.shminfo), width, height)
+        if not image:
+            raise OSError("XShmCreateImage failed")
+        if image.contents.bits_per_pixel != 32:
+            self.x11.XDestroyImage(image)
+            raise OSError("X11 shared-memory capture needs a 32-bit visual")
+        size = image.contents.bytes_per_line * height
+
+        self.shminfo.shmid = self.libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if self.shminfo.shmid < 0:
+            self.x11.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        address = self.libc.shmat(self.shminfo.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            self.libc.shmctl(self.shminfo.shmid, IPC_RMID, None)
+            self.x11.XDestroyImage(image)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        self.shminfo.shmaddr = address
+        self.shminfo.readOnly = 0
+        image.contents.data = address
+        self.xext.XShmAttach(self.display, ctypes.byref(self.shminfo))
+        self.x11.XSync(self.display, 0)
+        # Mark the segment for removal now; it lives until both sides detach.
+        self.libc.shmctl(self.shminfo.shmid, IPC_RMID, None)
+        self.image = image
+
+        # BGRX pixels (little-endian 32-bit ZPixmap), viewed in place.
+        stride = image.contents.bytes_per_line
+        buffer = (ctypes.c_uint8 * size).from_address(address)
+        rows = np.frombuffer(buffer, dtype=np.uint8).reshape(height, stride)
+        self.frame = rows[:, :width * 4].reshape(height, width, 4)[:, :, :3]
+
+    def _destroy_image(self):
+        if self.image is None:
+            return
+        self.frame = None
+        self.xext.XShmDetach(self.display, ctypes.byref(self.shminfo))
+        self.x11.XSync(self.display, 0)
+        self.x11.XDestroyImage(self.image)  # Frees the XImage only; the data is shared memory
+        self.libc.shmdt(self.shminfo.shmaddr)
+        self.image = None
+
+    def grab(self):
+        if self.image is None:
+            return None
+        if self.image_monitor != self.monitor_index:
+            # Recreated here rather than in set_monitor() so only the grabbing thread touches the image.
+            self._destroy_image()
+            self._create_image()
+        if not self.xext.XShmGetImage(self.display, self.root, self.image, self.left, self.top, ALL_PLANES):
+            return None
+        return self.frame
+
+    def close(self):
+        if self.display:
+            self._destroy_image()
+            self.x11.XCloseDisplay(self.display)
+            self.display = None
+
+
+        ########################
+        #      SYNTHETIC       #
+        ########################
+
+class SyntheticFrameSource(FrameSource):
+    """Animated test pattern rendered into a reused buffer.
+
+    A horizontal rainbow with a vertical brightness ramp that scrolls by `speed` pixels per
+    grab, so colors and motion change at a known rate.
+    """
+
+    def __init__(self, monitor_index=1, width=1920, height=1080, speed=8):
+        super().__init__(monitor_index)
+        self.speed = speed
+        self.offset = 0
+        phase = np.linspace(0.0, 2.0 * np.pi, width, endpoint=False)
+        rainbow = np.stack([np.sin(phase + shift) for shift in (4.0 * np.pi / 3.0, 2.0 * np.pi / 3.0, 0.0)], axis=-1)
+        ramp = np.linspace(1.0, 0.2, height)[:, None, None]
+        self.pattern = np.rint(127.5 * (1.0 + rainbow)[None, :, :] * ramp).astype(np.uint8)
+        self.frame = np.empty_like(self.pattern)
+
+    def grab(self):
+        width = self.pattern.shape[1]
+        shift = self.offset % width
+        self.frame[:, :width - shift] = self.pattern[:, shift:]
+        self.frame[:, width - shift:] = self.pattern[:, :shift]
+        self.offset += self.speed
+        return self.frame
+
+
+        ########################
+        #   RECORD AND REPLAY  #
+        ########################
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+RECORD_CHUNK = 64  # Frames a recording file grows by when it is full
+
+
+def _npy_header(count, shape):
+    """Version 1.0 .npy header for a (count, *shape) uint8 array.
+
+    The frame count is right-aligned in a fixed-width field, so the header keeps its length
+    and can be rewritten in place once the final count is known.
+    """
+    dims = ", ".join(str(size) for size in shape)
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': (%12d, %s), }" % (count, dims)
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    return NPY_MAGIC + len(header).to_bytes(2, "little") + header
+
+
+def timestamps_path(path):
+    """Sidecar file holding the capture timestamps of a recording."""
+    return os.path.splitext(path)[0] + ".times.npy"
+
+
+def info_path(path):
+    """Sidecar file holding the size of the captured frames of a recording."""
+    return os.path.splitext(path)[0] + ".info.json"
+
+
+class FrameRecorder:
+    """Record frames to a memory-mapped .npy file for ReplayFrameSource.
+
+    The file grows by RECORD_CHUNK frames whenever it is full and frames are copied straight
+    into a memory map of it. close() trims the file and writes the frame count into the
+    header, so a recording is a plain (count, height, width, 3) uint8 array that np.load()
+    can memory-map. Capture timestamps (seconds, perf_counter) go to <name>.times.npy and
+    the size of the captured frames to <name>.info.json. With a divisor of 2, 4 or 8 frames
+    are downscaled like the analysis image before they are written; ReplayFrameSource
+    scales them back up to the captured size, so segment coordinates still match.
+    """
+
+    def __init__(self, path, divisor=1):
+        self.path = path
+        self.divisor = divisor
+        self.file = open(path, "w+b")
+        self.shape = None
+        self.source_size = None  # (width, height) of the captured frames
+        self.header_size = 0
+        self.frames = None  # Memory map of the frames allocated in the file so far
+        self.timestamps = []
+
+    def _map(self, capacity):
+        """Resize the file for capacity frames and map them."""
+        self.frames = None  # Release the old map first; mapped files cannot be resized on Windows
+        self.file.truncate(self.header_size + capacity * int(np.prod(self.shape)))
+        self.frames = np.memmap(self.file, dtype=np.uint8, mode="r+", offset=self.header_size,
+                                shape=(capacity,) + self.shape)
+
+    def write(self, frame, timestamp=None):
+        """Append one HxWx3 (or HxWx4) BGR frame; every frame must have the same size."""
+        size = (frame.shape[1], frame.shape[0])
+        if self.divisor > 1:
+            from time_numpy import build_analysis_image
+            frame = build_analysis_image(frame, self.divisor)
+        frame = frame[:, :, :3]
+        if self.shape is None:
+            self.shape, self.source_size = frame.shape, size
+            header = _npy_header(0, self.shape)
+            self.header_size = len(header)
+            self.file.write(header)
+            self._map(RECORD_CHUNK)
+        elif frame.shape != self.shape or size != self.source_size:
+            raise ValueError(f"Frame size {size} differs from the recording's {self.source_size}.")
+        count = len(self.timestamps)
+        if count == len(self.frames):
+            self.frames.flush()
+            self._map(count + RECORD_CHUNK)
+        self.frames[count] = frame
+        self.timestamps.append(time.perf_counter() if timestamp is None else timestamp)
+
+    def close(self):
+        """Trim the file, finalize the header with the frame count and write the sidecar files."""
+        if self.file.closed:
+            return
+        count = len(self.timestamps)
+        if self.frames is not None:
+            self.frames.flush()
+            self.frames = None
+            self.file.truncate(self.header_size + count * int(np.prod(self.shape)))
+            self.file.seek(0)
+            self.file.write(_npy_header(count, self.shape))
+        self.file.close()
+        np.save(timestamps_path(self.path), np.asarray(self.timestamps, dtype=np.float64))
+        if self.source_size is not None:
+            with open(info_path(self.path), "w") as file:
+                json.dump({"width": self.source_size[0], "height": self.source_size[1],
+                           "divisor": self.divisor}, file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingFrameSource(FrameSource):
+    """Pass frames through from another source while recording them with a FrameRecorder."""
+
+    def __init__(self, source, path, divisor=1):
+        super().__init__(source.monitor_index)
+        self.source = source
+        self.recorder = FrameRecorder(path, divisor)
+
+    def grab(self):
+        frame = self.source.grab()
+        if frame is not None:
+            self.recorder.write(frame, getattr(self.source, "frame_time", None))
+        return frame
+
+    def set_monitor(self, monitor_index):
+        super().set_monitor(monitor_index)
+        self.source.set_monitor(monitor_index)
+
+    def close(self):
+        self.recorder.close()
+        self.source.close()
+
+
+class ReplayFrameSource(FrameSource):
+    """Replay a FrameRecorder recording.
+
+    The recording is memory-mapped and grab() returns read-only views of it, so frames are
+    never copied. Downscaled recordings are the exception: their frames are scaled back up
+    to the captured size (nearest neighbor, into one reused buffer) so the segment layout
+    still matches. With realtime=True frames are paced by their recorded timestamps,
+    otherwise they are returned as fast as they are requested. At the end the recording
+    starts over if loop is set, and grab() returns None otherwise.
+    """
+
+    def __init__(self, monitor_index=1, path="recording.npy", realtime=True, loop=True):
+        super().__init__(monitor_index)
+        self.frames = np.load(path, mmap_mode="r")
+        if self.frames.ndim != 4 or self.frames.shape[3] != 3 or self.frames.dtype != np.uint8:
+            raise ValueError(f"{path} is not a frame recording.")
+        self.factor = 1
+        self.upscaled = None  # Reused output buffer for downscaled recordings
+        try:
+            with open(info_path(path), "r") as file:
+                info = json.load(file)
+            width, height = int(info["width"]), int(info["height"])
+        except (OSError, ValueError, KeyError, TypeError):
+            width, height = self.frames.shape[2], self.frames.shape[1]  # Older recordings: full size
+        rows, cols = self.frames.shape[1:3]
+        if (width, height) != (cols, rows):
+            factor = width // max(cols, 1)
+            if factor < 2 or (width // factor, height // factor) != (cols, rows):
+                raise ValueError(f"{path} holds {cols}x{rows} frames that are not a downscaled "
+                                 f"{width}x{height} capture.")
+            self.factor = factor
+            self.upscaled = np.empty((height, width, 3), dtype=np.uint8)
+        try:
+            self.timestamps = np.load(timestamps_path(path))
+        except OSError:
+            self.timestamps = None
+        if self.timestamps is None or len(self.timestamps) != len(self.frames):
+            self.timestamps = np.arange(len(self.frames)) / 30.0  # Assume 30 fps without timestamps
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0
+        self.start_time = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def grab(self):
+        if self.index >= len(self.frames):
+            if not self.loop or not len(self.frames):
+                return None
+            self.index = 0
+            self.start_time = None
+        if self.realtime:
+            offset = self.timestamps[self.index] - self.timestamps[0]
+            if self.start_time is None:
+                self.start_time = time.perf_counter()
+            delay = self.start_time + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        frame = self.frames[self.index]
+        self.index += 1
+        if self.upscaled is not None:
+            return upscale_frame(frame, self.factor, self.upscaled)
+        return frame
+
+
+def upscale_frame(frame, factor, out):
+    """Nearest-neighbor upscale of a frame by an integer factor into out.
+
+    Rows and columns of out beyond factor times the frame size repeat the last ones, like
+    the pixels build_analysis_image() drops when the captured size is not a multiple.
+    """
+    rows, cols = frame.shape[:2]
+    height, width = rows * factor, cols * factor
+    blocks = out[:height, :width]
+    step_y, step_x, step_c = blocks.strides
+    blocks = np.lib.stride_tricks.as_strided(blocks, shape=(rows, factor, cols, factor, 3),
+                                             strides=(step_y * factor, step_y, step_x * factor, step_x, step_c))
+    blocks[...] = frame[:, None, :, None]
+    out[height:, :width] = out[height - 1:height, :width]
+    out[:, width:] = out[:, width - 1:width]
+    return out
+
+
+        ########################
+        #    CAPTURE THREAD    #
+        ########################
+
+class CaptureThread(FrameSource):
+    """Capture another frame source on a background thread at a fixed rate.
+
+    Frames are copied into a small ring of preallocated, timestamped slots. grab() returns
+    the newest one and older frames are dropped. The slot handed out by grab() is not
+    written again until the next grab(), so it stays valid while it is analyzed; the
+    writer always has at least one other free slot. If the source raises, the thread stops
+    and grab() raises a RuntimeError from that exception instead of repeating the last frame.
+    """
+
+    def __init__(self, source, rate=30, slots=3):
+        super().__init__(source.monitor_index)
+        self.source = source
+        self.interval = 1.0 / max(rate, 1)
+        self.slots = [None] * max(slots, 3)
+        self.stamps = [0.0] * len(self.slots)
+        self.latest = -1  # Slot of the newest frame
+        self.reading = -1  # Slot handed out by the last grab()
+        self.frame_time = None  # perf_counter() timestamp of the frame returned by grab()
+        self.captured = 0  # Frames captured, including the dropped ones
+        self.error = None  # Exception raised by the source, which stopped the thread
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="CaptureThread", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_time = time.perf_counter()
+        while self.running:
+            try:
+                frame = self.source.grab()
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.running = False
+                    self.condition.notify_all()
+                return
+            stamp = time.perf_counter()
+            if frame is not None:
+                with self.condition:
+                    slot = next(i for i in range(len(self.slots)) if i != self.latest and i != self.reading)
+                buffer = self.slots[slot]
+                if buffer is None or buffer.shape != frame.shape:
+                    buffer = self.slots[slot] = np.empty(frame.shape, dtype=np.uint8)
+                np.copyto(buffer, frame)
+                with self.condition:
+                    self.stamps[slot] = stamp
+                    self.latest = slot
+                    self.captured += 1
+                    self.condition.notify_all()
+            next_time = max(next_time + self.interval, time.perf_counter())
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def grab(self, timeout=1.0):
+        """Return the newest frame, waiting for the first one, or None if none arrived in time.
+
+        Raises RuntimeError once the source has failed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest >= 0 or self.error is not None, timeout)
+            if self.error is not None:
+                raise RuntimeError(f"Frame capture stopped: {self.error}") from self.error
+            if self.latest < 0:
+                return None
+            self.reading = self.latest
+            self.frame_time = self.stamps[self.reading]
+            return self.slots[self.reading]
+
+    def frame_age(self):
+        """Seconds since the frame returned by the last grab() was captured."""
+        return None if self.frame_time is None else time.perf_counter() - self.frame_time
+
+    def set_monitor(self, monitor_index):
+        super().set_monitor(monitor_index)
+        self.source.set_monitor(monitor_index)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.source.close()
+
+
+SOURCES = {
+    "mss": MssFrameSource,
+    "xshm": XShmFrameSource,
+    "synthetic": SyntheticFrameSource,
+    "replay": ReplayFrameSource,
+}
+
+
+def create_frame_source(kind, monitor_index=1, **options):
+    """Create a frame source by name ("mss", "xshm", "synthetic" or "replay").
+
+    Extra keyword options are passed to the source, e.g. path= for "replay".
+    """
+    try:
+        source_class = SOURCES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown frame source: {kind}") from None
+    return source_class(monitor_index, **options)
+
+
+def open_frame_source(kind="engine", monitor_index=1, rate=0, record_to=None, **options):
+    """Open the frame source chain for the capture settings, or None for the engine's own capture.
+
+    kind is a SOURCES name or "engine". With record_to set, frames are also recorded to that
+    file, and with a rate above 0 the source runs on a CaptureThread; both use mss if the
+    engine's own capture was selected. Sources that cannot be opened fall back to that too.
+    """
+    source = None
+    if kind != "engine":
+        try:
+            source = create_frame_source(kind, monitor_index, **options)
+        except (OSError, ValueError) as e:
+            print(f"Capture source '{kind}' unavailable, using the engine's capture: {e}")
+    if record_to and kind != "replay":
+        try:
+            source = RecordingFrameSource(source or create_frame_source("mss", monitor_index), record_to)
+        except OSError as e:
+            print(f"Cannot record frames to '{record_to}': {e}")
+    if rate > 0:
+        source = CaptureThread(source or create_frame_source("mss", monitor_index), rate)
+    return source
@@ -0,0 +1,132 @@
+"""Shared result buffers and the changed/forget protocol of the analysis child."""
+import json
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import analysis_process
+import frame_sources
+import time_numpy
+
+
+def test_double_buffer_round_trip():
+    writer = analysis_process.SharedDoubleBuffer((4, 3), np.int32)
+    reader = analysis_process.SharedDoubleBuffer((4, 3), np.int32, writer.name)
+    try:
+        assert reader.read() is None
+        assert writer.write(np.arange(6).reshape(2, 3), stamp=1.5)
+        seq, value, stamp = reader.read()
+        assert (seq, stamp) == (1, 1.5)
+        np.testing.assert_array_equal(value, np.arange(6).reshape(2, 3))
+        assert reader.read(after=seq) is None
+
+        for n in range(2, 5):  # Both slots are reused; the newest value wins
+            assert writer.write(np.full((n, 3), n), stamp=float(n))
+        seq, value, stamp = reader.read(after=1)
+        assert (seq, value.shape, stamp) == (4, (4, 3), 4.0)
+        assert (value == 4).all()
+        value[:] = 0  # A copy, not a view of the shared slot
+        assert (reader.read()[1] == 4).all()
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_double_buffer_rejects_values_over_capacity():
+    buffer = analysis_process.SharedDoubleBuffer((4, 3), np.int32)
+    try:
+        assert buffer.write(np.ones((2, 3)))
+        assert not buffer.write(np.ones((5, 3)))
+        assert not buffer.write(np.ones((2, 4)))
+        assert not buffer.write(np.ones(4))
+        assert buffer.sequence == 1
+        np.testing.assert_array_equal(buffer.read()[1], np.ones((2, 3)))
+    finally:
+        buffer.close()
+
+
+@pytest.fixture
+def analysis_child(tmp_path, monkeypatch):
+    """run_analysis on a thread, replaying a two-segment frame, with the UI side's buffers."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "settings.json").write_text(json.dumps({"capture_regions": False}))
+    layout = {"1": {"x": 0, "y": 0, "width": 16, "height": 16},
+              "2": {"x": 16, "y": 0, "width": 16, "height": 16}}
+    (tmp_path / "segments.json").write_text(json.dumps(layout))
+    frame = np.zeros((16, 32, 3), np.uint8)
+    frame[:, :16] = (0, 0, 200)
+    frame[:, 16:] = (200, 0, 0)
+    recorder = frame_sources.FrameRecorder(str(tmp_path / "frames.npy"))
+    recorder.write(frame, 0.0)
+    recorder.close()
+
+    results = analysis_process.SharedDoubleBuffer((time_numpy.MAX_SEGMENTS,), time_numpy.SEGMENT_DTYPE)
+    control_memory = shared_memory.SharedMemory(create=True, size=analysis_process.CONTROL_DTYPE.itemsize)
+    control = np.ndarray((), dtype=analysis_process.CONTROL_DTYPE, buffer=control_memory.buf)
+    control["monitor_index"] = 1
+    control["letterbox"] = 1
+    control["acked"] = 0
+    control["forget"] = 0
+    stop = threading.Event()
+    names = {"results": results.name, "control": control_memory.name}
+    capture = {"kind": "replay", "path": str(tmp_path / "frames.npy"), "realtime": False}
+    thread = threading.Thread(target=analysis_process.run_analysis, args=(names, "numpy", capture, stop))
+    thread.start()
+    try:
+        yield results, control
+    finally:
+        stop.set()
+        thread.join(timeout=5.0)
+        del control
+        control_memory.close()
+        control_memory.unlink()
+        results.close()
+        time_numpy.set_letterbox_detection(True)
+
+
+def read_until(results, control, condition, ack=True, timeout=5.0):
+    """Read results (acknowledging them if ack) until one satisfies condition; return its changed segments."""
+    deadline = time.perf_counter() + timeout
+    seq = 0
+    while time.perf_counter() < deadline:
+        latest = results.read(seq)
+        if latest is None:
+            time.sleep(0.005)
+            continue
+        seq, segments, _ = latest
+        if ack:
+            control["acked"] = seq
+        changed = set(segments["segment"][segments["changed"] != 0].tolist())
+        if condition(seq, changed):
+            return changed
+    raise AssertionError("No matching result from the analysis child")
+
+
+def test_changes_are_reported_until_acknowledged(analysis_child):
+    results, control = analysis_child
+    assert read_until(results, control, lambda seq, changed: True, ack=False) == {1, 2}
+    # Unread changes stay pending while the UI does not acknowledge any result.
+    assert read_until(results, control, lambda seq, changed: seq >= 4, ack=False) == {1, 2}
+    assert read_until(results, control, lambda seq, changed: not changed) == set()
+
+
+def test_forget_reports_a_segment_again(analysis_child):
+    results, control = analysis_child
+    read_until(results, control, lambda seq, changed: not changed)
+    control["forget"][2] = 1
+    assert read_until(results, control, lambda seq, changed: bool(changed)) == {2}
+    assert not control["forget"].any()
+
+
+def test_letterbox_flag_reaches_the_engine(analysis_child):
+    results, control = analysis_child
+    read_until(results, control, lambda seq, changed: True)
+    assert time_numpy.enable_letterbox_detection
+    control["letterbox"] = 0
+    deadline = time.perf_counter() + 5.0
+    while time_numpy.enable_letterbox_detection and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    assert not time_numpy.enable_letterbox_detection
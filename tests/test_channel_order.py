@@ -0,0 +1,66 @@
+"""Channel order: pure BGR and BGRA frames give the hue of their color on every segment."""
+import base64
+import json
+
+import numpy as np
+import pytest
+
+import time_numpy
+
+# Device HSV (hue 0-360, saturation and value 0-1000) of each pure color, keyed by its BGR pixel.
+PURE_COLORS = {
+    "red": ((0, 0, 255), (0, 1000, 1000)),
+    "green": ((0, 255, 0), (120, 1000, 1000)),
+    "blue": ((255, 0, 0), (240, 1000, 1000)),
+}
+# DPS 61 payloads of segment 1 set to each color, written out byte by byte.
+PAYLOADS = {
+    "red": "00 02 00 14 01 00 00 03 e8 03 e8 81 14",
+    "green": "00 02 00 14 01 00 78 03 e8 03 e8 81 14",
+    "blue": "00 02 00 14 01 00 f0 03 e8 03 e8 81 14",
+}
+
+
+def load_engine(name):
+    if name == "numpy":
+        return time_numpy
+    bindings = pytest.importorskip("time_bindings")
+    if not hasattr(bindings, "Processor"):
+        pytest.skip("time_bindings is an outdated build")
+    return bindings
+
+
+@pytest.fixture
+def layout_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "settings.json").write_text(json.dumps({"capture_regions": False}))
+    layout = {str(segment): {"x": 64 * (segment - 1), "y": 0, "width": 64, "height": 96} for segment in (1, 2, 3)}
+    (tmp_path / "segments.json").write_text(json.dumps(layout))
+    return tmp_path
+
+
+def pure_frame(bgr, alpha):
+    frame = np.empty((96, 192, 4 if alpha else 3), np.uint8)
+    frame[..., :3] = bgr
+    if alpha:
+        frame[..., 3] = 255
+    return frame
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+@pytest.mark.parametrize("alpha", [False, True], ids=["bgr", "bgra"])
+@pytest.mark.parametrize("color", sorted(PURE_COLORS))
+def test_pure_colors_keep_their_hue(layout_dir, engine, alpha, color):
+    module = load_engine(engine)
+    bgr, hsv = PURE_COLORS[color]
+    processor = module.Processor()
+    try:
+        segments, commands = processor.analyze(pure_frame(bgr, alpha))
+    finally:
+        processor.close()
+    assert sorted(segments["segment"].tolist()) == [1, 2, 3]
+    for record in segments:
+        assert (int(record["h"]), int(record["s"]), int(record["v"])) == hsv
+    payload = module.encodeCommand(1, *hsv)
+    assert base64.b64decode(payload) == bytes.fromhex(PAYLOADS[color])
+    assert commands["61_1"] == payload
@@ -0,0 +1,82 @@
+"""CIELAB conversion and the CIEDE2000 difference against published values."""
+import numpy as np
+import pytest
+
+import time_numpy
+
+# Test data of Sharma, Wu and Dalal, "The CIEDE2000 color-difference formula: implementation
+# notes, supplementary test data, and mathematical observations" (2005), Table 1:
+# (L1, a1, b1), (L2, a2, b2), delta E 2000. The pairs cover the hue wrap-around and both
+# branches of the mean hue.
+SHARMA_PAIRS = [
+    ((50.0000, 2.6772, -79.7751), (50.0000, 0.0000, -82.7485), 2.0425),
+    ((50.0000, 3.1571, -77.2803), (50.0000, 0.0000, -82.7485), 2.8615),
+    ((50.0000, 2.8361, -74.0200), (50.0000, 0.0000, -82.7485), 3.4412),
+    ((50.0000, -1.3802, -84.2814), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, -1.1848, -84.8006), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, -0.9009, -85.5211), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, 0.0000, 0.0000), (50.0000, -1.0000, 2.0000), 2.3669),
+    ((50.0000, -1.0000, 2.0000), (50.0000, 0.0000, 0.0000), 2.3669),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0009), 7.1792),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0010), 7.1792),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0011), 7.2195),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0012), 7.2195),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0009, -2.4900), 4.8045),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0010, -2.4900), 4.8045),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0011, -2.4900), 4.7461),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 0.0000, -2.5000), 4.3065),
+    ((50.0000, 2.5000, 0.0000), (73.0000, 25.0000, -18.0000), 27.1492),
+    ((50.0000, 2.5000, 0.0000), (61.0000, -5.0000, 29.0000), 22.8977),
+    ((50.0000, 2.5000, 0.0000), (56.0000, -27.0000, -3.0000), 31.9030),
+    ((50.0000, 2.5000, 0.0000), (58.0000, 24.0000, 15.0000), 19.4535),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.1736, 0.5854), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.2972, 0.0000), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 1.8634, 0.5757), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.2592, 0.3350), 1.0000),
+    ((60.2574, -34.0099, 36.2677), (60.4626, -34.1751, 39.4387), 1.2644),
+    ((63.0109, -31.0961, -5.8663), (62.8187, -29.7946, -4.0864), 1.2630),
+    ((61.2901, 3.7196, -5.3901), (61.4292, 2.2480, -4.9620), 1.8731),
+    ((35.0831, -44.1164, 3.7933), (35.0232, -40.0716, 1.5901), 1.8645),
+    ((22.7233, 20.0904, -46.6940), (23.0331, 14.9730, -42.5619), 2.0373),
+    ((36.4612, 47.8580, 18.3852), (36.2715, 50.5065, 21.2231), 1.4146),
+    ((90.8027, -2.0831, 1.4410), (91.1528, -1.6435, 0.0447), 1.4441),
+    ((90.9257, -0.5406, -0.9208), (88.6381, -0.8985, -0.7239), 1.5381),
+    ((6.7747, -0.2908, -2.4247), (5.8714, -0.0985, -2.2286), 0.6377),
+    ((2.0776, 0.0795, -1.1350), (0.9033, -0.0636, -0.5514), 0.9082),
+]
+
+# sRGB colors and their CIELAB (D65) values.
+SRGB_LAB = [
+    ((0, 0, 0), (0.0, 0.0, 0.0)),
+    ((255, 255, 255), (100.0, 0.0, 0.0)),
+    ((128, 128, 128), (53.585, 0.0, 0.0)),
+    ((255, 0, 0), (53.241, 80.092, 67.203)),
+    ((0, 255, 0), (87.735, -86.183, 83.179)),
+    ((0, 0, 255), (32.297, 79.188, -107.860)),
+    ((255, 255, 0), (97.139, -21.554, 94.478)),
+]
+
+
+def test_delta_e_2000_matches_the_sharma_pairs():
+    lab1 = np.array([pair[0] for pair in SHARMA_PAIRS])
+    lab2 = np.array([pair[1] for pair in SHARMA_PAIRS])
+    expected = np.array([pair[2] for pair in SHARMA_PAIRS])
+    np.testing.assert_allclose(time_numpy.delta_e_2000(lab1, lab2), expected, atol=5e-5)
+    # The formula is symmetric, which exercises the other side of every hue branch.
+    np.testing.assert_allclose(time_numpy.delta_e_2000(lab2, lab1), expected, atol=5e-5)
+
+
+def test_identical_colors_have_no_difference():
+    lab = np.array([pair[0] for pair in SHARMA_PAIRS])
+    np.testing.assert_array_equal(time_numpy.delta_e_2000(lab, lab), 0.0)
+
+
+@pytest.mark.parametrize("rgb, lab", SRGB_LAB)
+def test_rgb_to_lab_matches_known_values(rgb, lab):
+    np.testing.assert_allclose(time_numpy.rgb_to_lab(np.array([rgb], np.uint8))[0], lab, atol=0.01)
+
+
+def test_delta_e_76_is_the_lab_distance():
+    lab1 = np.array([[50.0, 2.5, 0.0]])
+    lab2 = np.array([[53.0, -1.5, 0.0]])
+    np.testing.assert_allclose(time_numpy.delta_e_76(lab1, lab2), [5.0])
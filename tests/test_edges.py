@@ -0,0 +1,30 @@
+"""Edge intensity of the NumPy engine against the native engine's OpenCV operations."""
+import numpy as np
+import pytest
+
+import time_numpy
+
+
+def high_contrast_frame():
+    """Black and white checkerboard with a white diagonal half, so both Sobel axes saturate."""
+    rows, cols = np.indices((48, 64))
+    frame = np.where((rows // 4 + cols // 4) % 2 == 0, 255, 0).astype(np.uint8)
+    frame[rows > cols] = 255
+    return frame
+
+
+def test_gradient_magnitude_is_a_uint8_value():
+    gradient = time_numpy.gradient_magnitude(high_contrast_frame().astype(np.float64))
+    assert 0.0 <= gradient.min() and gradient.max() <= 255.0
+    assert np.array_equal(gradient, np.rint(gradient))
+
+
+def test_gradient_magnitude_matches_opencv():
+    cv2 = pytest.importorskip("cv2")
+    frame = high_contrast_frame()
+    # The native MotionBuffer's edge map.
+    magnitude_x = cv2.convertScaleAbs(cv2.Sobel(frame, cv2.CV_16S, 1, 0), alpha=0.125)
+    magnitude_y = cv2.convertScaleAbs(cv2.Sobel(frame, cv2.CV_16S, 0, 1), alpha=0.125)
+    expected = cv2.add(magnitude_x, magnitude_y)
+    gradient = time_numpy.gradient_magnitude(frame.astype(np.float64))
+    assert np.array_equal(gradient, expected.astype(np.float64))
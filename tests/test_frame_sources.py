@@ -0,0 +1,128 @@
+"""Frame sources and the capture thread."""
+import types
+
+import numpy as np
+import pytest
+
+import frame_sources
+
+
+class FakeSession:
+    """Stands in for an mss session, returning BGRA screenshots of a counter color."""
+
+    def __init__(self, width=32, height=16):
+        self.width, self.height = width, height
+        self.count = 0
+
+    def grab(self, monitor):
+        self.count += 1
+        pixels = np.full((self.height, self.width, 4), self.count, dtype=np.uint8)
+        pixels[..., 3] = 255
+        return types.SimpleNamespace(raw=bytearray(pixels.tobytes()), width=self.width, height=self.height)
+
+
+def test_frame_source_is_abstract():
+    with pytest.raises(TypeError):
+        frame_sources.FrameSource()
+
+
+def test_mss_source_reuses_its_frame_buffer(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(frame_sources, "screen_session", lambda: session)
+    monkeypatch.setattr(frame_sources, "monitor_geometry", lambda index: {})
+    source = frame_sources.MssFrameSource()
+    first = source.grab()
+    assert first.shape == (16, 32, 3) and first.flags.c_contiguous
+    assert (first == 1).all()
+    second = source.grab()
+    assert second is first
+    assert (second == 2).all()
+
+
+class FailingSource(frame_sources.FrameSource):
+    """Returns a few frames, then raises like a capture that lost its display."""
+
+    def __init__(self, frames=2):
+        super().__init__()
+        self.frames = frames
+
+    def grab(self):
+        if self.frames == 0:
+            raise OSError("display lost")
+        self.frames -= 1
+        return np.zeros((4, 4, 3), np.uint8)
+
+
+def test_capture_thread_reports_source_errors():
+    thread = frame_sources.CaptureThread(FailingSource(), rate=200)
+    try:
+        thread.thread.join(timeout=2.0)
+        assert not thread.thread.is_alive()
+        with pytest.raises(RuntimeError) as raised:
+            thread.grab()
+        assert isinstance(raised.value.__cause__, OSError)
+    finally:
+        thread.close()
+
+
+def test_capture_thread_error_before_first_frame():
+    thread = frame_sources.CaptureThread(FailingSource(frames=0), rate=200)
+    try:
+        with pytest.raises(RuntimeError):
+            thread.grab(timeout=2.0)
+    finally:
+        thread.close()
+
+
+def synthetic_frames(count, height=30, width=44):
+    """Frames with a per-frame gradient so every pixel and frame differ."""
+    rows, cols = np.mgrid[:height, :width]
+    return [np.dstack([(rows * 7 + index) % 256, (cols * 5 + index) % 256, (rows + cols + 3 * index) % 256])
+            .astype(np.uint8) for index in range(count)]
+
+
+def test_record_and_replay_round_trip(tmp_path):
+    path = str(tmp_path / "recording.npy")
+    frames = synthetic_frames(frame_sources.RECORD_CHUNK + 6)  # Forces the file to grow once
+    times = [0.5 + index / 60.0 for index in range(len(frames))]
+    recorder = frame_sources.FrameRecorder(path)
+    for frame, timestamp in zip(frames, times):
+        recorder.write(frame, timestamp)
+    recorder.close()
+
+    assert np.load(path).shape == (len(frames), 30, 44, 3)
+    replay = frame_sources.ReplayFrameSource(path=path, realtime=False, loop=False)
+    np.testing.assert_array_equal(replay.timestamps, times)
+    for frame in frames:
+        np.testing.assert_array_equal(replay.grab(), frame)
+    assert replay.grab() is None
+
+
+def test_downscaled_recording_replays_at_the_captured_size(tmp_path):
+    from time_numpy import build_analysis_image
+    path = str(tmp_path / "recording.npy")
+    frames = synthetic_frames(3, height=31, width=45)  # Not a multiple of the divisor
+    recorder = frame_sources.FrameRecorder(path, divisor=2)
+    for index, frame in enumerate(frames):
+        recorder.write(np.dstack([frame, np.full(frame.shape[:2], 255, np.uint8)]), float(index))
+    recorder.close()
+
+    assert np.load(path).shape == (3, 15, 22, 3)
+    replay = frame_sources.ReplayFrameSource(path=path, realtime=False, loop=False)
+    np.testing.assert_array_equal(replay.timestamps, [0.0, 1.0, 2.0])
+    for frame in frames:
+        replayed = replay.grab()
+        assert replayed.shape == frame.shape
+        np.testing.assert_array_equal(build_analysis_image(replayed, 2), build_analysis_image(frame, 2))
+        np.testing.assert_array_equal(replayed[:2, :2], np.broadcast_to(build_analysis_image(frame, 2)[0, 0], (2, 2, 3)))
+
+
+def test_replay_refuses_a_recording_of_another_size(tmp_path):
+    path = str(tmp_path / "recording.npy")
+    recorder = frame_sources.FrameRecorder(path)
+    recorder.write(synthetic_frames(1)[0], 0.0)
+    recorder.close()
+    with open(frame_sources.info_path(path), "w") as file:
+        file.write('{"width": 50, "height": 30}')
+    with pytest.raises(ValueError):
+        frame_sources.ReplayFrameSource(path=path, realtime=False)
@@ -0,0 +1,48 @@
+"""The label-map analysis mode against per-segment analysis in the NumPy engine."""
+import json
+
+import numpy as np
+
+import time_numpy
+
+# Overlapping rectangles, including one nested inside another and one sharing an edge.
+SEGMENTS = {
+    1: (0, 0, 96, 64),
+    2: (64, 32, 96, 64),
+    3: (80, 40, 16, 16),
+    4: (160, 0, 32, 120),
+    5: (0, 64, 192, 56),
+}
+
+
+def noisy_frame(seed=7, width=192, height=120):
+    """Random colors with a few large hue patches, so every segment has a clear dominant hue."""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frame[:60, :100] = (30, 60, 220)
+    frame[40:, 120:] = (200, 80, 20)
+    return frame
+
+
+def test_label_map_matches_per_segment_colors():
+    frame = noisy_frame()
+    ids, colors, _ = time_numpy.analyze_segments(frame, SEGMENTS)
+    label_map = time_numpy.LabelMap(SEGMENTS, frame.shape)
+    assert label_map.ids == ids
+    assert np.array_equal(label_map.dominant_colors(label_map.pixels(frame)), colors)
+
+
+def test_processor_modes_agree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    layout = {str(segment): {"x": x, "y": y, "width": w, "height": h}
+              for segment, (x, y, w, h) in SEGMENTS.items()}
+    (tmp_path / "segments.json").write_text(json.dumps(layout))
+    results = {}
+    for mode in ("roi", "labelmap"):
+        (tmp_path / "settings.json").write_text(json.dumps({"analysis_mode": mode, "capture_regions": False}))
+        processor = time_numpy.Processor()
+        try:
+            results[mode], _ = processor.analyze(noisy_frame())
+        finally:
+            processor.close()
+    assert np.array_equal(results["roi"], results["labelmap"])
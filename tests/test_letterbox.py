@@ -0,0 +1,135 @@
+"""Letterbox detection: the cached content rectangle and its hysteresis."""
+import json
+
+import numpy as np
+import pytest
+
+import time_numpy
+
+ROWS, COLS = 160, 240
+
+
+def picture(top=0, bottom=0, left=0, right=0, level=128):
+    """A gray picture inside black bars of the given widths."""
+    image = np.zeros((ROWS, COLS, 3), np.uint8)
+    image[top:ROWS - bottom, left:COLS - right] = level
+    return image
+
+
+def load_engine(name):
+    if name == "numpy":
+        return time_numpy
+    bindings = pytest.importorskip("time_bindings")
+    if not hasattr(bindings, "Processor"):
+        pytest.skip("time_bindings is an outdated build")
+    return bindings
+
+
+LETTERBOXED = picture(top=40, bottom=40)
+FULL = picture()
+
+
+def test_detects_the_picture_between_bars():
+    tracker = time_numpy.LetterboxTracker()
+    assert tracker.update(LETTERBOXED) == (0, 40, COLS, 80)
+    assert tracker.current() == (0, 40, COLS, 80)
+
+
+def test_brief_changes_do_not_flicker_the_bars():
+    tracker = time_numpy.LetterboxTracker()
+    tracker.update(LETTERBOXED)
+    for frames in range(1, time_numpy.LETTERBOX_CONFIRM):
+        for _ in range(frames):
+            assert tracker.update(FULL) == (0, 40, COLS, 80)
+        assert tracker.update(LETTERBOXED) == (0, 40, COLS, 80)
+
+
+def test_dark_frames_keep_the_bars():
+    tracker = time_numpy.LetterboxTracker()
+    tracker.update(LETTERBOXED)
+    for _ in range(2 * time_numpy.LETTERBOX_CONFIRM):
+        assert tracker.update(picture(level=0)) == (0, 40, COLS, 80)
+    assert tracker.update(LETTERBOXED) == (0, 40, COLS, 80)
+
+
+def test_bars_are_redetected_after_they_disappear_and_return():
+    tracker = time_numpy.LetterboxTracker()
+    tracker.update(LETTERBOXED)
+    for _ in range(time_numpy.LETTERBOX_CONFIRM - 1):
+        assert tracker.update(FULL) == (0, 40, COLS, 80)
+    assert tracker.update(FULL) == (0, 0, COLS, ROWS)
+    for _ in range(time_numpy.LETTERBOX_CONFIRM - 1):
+        assert tracker.update(LETTERBOXED) == (0, 0, COLS, ROWS)
+    assert tracker.update(LETTERBOXED) == (0, 40, COLS, 80)
+
+
+def test_full_detection_only_runs_when_the_edges_change(monkeypatch):
+    calls = []
+    detect = time_numpy.detect_content_rect
+    monkeypatch.setattr(time_numpy, "detect_content_rect", lambda *args: calls.append(1) or detect(*args))
+    tracker = time_numpy.LetterboxTracker()
+    tracker.update(LETTERBOXED)
+    for _ in range(time_numpy.LETTERBOX_INTERVAL - 1):
+        tracker.update(LETTERBOXED)
+    assert len(calls) == 1
+    tracker.update(LETTERBOXED)  # Periodic re-evaluation
+    assert len(calls) == 2
+    tracker.update(FULL)  # The rows outside the cached edges stopped being black
+    assert len(calls) == 3
+
+
+def test_a_new_frame_size_resets_the_cache():
+    tracker = time_numpy.LetterboxTracker()
+    tracker.update(LETTERBOXED)
+    assert tracker.update(FULL[::2, ::2]) == (0, 0, COLS // 2, ROWS // 2)
+
+
+def test_letterbox_and_pillarbox_bars_are_detected_together():
+    rect, conclusive = time_numpy.detect_content_rect(picture(top=40, bottom=40, left=30, right=30))
+    assert conclusive and rect == (30, 40, COLS - 60, ROWS - 80)
+
+
+def test_segments_are_remapped_into_both_bars():
+    quadrants = {1: (0, 0, 120, 80), 2: (120, 0, 120, 80), 3: (0, 80, 120, 80), 4: (120, 80, 120, 80)}
+    remapped = time_numpy.remap_segments(quadrants, (30, 40, 180, 80), (COLS, ROWS))
+    assert remapped == {1: (30, 40, 90, 40), 2: (120, 40, 90, 40), 3: (30, 80, 90, 40), 4: (120, 80, 90, 40)}
+
+
+QUADRANT_BGR = {1: (0, 0, 200), 2: (0, 200, 0), 3: (200, 0, 0), 4: (0, 200, 200)}
+
+
+def quadrant_picture(rows, cols, top=0, left=0):
+    """Four colored quadrants inside black bars top/bottom and left/right."""
+    image = np.zeros((rows, cols, 3), np.uint8)
+    inner_rows, inner_cols = rows - 2 * top, cols - 2 * left
+    mid_y, mid_x = top + inner_rows // 2, left + inner_cols // 2
+    image[top:mid_y, left:mid_x] = QUADRANT_BGR[1]
+    image[top:mid_y, mid_x:cols - left] = QUADRANT_BGR[2]
+    image[mid_y:rows - top, left:mid_x] = QUADRANT_BGR[3]
+    image[mid_y:rows - top, mid_x:cols - left] = QUADRANT_BGR[4]
+    return image
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+def test_processor_reads_segments_inside_both_bars(tmp_path, monkeypatch, engine):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "settings.json").write_text(json.dumps({"capture_regions": False}))
+    rows, cols = 320, 480
+    layout = {str(segment): {"x": x, "y": y, "width": cols // 2, "height": rows // 2}
+              for segment, (x, y) in {1: (0, 0), 2: (cols // 2, 0), 3: (0, rows // 2), 4: (cols // 2, rows // 2)}.items()}
+    (tmp_path / "segments.json").write_text(json.dumps(layout))
+    module = load_engine(engine)
+    module.set_letterbox_detection(True)
+
+    def analyze(image):
+        processor = module.Processor()
+        try:
+            segments, _ = processor.analyze(image)
+        finally:
+            processor.close()
+        return {int(r["segment"]): (int(r["h"]), int(r["s"]), int(r["v"])) for r in segments}
+
+    barred = analyze(quadrant_picture(rows, cols, top=64, left=80))
+    full = analyze(quadrant_picture(rows, cols))
+    assert barred == full
+    assert len({hsv for hsv in full.values()}) == 4
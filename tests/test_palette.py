@@ -0,0 +1,83 @@
+"""The k-means palette color method on two-color frames."""
+import json
+
+import numpy as np
+import pytest
+
+import time_numpy
+
+MAJORITY = (30, 60, 200)  # BGR
+MINORITY = (200, 120, 10)
+
+
+def load_engine(name):
+    if name == "numpy":
+        return time_numpy
+    bindings = pytest.importorskip("time_bindings")
+    if not hasattr(bindings, "Processor"):
+        pytest.skip("time_bindings is an outdated build")
+    return bindings
+
+
+def two_color_pixels(majority, minority, count=400, share=0.75):
+    pixels = np.empty((count, 3), np.uint8)
+    split = int(count * share)
+    pixels[:split] = majority
+    pixels[split:] = minority
+    return pixels
+
+
+def seeded(pixels, labels, count):
+    clusters = time_numpy.settings["palette_clusters"]
+    return np.stack([time_numpy.palette_seeds(pixels[labels == i], clusters) for i in range(count)])
+
+
+def test_palette_returns_the_dominant_cluster_of_each_segment():
+    pixels = np.concatenate([two_color_pixels(MAJORITY, MINORITY), two_color_pixels(MINORITY, MAJORITY)])
+    labels = np.repeat([0, 1], 400)
+    colors, centroids = time_numpy.palette_colors(pixels, labels, 2, seeded(pixels, labels, 2),
+                                                  time_numpy.PALETTE_MAX_ITERATIONS)
+    assert [tuple(color) for color in colors.tolist()] == [MAJORITY, MINORITY]
+
+    # Warm-started from these palettes, one iteration is enough for the next frame.
+    colors, _ = time_numpy.palette_colors(pixels, labels, 2, centroids, 1)
+    assert [tuple(color) for color in colors.tolist()] == [MAJORITY, MINORITY]
+
+
+def test_palette_follows_the_majority_when_it_changes():
+    pixels = two_color_pixels(MAJORITY, MINORITY)
+    labels = np.zeros(len(pixels), np.int64)
+    _, centroids = time_numpy.palette_colors(pixels, labels, 1, seeded(pixels, labels, 1), 8)
+    flipped = two_color_pixels(MINORITY, MAJORITY)
+    colors, _ = time_numpy.palette_colors(flipped, labels, 1, centroids, 2)
+    assert tuple(colors[0].tolist()) == MINORITY
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+def test_processor_palette_mode_picks_the_dominant_color(tmp_path, monkeypatch, engine):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "settings.json").write_text(json.dumps({"capture_regions": False, "color_method": "palette"}))
+    (tmp_path / "segments.json").write_text(json.dumps({"1": {"x": 0, "y": 0, "width": 64, "height": 64}}))
+    frame = np.empty((64, 64, 3), np.uint8)
+    frame[:, :48] = MAJORITY
+    frame[:, 48:] = MINORITY
+    module = load_engine(engine)
+
+    def analyze(image):
+        processor = module.Processor()
+        try:
+            segments, _ = processor.analyze(image)
+        finally:
+            processor.close()
+        return tuple(int(segments[channel][0]) for channel in ("r", "g", "b", "h", "s", "v"))
+
+    try:
+        # Segment colors are post-processed, so compare with frames of a single color.
+        mixed = analyze(frame)
+        majority = analyze(np.broadcast_to(np.array(MAJORITY, np.uint8), frame.shape).copy())
+        minority = analyze(np.broadcast_to(np.array(MINORITY, np.uint8), frame.shape).copy())
+    finally:
+        # Settings are module globals of the engine; restore the default method for other tests.
+        (tmp_path / "settings.json").write_text(json.dumps({"color_method": "histogram"}))
+        module.Processor().close()
+    assert mixed == majority != minority
@@ -0,0 +1,62 @@
+"""The Processor's in-memory previous colors: read-only view and forget()."""
+import json
+
+import numpy as np
+import pytest
+
+import time_numpy
+
+
+def load_engine(name):
+    if name == "numpy":
+        return time_numpy
+    bindings = pytest.importorskip("time_bindings")
+    if not hasattr(bindings, "Processor"):
+        pytest.skip("time_bindings is an outdated build")
+    return bindings
+
+
+@pytest.fixture
+def layout_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "settings.json").write_text(json.dumps({"capture_regions": False}))
+    layout = {"1": {"x": 0, "y": 0, "width": 64, "height": 64},
+              "2": {"x": 64, "y": 0, "width": 64, "height": 64}}
+    (tmp_path / "segments.json").write_text(json.dumps(layout))
+    return tmp_path
+
+
+def frame():
+    image = np.zeros((64, 128, 3), np.uint8)
+    image[:, :64] = (0, 0, 200)
+    image[:, 64:] = (200, 0, 0)
+    return image
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+def test_forget_reports_segments_as_changed(layout_dir, engine):
+    processor = load_engine(engine).Processor()
+    try:
+        segments, commands = processor.analyze(frame())
+        assert set(commands) == {"61_1", "61_2"}
+        assert tuple(processor.prev_colors[1]) == (200, 0, 0)
+
+        segments, commands = processor.analyze(frame())
+        assert commands == {} and not segments["changed"].any()
+
+        processor.forget([2])
+        assert processor.prev_colors[2, 0] == -1
+        segments, commands = processor.analyze(frame())
+        assert set(commands) == {"61_2"}
+    finally:
+        processor.close()
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+def test_prev_colors_is_read_only(layout_dir, engine):
+    processor = load_engine(engine).Processor()
+    try:
+        with pytest.raises(ValueError):
+            processor.prev_colors[1] = -1
+    finally:
+        processor.close()
@@ -0,0 +1,38 @@
+"""Generated fixed-color commands against the payloads the UI used to hard-code."""
+import pytest
+
+import time_numpy
+
+# The literal tables time.py sent before segment_codes() generated them.
+ORANGE_CODES = {
+    1: "AAIAFAEAEAPoA+iBFA==", 2: "AAIAFAEAEAPoA+iBEw==", 3: "AAIAFAEAEAPoA+iBEg==",
+    4: "AAIAFAEAEAPoA+iBEQ==", 5: "AAIAFAEAEAPoA+iBEA==", 6: "AAIAFAEAEAPoA+iBDw==",
+    7: "AAIAFAEAEAPoA+iBDg==", 8: "AAIAFAEAEAPoA+iBDQ==", 9: "AAIAFAEAEAPoA+iBDA==",
+    10: "AAIAFAEAEAPoA+iBCw==", 11: "AAIAFAEAEAPoA+iBCg==", 12: "AAIAFAEAEAPoA+iBCQ==",
+    13: "AAIAFAEAEAPoA+iBCA==", 14: "AAIAFAEAEAPoA+iBBw==", 15: "AAIAFAEAEAPoA+iBBg==",
+    16: "AAIAFAEAEAPoA+iBBQ==", 17: "AAIAFAEAEAPoA+iBBA==", 18: "AAIAFAEAEAPoA+iBAw==",
+    19: "AAIAFAEAEAPoA+iBAg==", 20: "AAIAFAEAEAPoA+iBAQ==",
+}
+BLACK_CODES = {
+    1: "AAIAFAEAAAAAAACBFA==", 2: "AAIAFAEAAAAAAACBEw==", 3: "AAIAFAEAAAAAAACBEg==",
+    4: "AAIAFAEAAAAAAACBEQ==", 5: "AAIAFAEAAAAAAACBEA==", 6: "AAIAFAEAAAAAAACBDw==",
+    7: "AAIAFAEAAAAAAACBDg==", 8: "AAIAFAEAAAAAAACBDQ==", 9: "AAIAFAEAAAAAAACBDA==",
+    10: "AAIAFAEAAAAAAACBCw==", 11: "AAIAFAEAAAAAAACBCg==", 12: "AAIAFAEAAAAAAACBCQ==",
+    13: "AAIAFAEAAAAAAACBCA==", 14: "AAIAFAEAAAAAAACBBw==", 15: "AAIAFAEAAAAAAACBBg==",
+    16: "AAIAFAEAAAAAAACBBQ==", 17: "AAIAFAEAAAAAAACBBA==", 18: "AAIAFAEAAAAAAACBAw==",
+    19: "AAIAFAEAAAAAAACBAg==", 20: "AAIAFAEAAAAAAACBAQ==",
+}
+
+
+def native_encoder():
+    bindings = pytest.importorskip("time_bindings")
+    if not hasattr(bindings, "encodeCommand"):
+        pytest.skip("time_bindings is an outdated build")
+    return bindings.encodeCommand
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+def test_segment_codes_match_the_old_tables(engine):
+    encode = time_numpy.encodeCommand if engine == "numpy" else native_encoder()
+    assert time_numpy.segment_codes(time_numpy.BLACK_HSV, encode) == BLACK_CODES
+    assert time_numpy.segment_codes(time_numpy.HIGHLIGHT_HSV, encode) == ORANGE_CODES
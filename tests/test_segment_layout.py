@@ -0,0 +1,84 @@
+"""Segment layouts loaded by the NumPy engine's Processor, and the mean colors of the "mean" mode."""
+import json
+
+import numpy as np
+import pytest
+
+import time_numpy
+
+
+def write_layout(directory, columns, rows, width=640, height=360):
+    """Write a grid of segments numbered from 1 covering a width x height frame."""
+    segment_width, segment_height = width // columns, height // rows
+    layout = {
+        str(row * columns + column + 1): {"x": column * segment_width, "y": row * segment_height,
+                                          "width": segment_width, "height": segment_height}
+        for row in range(rows) for column in range(columns)
+    }
+    (directory / "segments.json").write_text(json.dumps(layout))
+
+
+@pytest.fixture
+def processor_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(time_numpy.settings, "analysis_mode", "mean")  # Restored for other tests
+    (tmp_path / "settings.json").write_text(json.dumps({"analysis_mode": "mean"}))
+    return tmp_path
+
+
+def gradient_frame(width=640, height=360):
+    columns = np.linspace(0, 255, width, dtype=np.uint8)
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = columns
+    frame[..., 2] = columns[::-1]
+    return frame
+
+
+def test_device_layout_is_analyzed(processor_dir):
+    write_layout(processor_dir, columns=5, rows=4)
+    segments, commands = time_numpy.Processor().analyze(gradient_frame())
+    assert list(segments["segment"]) == list(range(1, 21))
+    assert len(commands) == 20
+
+
+def test_zones_beyond_the_device_are_analyzed_but_not_sent(processor_dir):
+    write_layout(processor_dir, columns=10, rows=12)
+    segments, commands = time_numpy.Processor().analyze(gradient_frame())
+    assert list(segments["segment"]) == list(range(1, 121))
+    assert segments["changed"].all()
+    assert sorted(commands) == sorted(f"61_{segment}" for segment in range(1, time_numpy.DEVICE_SEGMENTS + 1))
+
+
+def test_layout_with_unnumbered_segments_is_rejected(processor_dir, capsys):
+    layout = {"1": {"x": 0, "y": 0, "width": 64, "height": 36},
+              str(time_numpy.MAX_SEGMENTS + 1): {"x": 64, "y": 0, "width": 64, "height": 36}}
+    (processor_dir / "segments.json").write_text(json.dumps(layout))
+    processor = time_numpy.Processor()
+    assert "not loaded" in capsys.readouterr().err
+    # Frames are still analyzed, without segments, instead of failing on the unknown segment.
+    for _ in range(2):
+        segments, commands = processor.analyze(gradient_frame())
+        assert len(segments) == 0
+        assert commands == {}
+
+
+def noise_frame(width=160, height=90):
+    return np.random.default_rng(7).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("rect", [(0, 0, 160, 90), (5, 3, 7, 5), (13, 41, 3, 2), (61, 17, 1, 1),
+                                  (157, 88, 3, 2), (40, 20, 33, 17)])
+def test_mean_colors_match_the_segment_pixels(rect):
+    frame = noise_frame()
+    motion = time_numpy.MotionBuffer()
+    motion.update(frame, edges=False, colors=True)
+    x, y, width, height = rect
+    expected = np.rint(frame[y:y + height, x:x + width].reshape(-1, 3).mean(axis=0))
+    np.testing.assert_array_equal(motion.mean_colors([rect])[0], expected)
+
+
+def test_empty_rectangles_read_one_pixel():
+    frame = noise_frame()
+    motion = time_numpy.MotionBuffer()
+    motion.update(frame, edges=False, colors=True)
+    np.testing.assert_array_equal(motion.mean_colors([(30, 20, 0, 0)])[0], frame[20, 30])
@@ -0,0 +1,83 @@
+"""Temporal smoothing: step response of the filters and the restart on forget()."""
+import json
+
+import numpy as np
+import pytest
+
+import time_numpy
+
+MODES = ["ema", "one_euro", "spring"]
+FRAME_TIME = 1 / 30
+
+
+def load_engine(name):
+    if name == "numpy":
+        return time_numpy
+    bindings = pytest.importorskip("time_bindings")
+    if not hasattr(bindings, "Processor"):
+        pytest.skip("time_bindings is an outdated build")
+    return bindings
+
+
+@pytest.fixture
+def smoothing(monkeypatch):
+    def configure(mode, time_constant=150):
+        monkeypatch.setitem(time_numpy.settings, "smoothing_mode", mode)
+        monkeypatch.setitem(time_numpy.settings, "smoothing_time", time_constant)
+        return time_numpy.SmoothingFilter()
+    return configure
+
+
+def step(filter, color, frames):
+    """Feed a constant color to segment 1 and return the output of every frame."""
+    colors = np.array([color], np.uint8)
+    return [int(filter.apply([1], colors, FRAME_TIME)[0, 2]) for _ in range(frames)]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_filters_converge_to_a_step_without_overshoot(smoothing, mode):
+    filter = smoothing(mode)
+    assert step(filter, (0, 0, 0), 1) == [0]  # The first color primes the filter
+    outputs = step(filter, (0, 0, 200), 60)
+    assert 0 < outputs[0] < 200
+    assert outputs == sorted(outputs) and max(outputs) == 200
+    assert outputs[-1] == 200
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_forget_restarts_at_the_current_color(smoothing, mode):
+    filter = smoothing(mode)
+    step(filter, (0, 0, 0), 1)
+    assert step(filter, (0, 0, 200), 1)[0] < 200
+    filter.forget([1])
+    assert step(filter, (0, 0, 200), 1) == [200]
+
+
+def test_smoothing_off_passes_colors_through(smoothing):
+    filter = smoothing("off")
+    step(filter, (0, 0, 0), 1)
+    assert step(filter, (0, 0, 200), 1) == [200]
+
+
+@pytest.mark.parametrize("engine", ["numpy", "native"])
+def test_processor_forget_restarts_smoothing(tmp_path, monkeypatch, engine):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "settings.json").write_text(json.dumps(
+        {"capture_regions": False, "smoothing_mode": "ema", "smoothing_time": 1000}))
+    (tmp_path / "segments.json").write_text(json.dumps({"1": {"x": 0, "y": 0, "width": 64, "height": 64}}))
+    black = np.zeros((64, 64, 3), np.uint8)
+    red = np.zeros((64, 64, 3), np.uint8)
+    red[..., 2] = 255
+    processor = load_engine(engine).Processor()
+    try:
+        processor.analyze(black)
+        segments, _ = processor.analyze(red)
+        assert segments["v"][0] < 1000  # Smoothed towards red
+        processor.forget([1])
+        segments, _ = processor.analyze(red)
+        assert (int(segments["h"][0]), int(segments["s"][0]), int(segments["v"][0])) == (0, 1000, 1000)
+    finally:
+        # Settings are module globals of the engine; turn smoothing off again for other tests.
+        (tmp_path / "settings.json").write_text(json.dumps({"smoothing_mode": "off", "smoothing_time": 150}))
+        processor.reload()
+        processor.close()
@@ -1,6 +1,7 @@
 #include <opencv2/opencv.hpp>
 #include <iostream>
 #include <vector>
+#include <array>
 #include <json/json.h>
 #include <sstream>
 #include <iomanip>
@@ -10,33 +11,69 @@
 #include <algorithm>
 #include <fstream>
 #include <cmath>
+#include <cstring>
 #include <map>
 #include <mutex>
 #include <thread>
 #include <future>
+#include <optional>
+#include <chrono>
 #include <rapidjson/document.h>
 #include <rapidjson/writer.h>
 #include <rapidjson/stringbuffer.h>
 #include <queue>
 #include <condition_variable>
+#include <filesystem>
+#include <stdexcept>
+#include <random>
+#include <list>
+#include <unordered_map>
+#include <numeric>
+#include <limits>
 #include <opencv2/imgproc.hpp>
 //#define DEBUG  // Uncomment this for debugging, comment it for release
 
-std::map<int, std::tuple<int, int, int>> prev_colors;
+using ColorMap = std::map<int, std::tuple<int, int, int>>;
+// The DPS 61 payload addresses segments 1-20; only those get commands.
+constexpr int kDeviceSegments = 20;
+// Segments a layout may define; loadSegmentData() rejects layouts using others. Segments
+// above kDeviceSegments are analyzed but not sent.
+constexpr int kMaxSegments = 256;
+// Previous colors as an RGB table indexed by segment (row 0 is unused), shared with Python as
+// a NumPy view. -1 marks a segment without a previous color.
+constexpr int kSegmentSlots = kMaxSegments + 1;
+using ColorTable = std::array<std::array<int16_t, 3>, kSegmentSlots>;
 cv::Vec3b computeDominantColor(const cv::Mat& roi);
+cv::Vec3b computePaletteColor(const cv::Mat& samples, std::vector<cv::Vec3f>& centroids, int iterations);
 std::string convertToBase64(const std::vector<uint8_t>& data);
 std::string buildCommand(int segment, const cv::Vec3b& color);
+cv::Vec3i toDeviceHSV(const cv::Vec3b& color);
+std::string encodeCommand(int segment, const cv::Vec3i& deviceHSV);
 cv::Mat captureScreen();
 bool set_uniform_brightness = false;
 int uniform_brightness = 500;  // Default value
 std::mutex color_mutex;
 bool set_color_boost = false;
 double color_boost_factor = 1.0;  // 1.0 means no boost, >1.0 increases saturation
-static cv::Mat prevFrame;
 int component_threshold = 250;          // Sensitivity for individual color components
 double manhattan_threshold = 150.0;     // Sensitivity for the Manhattan color distance
 bool enable_letterbox_detection = true;
 int threshold_value = 10;
+std::string sampling_mode = "full";  // "full", "stride", "blue_noise" or "count"
+int sampling_stride = 4;            // Pixel step for the "stride" mode
+int sample_count = 2000;            // Target samples per segment for the "blue_noise" and "count" modes
+int analysis_scale = 1;             // Analysis resolution divisor: 1, 2, 4 or 8
+bool capture_regions = true;        // Capture only the areas covered by segments (without letterbox detection)
+int signature_tolerance = 2;        // Reuse a segment's color while its signature moves less than this; 0 disables
+std::string smoothing_mode = "off";  // "off", "ema", "one_euro" or "spring"
+int smoothing_time = 150;           // Smoothing time constant in milliseconds
+std::string change_metric = "rgb";  // "rgb" uses the two thresholds above, "cie76" and "ciede2000" use delta_e_threshold
+double delta_e_threshold = 5.0;     // Minimum perceptual (CIELAB delta E) difference for a change
+bool edge_weighting = true;         // Boost the saturation of segments with strong edges
+std::string color_method = "histogram";  // "histogram" (most frequent hue) or "palette" (weighted k-means)
+int palette_clusters = 4;           // Clusters per segment for the "palette" method
+int palette_iterations = 64;        // k-means iterations per frame, shared by all segments
+std::string analysis_mode = "roi";  // "roi" finds each segment's dominant color, "mean" averages it from an integral image
 
 namespace {
     // Global (file‑scope) variables for screen capture:
@@ -48,7 +85,11 @@ namespace {
     int g_screenWidth = 0;
     int g_screenHeight = 0;
     HBITMAP g_hbwindow = nullptr;
+    HBITMAP g_hbcanvas = nullptr;  // Packed frame for region capture, recreated when its size changes
+    cv::Size g_canvasSize;
     bool g_initialized = false;
+    // Capture may run on a background analysis thread while the UI switches monitors.
+    std::recursive_mutex g_captureMutex;
 }
 // Setter function to change letterbox detection.
 extern "C" void set_letterbox_detection(bool enable) {
@@ -88,11 +129,16 @@ BOOL CALLBACK MonitorEnumProc(HMONITOR hMonitor, HDC hdcMonitor, LPRECT lprcMoni
 }
 
 extern "C" void initScreenCapture() {
+    std::lock_guard<std::recursive_mutex> lock(g_captureMutex);
     if (g_initialized) {
         if (g_hbwindow) {
             DeleteObject(g_hbwindow);
             g_hbwindow = nullptr;
         }
+        if (g_hbcanvas) {
+            DeleteObject(g_hbcanvas);
+            g_hbcanvas = nullptr;
+        }
         if (g_hwindowCompatibleDC) {
             DeleteDC(g_hwindowCompatibleDC);
             g_hwindowCompatibleDC = nullptr;
@@ -136,12 +182,17 @@ extern "C" void initScreenCapture() {
 
 
 extern "C" void switchMonitorCapture() {
+    std::lock_guard<std::recursive_mutex> lock(g_captureMutex);
     // Free existing resources if initialized
     if (g_initialized) {
         if (g_hbwindow) {
             DeleteObject(g_hbwindow);
             g_hbwindow = nullptr;
         }
+        if (g_hbcanvas) {
+            DeleteObject(g_hbcanvas);
+            g_hbcanvas = nullptr;
+        }
         if (g_hwindowCompatibleDC) {
             DeleteDC(g_hwindowCompatibleDC);
             g_hwindowCompatibleDC = nullptr;
@@ -157,112 +208,276 @@ extern "C" void switchMonitorCapture() {
 }
 
 // Initialize the map with default RGB values
-void initializePrevColors(int numSegments) {
+void initializePrevColors(ColorMap& prev_colors, int numSegments) {
     for (int i = 1; i <= numSegments; ++i) {
         prev_colors[i] = std::make_tuple(0, 0, 0); // Default to black
     }
 }
 
-// Compute the average pixel difference (motion intensity) between current and previous segment
-double computeMotionIntensity(const cv::Mat& currSegment, const cv::Mat& prevSegment) {
-    if (currSegment.empty() || prevSegment.empty() ||
-        currSegment.size() != prevSegment.size()) {
-        return 0.0;
-    }
-    cv::Mat diff;
-    cv::absdiff(currSegment, prevSegment, diff);
-    cv::Mat gray;
-    cv::cvtColor(diff, gray, cv::COLOR_BGR2GRAY);
-    // Average difference gives a measure of motion
-    return cv::mean(gray)[0];
+// Frames are analyzed in the layout they arrive in: BGRA as captured from the screen, or
+// BGR/BGRA from a Python frame source. Channel 0 is always blue, 1 green and 2 red, and
+// the alpha channel of BGRA frames is ignored.
+inline int grayConversion(const cv::Mat& image) {
+    return image.channels() == 4 ? cv::COLOR_BGRA2GRAY : cv::COLOR_BGR2GRAY;
 }
 
-// Compute edge intensity using Canny edge detection.
-// Returns a scaled measure of the edge density.
-double computeEdgeIntensity(const cv::Mat& segment) {
-    if (segment.empty()) {
-        return 0.0;
-    }
-    cv::Mat gray, edges;
-    cv::cvtColor(segment, gray, cv::COLOR_BGR2GRAY);
-    cv::Canny(gray, edges, 50, 150);
-    double edgeCount = cv::countNonZero(edges);
-    double totalPixels = segment.rows * segment.cols;
-    // Scale edge density to a value roughly in the 0-255 range
-    return (totalPixels > 0) ? (edgeCount / totalPixels) * 255.0 : 0.0;
-}
+constexpr int kMotionDivisor = 4;  // Motion and edges are measured at 1/4 of the analysis resolution
 
-// Adjust the dominant color based on motion and edge intensities.
-// boost brightness if there is motion and saturation if edges are strong.
-cv::Vec3b adjustColorWithMotionAndEdges(const cv::Vec3b& color, double motionIntensity, double edgeIntensity) {
-    // Convert BGR to HSV
-    cv::Mat bgrPixel(1, 1, CV_8UC3, color);
-    cv::Mat hsvPixel;
-    cv::cvtColor(bgrPixel, hsvPixel, cv::COLOR_BGR2HSV);
-    cv::Vec3b hsvColor = hsvPixel.at<cv::Vec3b>(0, 0);
+// Frame-level motion, edge energy and mean color. Every frame is reduced to grayscale at
+// 1/kMotionDivisor of the analysis resolution, in two preallocated buffers that swap roles
+// each frame. The absolute difference of the two, and optionally the gradient magnitude of
+// the newer one and the color channels of the reduced frame, are summed into integral images
+// once per frame, so the motion, edge intensity and mean color of any segment are O(1)
+// lookups instead of passes over its pixels.
+class MotionBuffer {
+public:
+    // Take the next frame and difference it against the previous one. With edges, also
+    // measure its gradient magnitude, and with colors sum its color channels.
+    void update(const cv::Mat& image, bool edges, bool colors = false) {
+        cv::Size size((std::max)(1, image.cols / kMotionDivisor), (std::max)(1, image.rows / kMotionDivisor));
+        cv::resize(image, reduced, size, 0, 0, cv::INTER_AREA);
+        colorsValid = colors;
+        if (colors) {
+            // At the analysis resolution, so small segments keep their own pixels.
+            cv::integral(image, colorIntegral, CV_64F);  // One sum per channel
+        }
+        current ^= 1;
+        cv::cvtColor(reduced, luma[current], grayConversion(reduced));  // Reuses the buffer
+        valid = luma[current ^ 1].size() == size;
+        if (valid) {
+            cv::absdiff(luma[current], luma[current ^ 1], difference);
+            cv::integral(difference, integral, CV_64F);
+        }
+        edgesValid = edges;
+        if (edges) {
+            // |dx| + |dy| of the 3x3 Sobel operator, each scaled by 1/8; the uint8 sum saturates at
+            // 255, and time_numpy.gradient_magnitude() caps it the same way.
+            cv::Sobel(luma[current], gradientX, CV_16S, 1, 0);
+            cv::Sobel(luma[current], gradientY, CV_16S, 0, 1);
+            cv::convertScaleAbs(gradientX, magnitudeX, 0.125);
+            cv::convertScaleAbs(gradientY, magnitudeY, 0.125);
+            cv::add(magnitudeX, magnitudeY, gradient);
+            cv::integral(gradient, edgeIntegral, CV_64F);
+        }
+    }
 
-    // Determine boost factors.
-    double brightnessBoost = 1.0 + std::min(0.5, motionIntensity / 50.0); // boost up to 50%
-    double saturationBoost = 1.0 + std::min(0.1, edgeIntensity / 50.0);    // boost up to 10%
+    void reset() {
+        luma[0].release();
+        luma[1].release();
+        valid = false;
+        edgesValid = false;
+        colorsValid = false;
+    }
 
-    // Disable saturation boost if color boost option is enabled.
-    if (set_color_boost) {
-        saturationBoost = 1.0;
+    // Mean grayscale change inside a rectangle of the analysis image; 0 without a previous frame.
+    double intensity(const cv::Rect& rect) const {
+        return valid ? meanInside(integral, rect, kMotionDivisor) : 0.0;
     }
 
-    int newV = std::min(255, static_cast<int>(hsvColor[2] * brightnessBoost));
-    int newS = std::min(255, static_cast<int>(hsvColor[1] * saturationBoost));
-    hsvColor[2] = static_cast<uchar>(newV);
-    hsvColor[1] = static_cast<uchar>(newS);
-    hsvPixel.at<cv::Vec3b>(0, 0) = hsvColor;
+    // Mean gradient magnitude inside a rectangle of the analysis image, roughly 0-255; 0 when
+    // the last update did not measure edges.
+    double edgeIntensity(const cv::Rect& rect) const {
+        return edgesValid ? meanInside(edgeIntegral, rect, kMotionDivisor) : 0.0;
+    }
 
-    cv::Mat adjustedBGR;
-    cv::cvtColor(hsvPixel, adjustedBGR, cv::COLOR_HSV2BGR);
-    return adjustedBGR.at<cv::Vec3b>(0, 0);
-}
+    // Mean BGR color inside a rectangle of the analysis image; black when the last update did
+    // not sum the colors.
+    cv::Vec3b meanColor(const cv::Rect& rect) const {
+        if (!colorsValid) {
+            return cv::Vec3b(0, 0, 0);
+        }
+        return cv::Vec3b(cv::saturate_cast<uchar>(meanInside(colorIntegral, rect, 1, 0)),
+                         cv::saturate_cast<uchar>(meanInside(colorIntegral, rect, 1, 1)),
+                         cv::saturate_cast<uchar>(meanInside(colorIntegral, rect, 1, 2)));
+    }
 
+private:
+    // Mean of one channel of an image at 1/divisor of the analysis resolution, summed in sums,
+    // over the cells covering an analysis rectangle; every rectangle covers at least one cell.
+    static double meanInside(const cv::Mat& sums, const cv::Rect& rect, int divisor, int channel = 0) {
+        const int cols = sums.cols - 1, rows = sums.rows - 1, cn = sums.channels();
+        int left = (std::clamp)(rect.x / divisor, 0, cols - 1);
+        int top = (std::clamp)(rect.y / divisor, 0, rows - 1);
+        int right = (std::clamp)((rect.x + rect.width + divisor - 1) / divisor, left + 1, cols);
+        int bottom = (std::clamp)((rect.y + rect.height + divisor - 1) / divisor, top + 1, rows);
+        const double* topRow = sums.ptr<double>(top);
+        const double* bottomRow = sums.ptr<double>(bottom);
+        double sum = bottomRow[right * cn + channel] - topRow[right * cn + channel] -
+                     bottomRow[left * cn + channel] + topRow[left * cn + channel];
+        return sum / ((right - left) * (bottom - top));
+    }
 
-// Set Brightness of the color based on the uniform brightness value (Could be improved)
+    cv::Mat reduced;
+    cv::Mat luma[2];
+    cv::Mat difference;
+    cv::Mat integral;
+    cv::Mat gradientX, gradientY, magnitudeX, magnitudeY, gradient;
+    cv::Mat edgeIntegral;
+    cv::Mat colorIntegral;
+    int current = 0;
+    bool valid = false;        // A previous frame of the same size exists
+    bool edgesValid = false;   // edgeIntegral belongs to the current frame
+    bool colorsValid = false;  // colorIntegral belongs to the current frame
+};
 
-cv::Vec3b applyProportionalBrightness(const cv::Vec3b& color, int uniformBrightness) {
-    // Convert BGR to HSV
-    cv::Mat bgrMat(1, 1, CV_8UC3); // Create a 1x1 matrix
-    bgrMat.at<cv::Vec3b>(0, 0) = color; // Set the pixel to the input color
-    cv::Mat hsvMat;
-    cv::cvtColor(bgrMat, hsvMat, cv::COLOR_BGR2HSV);
+constexpr int kPaletteSamples = 1024;        // Samples per segment for the palette method without a sampling mode
+constexpr int kPaletteMaxIterations = 8;     // k-means iterations per segment and frame at most
+constexpr float kPaletteConvergence = 1.0f;  // Stop once no centroid moves further than this
+constexpr float kPaletteGrayWeight = 16.0f;  // Weight of a gray pixel; saturated pixels weigh up to 271
+
+// Sample offsets inside a segment of the given size for the configured sampling mode.
+// "stride" uses a fixed pixel step, "count" a regular grid sized for the target sample count
+// and "blue_noise" jitters one sample inside every cell of that grid. Returns an empty
+// vector when every pixel should be used. The palette method always samples, with a grid of
+// kPaletteSamples points when no sampling mode is set.
+std::vector<cv::Point> computeSamplePoints(const cv::Size& size, int segment) {
+    std::vector<cv::Point> points;
+    std::string mode = sampling_mode;
+    int count = sample_count;
+    if (color_method == "palette" && mode == "full") {
+        mode = "count";
+        count = kPaletteSamples;
+    }
+    if (mode == "full" || size.area() == 0) {
+        return points;
+    }
 
-    // Extract HSV components
-    cv::Vec3b hsv = hsvMat.at<cv::Vec3b>(0, 0);
-    int h = hsv[0]; // Hue
-    int s = hsv[1]; // Saturation
-    int v = hsv[2]; // Brightness (Value)
+    int step = (mode == "stride")
+        ? sampling_stride
+        : static_cast<int>(std::sqrt(static_cast<double>(size.area()) / (std::max)(1, count)));
+    if (step <= 1) {
+        return points;
+    }
 
-    // Avoid over-brightening very dark colors
-    const int minBrightnessThreshold = 30; // Adjust threshold as needed
-    if (v < minBrightnessThreshold) {
-        return color; // Skip adjustment for very dark colors
+    if (mode == "blue_noise") {
+        std::mt19937 rng(segment);  // Fixed seed so the pattern is stable between frames
+        for (int y = 0; y < size.height; y += step) {
+            for (int x = 0; x < size.width; x += step) {
+                int cellWidth = (std::min)(step, size.width - x);
+                int cellHeight = (std::min)(step, size.height - y);
+                points.emplace_back(x + static_cast<int>(rng() % cellWidth), y + static_cast<int>(rng() % cellHeight));
+            }
+        }
+    } else {
+        for (int y = (std::min)(step / 2, size.height - 1); y < size.height; y += step) {
+            for (int x = (std::min)(step / 2, size.width - 1); x < size.width; x += step) {
+                points.emplace_back(x, y);
+            }
+        }
     }
+    return points;
+}
 
-    // Scale brightness proportionally
-    double scale = static_cast<double>(uniformBrightness) / 255.0;
-    v = static_cast<int>(v * scale);
-    v = (std::min)(v, 255); // Clamp to the maximum value using (std::min)
+// Copy the sampled pixels of a segment into a 1xN image with the segment's channel layout.
+cv::Mat gatherSamples(const cv::Mat& segment, const std::vector<cv::Point>& points) {
+    cv::Mat samples(1, static_cast<int>(points.size()), segment.type());
+    const size_t pixelSize = segment.elemSize();
+    uchar* out = samples.ptr<uchar>(0);
+    for (size_t i = 0; i < points.size(); ++i) {
+        std::memcpy(out + i * pixelSize, segment.ptr<uchar>(points[i].y) + points[i].x * pixelSize, pixelSize);
+    }
+    return samples;
+}
 
-    // Update HSV with the scaled brightness
-    hsv[2] = v;
-    hsvMat.at<cv::Vec3b>(0, 0) = hsv;
+// Cheap change signature of a segment: the mean color of each cell of a 4x4 grid.
+constexpr int kSignatureGrid = 4;
+cv::Mat computeSignature(const cv::Mat& segment) {
+    cv::Mat signature;
+    cv::resize(segment, signature,
+               cv::Size((std::min)(kSignatureGrid, segment.cols), (std::min)(kSignatureGrid, segment.rows)),
+               0, 0, cv::INTER_AREA);
+    return signature;
+}
 
-    // Convert back to BGR
-    cv::Mat resultMat;
-    cv::cvtColor(hsvMat, resultMat, cv::COLOR_HSV2BGR);
-    cv::Vec3b resultColor = resultMat.at<cv::Vec3b>(0, 0);
+// True if no cell of the signature moved by more than the tolerance.
+bool signatureUnchanged(const cv::Mat& signature, const cv::Mat& cached, int tolerance) {
+    return !cached.empty() && cached.size() == signature.size() &&
+           cv::norm(signature, cached, cv::NORM_INF) <= tolerance;
+}
 
-    return resultColor;
+// Inline 8-bit BGR -> HSV conversion with OpenCV's ranges (H 0-179, S and V 0-255).
+// Used for single colors instead of wrapping each one in a 1x1 cv::Mat for cv::cvtColor.
+inline cv::Vec3b bgrToHsv(const cv::Vec3b& bgr) {
+    int b = bgr[0], g = bgr[1], r = bgr[2];
+    int v = (std::max)({b, g, r});
+    int diff = v - (std::min)({b, g, r});
+    if (diff == 0) {
+        return cv::Vec3b(0, 0, static_cast<uchar>(v));
+    }
+    double h;
+    if (v == r) {
+        h = 60.0 * (g - b) / diff;
+    } else if (v == g) {
+        h = 120.0 + 60.0 * (b - r) / diff;
+    } else {
+        h = 240.0 + 60.0 * (r - g) / diff;
+    }
+    if (h < 0) {
+        h += 360.0;
+    }
+    int hue = cvRound(h / 2.0) % 180;
+    int sat = cvRound(255.0 * diff / v);
+    return cv::Vec3b(static_cast<uchar>(hue), cv::saturate_cast<uchar>(sat), static_cast<uchar>(v));
+}
+
+// Inline 8-bit HSV -> BGR conversion, the inverse of bgrToHsv.
+inline cv::Vec3b hsvToBgr(const cv::Vec3b& hsv) {
+    double h = hsv[0] / 30.0;  // Sector 0-6
+    double s = hsv[1] / 255.0;
+    double v = hsv[2];
+    int sector = static_cast<int>(std::floor(h));
+    double f = h - sector;
+    double p = v * (1.0 - s);
+    double q = v * (1.0 - s * f);
+    double t = v * (1.0 - s * (1.0 - f));
+    double r, g, b;
+    switch (sector % 6) {
+        case 0:  r = v; g = t; b = p; break;
+        case 1:  r = q; g = v; b = p; break;
+        case 2:  r = p; g = v; b = t; break;
+        case 3:  r = p; g = q; b = v; break;
+        case 4:  r = t; g = p; b = v; break;
+        default: r = v; g = p; b = q; break;
+    }
+    return cv::Vec3b(cv::saturate_cast<uchar>(b), cv::saturate_cast<uchar>(g), cv::saturate_cast<uchar>(r));
+}
+
+// Apply uniform brightness, color boost and the motion/edge adjustment to a dominant color
+// in a single HSV round trip.
+cv::Vec3b postProcessColor(const cv::Vec3b& color, double motionIntensity, double edgeIntensity) {
+    cv::Vec3b hsv = bgrToHsv(color);
+    int s = hsv[1];
+    int v = hsv[2];
+
+    // Scale brightness proportionally, but avoid over-brightening very dark colors.
+    const int minBrightnessThreshold = 30;
+    if (set_uniform_brightness && v >= minBrightnessThreshold) {
+        v = (std::min)(255, static_cast<int>(v * (uniform_brightness / 255.0)));
+    }
+    if (set_color_boost) {
+        s = (std::min)(255, static_cast<int>(s * color_boost_factor));
+    }
+
+    // Boost brightness if there is motion and saturation if edges are strong. The edge
+    // boost is disabled when the color boost option is enabled.
+    double brightnessBoost = 1.0 + (std::min)(0.5, motionIntensity / 50.0); // boost up to 50%
+    double saturationBoost = set_color_boost ? 1.0 : 1.0 + (std::min)(0.1, edgeIntensity / 50.0);  // boost up to 10%
+    hsv[2] = static_cast<uchar>((std::min)(255, static_cast<int>(v * brightnessBoost)));
+    hsv[1] = static_cast<uchar>((std::min)(255, static_cast<int>(s * saturationBoost)));
+    return hsvToBgr(hsv);
+}
+
+// Post-process the dominant colors of all segments of a frame in one step.
+void postProcessColors(std::vector<cv::Vec3b>& colors, const std::vector<double>& motion,
+                       const std::vector<double>& edges) {
+    for (size_t i = 0; i < colors.size(); ++i) {
+        colors[i] = postProcessColor(colors[i], motion[i], edges[i]);
+    }
 }
 
 // Loads the previous colors from a file and initializes to default values if the file is not found.
 
-void loadPrevColors(const std::string& filename) {
+void loadPrevColors(const std::string& filename, ColorMap& prev_colors) {
     std::ifstream file(filename);
     if (file.is_open()) {
         int segment, r, g, b;
@@ -282,14 +497,14 @@ void loadPrevColors(const std::string& filename) {
         #ifdef DEBUG
         std::cerr << "Could not open file " << filename << ". Initializing to defaults.\n";
         #endif
-        initializePrevColors(20); // Default to 20 segments; adjust as needed
+        initializePrevColors(prev_colors, kDeviceSegments);
     }
 }
 
 
 // Save the previous colors to a file for the next iteration.
 
-void savePrevColors(const std::string& filename) {
+void savePrevColors(const std::string& filename, const ColorMap& prev_colors) {
     std::ofstream file(filename, std::ios::trunc); 
     if (file.is_open()) {
         for (const auto& [segment, color] : prev_colors) {
@@ -306,6 +521,32 @@ void savePrevColors(const std::string& filename) {
     }
 }
 
+// Convert between the file/map representation of the previous colors and the table.
+ColorTable toColorTable(const ColorMap& prev_colors) {
+    ColorTable table;
+    for (auto& row : table) {
+        row.fill(-1);
+    }
+    for (const auto& [segment, color] : prev_colors) {
+        if (segment > 0 && segment < kSegmentSlots) {
+            table[segment] = {static_cast<int16_t>(std::get<0>(color)), static_cast<int16_t>(std::get<1>(color)),
+                              static_cast<int16_t>(std::get<2>(color))};
+        }
+    }
+    return table;
+}
+
+ColorMap toColorMap(const ColorTable& table) {
+    ColorMap prev_colors;
+    for (int segment = 1; segment < kSegmentSlots; ++segment) {
+        const auto& row = table[segment];
+        if (row[0] >= 0) {
+            prev_colors[segment] = std::make_tuple(row[0], row[1], row[2]);
+        }
+    }
+    return prev_colors;
+}
+
 // Function to calculate RGB color difference with proper logging
 double rgb_difference(const cv::Vec3b& color1, const cv::Vec3b& color2) {
     double diff = std::abs(color1[0] - color2[0]) +
@@ -320,38 +561,101 @@ double rgb_difference(const cv::Vec3b& color1, const cv::Vec3b& color2) {
     return diff;
 }
 
-// Set a threshold to filter out small changes
-const double COLOR_CHANGE_THRESHOLD = 150.0; // Adjust this value based on visual significance
+// Linear light of every 8-bit sRGB channel value (the sRGB transfer curve inverted).
+const std::array<double, 256>& srgbLinearTable() {
+    static const std::array<double, 256> table = [] {
+        std::array<double, 256> values{};
+        for (int i = 0; i < 256; ++i) {
+            double c = i / 255.0;
+            values[i] = c <= 0.04045 ? c / 12.92 : std::pow((c + 0.055) / 1.055, 2.4);
+        }
+        return values;
+    }();
+    return table;
+}
 
-// Function to check for significant color changes with logging (This prevents sending unnecessary commands)
-bool is_significant_change(int segment, const cv::Vec3b& new_color) {
-    auto it = prev_colors.find(segment);
-    if (it == prev_colors.end()) {
-        #ifdef DEBUG
-        std::cerr << "No previous color found for segment " << segment
-                  << ". Considering it a significant change.\n";
-        #endif
-        return true;
+// Convert an 8-bit RGB color to CIELAB (D65).
+cv::Vec3d rgbToLab(int r, int g, int b) {
+    const auto& linear = srgbLinearTable();
+    const double lr = linear[r], lg = linear[g], lb = linear[b];
+    double xyz[3] = {
+        (0.4124564 * lr + 0.3575761 * lg + 0.1804375 * lb) / 0.95047,
+        (0.2126729 * lr + 0.7151522 * lg + 0.0721750 * lb) / 1.0,
+        (0.0193339 * lr + 0.1191920 * lg + 0.9503041 * lb) / 1.08883,
+    };
+    constexpr double kEpsilon = (6.0 / 29.0) * (6.0 / 29.0) * (6.0 / 29.0);
+    for (double& t : xyz) {
+        t = t > kEpsilon ? std::cbrt(t) : t / (3.0 * (6.0 / 29.0) * (6.0 / 29.0)) + 4.0 / 29.0;
     }
+    return cv::Vec3d(116.0 * xyz[1] - 16.0, 500.0 * (xyz[0] - xyz[1]), 200.0 * (xyz[1] - xyz[2]));
+}
 
-    auto [prev_r, prev_g, prev_b] = it->second;
-    double diff = rgb_difference(new_color, cv::Vec3b(prev_r, prev_g, prev_b));
-    if (diff > COLOR_CHANGE_THRESHOLD) {
-        return true;
+// CIE76 color difference: the Euclidean distance in CIELAB.
+double deltaE76(const cv::Vec3d& lab1, const cv::Vec3d& lab2) {
+    return cv::norm(lab1 - lab2);
+}
+
+// CIEDE2000 color difference (kL = kC = kH = 1).
+double deltaE2000(const cv::Vec3d& lab1, const cv::Vec3d& lab2) {
+    constexpr double kPi = 3.14159265358979323846;
+    constexpr double kPow25To7 = 6103515625.0;  // 25^7
+    auto radians = [&](double degrees) { return degrees * kPi / 180.0; };
+    auto hueAngle = [&](double b, double a) {
+        double h = std::atan2(b, a) * 180.0 / kPi;
+        return h < 0.0 ? h + 360.0 : h;
+    };
+
+    const double cMean7 = std::pow((std::hypot(lab1[1], lab1[2]) + std::hypot(lab2[1], lab2[2])) / 2.0, 7);
+    const double g = 0.5 * (1.0 - std::sqrt(cMean7 / (cMean7 + kPow25To7)));
+    const double a1 = lab1[1] * (1.0 + g), a2 = lab2[1] * (1.0 + g);
+    const double c1 = std::hypot(a1, lab1[2]), c2 = std::hypot(a2, lab2[2]);
+    const double h1 = hueAngle(lab1[2], a1), h2 = hueAngle(lab2[2], a2);
+    const bool chroma = c1 * c2 != 0.0;
+
+    double dh = 0.0;
+    if (chroma) {
+        dh = h2 - h1;
+        if (dh > 180.0) dh -= 360.0;
+        else if (dh < -180.0) dh += 360.0;
     }
-    return false;
+    const double dL = lab2[0] - lab1[0];
+    const double dC = c2 - c1;
+    const double dH = 2.0 * std::sqrt(c1 * c2) * std::sin(radians(dh / 2.0));
+
+    const double lMean = (lab1[0] + lab2[0]) / 2.0;
+    const double cMean = (c1 + c2) / 2.0;
+    double hMean = h1 + h2;
+    if (chroma) {
+        if (std::abs(h1 - h2) <= 180.0) hMean /= 2.0;
+        else if (hMean < 360.0) hMean = (hMean + 360.0) / 2.0;
+        else hMean = (hMean - 360.0) / 2.0;
+    }
+    const double t = 1.0 - 0.17 * std::cos(radians(hMean - 30.0)) + 0.24 * std::cos(radians(2.0 * hMean))
+                   + 0.32 * std::cos(radians(3.0 * hMean + 6.0)) - 0.20 * std::cos(radians(4.0 * hMean - 63.0));
+    const double rotation = 30.0 * std::exp(-std::pow((hMean - 275.0) / 25.0, 2));
+    const double cMeanPrime7 = std::pow(cMean, 7);
+    const double rT = -2.0 * std::sqrt(cMeanPrime7 / (cMeanPrime7 + kPow25To7)) * std::sin(radians(2.0 * rotation));
+    const double sL = 1.0 + 0.015 * (lMean - 50.0) * (lMean - 50.0) / std::sqrt(20.0 + (lMean - 50.0) * (lMean - 50.0));
+    const double sC = 1.0 + 0.045 * cMean;
+    const double sH = 1.0 + 0.015 * cMean * t;
+    return std::sqrt((dL / sL) * (dL / sL) + (dC / sC) * (dC / sC) + (dH / sH) * (dH / sH)
+                     + rT * (dC / sC) * (dH / sH));
 }
-bool is_significant_change(int segment, const cv::Vec3b& new_color) {
-    auto it = prev_colors.find(segment);
-    if (it == prev_colors.end()) {
+
+// Compare a new color against a segment's previous RGB color. The "rgb" change metric uses
+// the Manhattan and per-channel thresholds; "cie76" and "ciede2000" compare the delta E of
+// the colors in CIELAB with delta_e_threshold.
+bool exceeds_change_thresholds(int segment, int prev_r, int prev_g, int prev_b, const cv::Vec3b& new_color) {
+    if (change_metric == "cie76" || change_metric == "ciede2000") {
+        cv::Vec3d prevLab = rgbToLab(prev_r, prev_g, prev_b);
+        cv::Vec3d newLab = rgbToLab(new_color[2], new_color[1], new_color[0]);
+        double deltaE = change_metric == "cie76" ? deltaE76(prevLab, newLab) : deltaE2000(prevLab, newLab);
         #ifdef DEBUG
-        std::cerr << "No previous color found for segment " << segment
-                  << ". Considering it a significant change.\n";
+        std::cerr << "Segment " << segment << " delta E (" << change_metric << "): " << deltaE << "\n";
         #endif
-        return true;
+        return deltaE > delta_e_threshold;
     }
 
-    auto [prev_r, prev_g, prev_b] = it->second;
     int red_diff = std::abs(prev_r - new_color[2]);
     int green_diff = std::abs(prev_g - new_color[1]);
     int blue_diff = std::abs(prev_b - new_color[0]);
@@ -379,6 +683,27 @@ bool is_significant_change(int segment, const cv::Vec3b& new_color) {
     }
     return false;
 }
+
+bool is_significant_change(const ColorMap& prev_colors, int segment, const cv::Vec3b& new_color) {
+    auto it = prev_colors.find(segment);
+    if (it == prev_colors.end()) {
+        #ifdef DEBUG
+        std::cerr << "No previous color found for segment " << segment
+                  << ". Considering it a significant change.\n";
+        #endif
+        return true;
+    }
+    auto [prev_r, prev_g, prev_b] = it->second;
+    return exceeds_change_thresholds(segment, prev_r, prev_g, prev_b, new_color);
+}
+
+bool is_significant_change(const ColorTable& prev_colors, int segment, const cv::Vec3b& new_color) {
+    if (segment <= 0 || segment >= kSegmentSlots || prev_colors[segment][0] < 0) {
+        return true;
+    }
+    const auto& row = prev_colors[segment];
+    return exceeds_change_thresholds(segment, row[0], row[1], row[2], new_color);
+}
 // Load settings from a JSON file saved using the Python script.
 void loadSettings() {
     std::ifstream file("settings.json");
@@ -411,6 +736,57 @@ void loadSettings() {
     if (settings.isMember("threshold_value")) {
         threshold_value = settings["threshold_value"].asInt(); 
     }
+    if (settings.isMember("sampling_mode")) {
+        sampling_mode = settings["sampling_mode"].asString();
+    }
+    if (settings.isMember("sampling_stride")) {
+        sampling_stride = settings["sampling_stride"].asInt();
+    }
+    if (settings.isMember("sample_count")) {
+        sample_count = settings["sample_count"].asInt();
+    }
+    if (settings.isMember("analysis_scale")) {
+        analysis_scale = settings["analysis_scale"].asInt();
+    }
+    if (settings.isMember("capture_regions")) {
+        capture_regions = settings["capture_regions"].asBool();
+    }
+    if (settings.isMember("signature_tolerance")) {
+        signature_tolerance = settings["signature_tolerance"].asInt();
+    }
+    if (settings.isMember("smoothing_mode")) {
+        smoothing_mode = settings["smoothing_mode"].asString();
+    }
+    if (settings.isMember("smoothing_time")) {
+        smoothing_time = settings["smoothing_time"].asInt();
+    }
+    if (settings.isMember("change_metric")) {
+        change_metric = settings["change_metric"].asString();
+    }
+    if (settings.isMember("delta_e_threshold")) {
+        delta_e_threshold = settings["delta_e_threshold"].asDouble();
+    }
+    if (settings.isMember("edge_weighting")) {
+        edge_weighting = settings["edge_weighting"].asBool();
+    }
+    if (settings.isMember("color_method")) {
+        color_method = settings["color_method"].asString();
+    }
+    if (settings.isMember("palette_clusters")) {
+        palette_clusters = settings["palette_clusters"].asInt();
+    }
+    if (settings.isMember("palette_iterations")) {
+        palette_iterations = settings["palette_iterations"].asInt();
+    }
+    if (settings.isMember("analysis_mode")) {
+        analysis_mode = settings["analysis_mode"].asString();
+        if (analysis_mode == "labelmap") {
+            // The label map is only implemented in time_numpy; say so instead of silently ignoring it.
+            std::cerr << "The label map analysis mode is only available in the NumPy engine; "
+                         "analyzing each segment separately." << std::endl;
+            analysis_mode = "roi";
+        }
+    }
     #ifdef DEBUG
     std::cerr << "Settings loaded:\n"
               << "  set_uniform_brightness: " << set_uniform_brightness << "\n"
@@ -419,11 +795,27 @@ void loadSettings() {
               << "  color_boost_factor: " << color_boost_factor << "\n"
               << "  component_threshold: " << component_threshold << "\n"
               << "  manhattan_threshold: " << manhattan_threshold << "\n"
-              << "  letterbox_threshold_value: " << threshold_value << "\n";
+              << "  letterbox_threshold_value: " << threshold_value << "\n"
+              << "  sampling_mode: " << sampling_mode << "\n"
+              << "  sampling_stride: " << sampling_stride << "\n"
+              << "  sample_count: " << sample_count << "\n"
+              << "  analysis_scale: " << analysis_scale << "\n"
+              << "  capture_regions: " << capture_regions << "\n"
+              << "  signature_tolerance: " << signature_tolerance << "\n"
+              << "  smoothing_mode: " << smoothing_mode << "\n"
+              << "  smoothing_time: " << smoothing_time << "\n"
+              << "  change_metric: " << change_metric << "\n"
+              << "  delta_e_threshold: " << delta_e_threshold << "\n"
+              << "  edge_weighting: " << edge_weighting << "\n"
+              << "  color_method: " << color_method << "\n"
+              << "  palette_clusters: " << palette_clusters << "\n"
+              << "  palette_iterations: " << palette_iterations << "\n"
+              << "  analysis_mode: " << analysis_mode << "\n";
     #endif
 
 }
-// Load segment data from a JSON file saved using the Python script.
+// Load segment data from a JSON file saved using the Python script. Layouts with segments the
+// device cannot address are rejected as a whole, so every frame's commands can be encoded.
 std::map<int, cv::Rect> loadSegmentData(const std::string& filename) {
     std::map<int, cv::Rect> segmentMap;
     std::ifstream file(filename);
@@ -451,14 +843,24 @@ std::map<int, cv::Rect> loadSegmentData(const std::string& filename) {
         #endif
     }
 
+    for (const auto& [segment, rect] : segmentMap) {
+        if (segment < 1 || segment > kMaxSegments) {
+            std::cerr << "Error: " << filename << " uses segment " << segment << ", but segments are numbered 1-"
+                      << kMaxSegments << ". The segment layout is not loaded." << std::endl;
+            return {};
+        }
+    }
     return segmentMap;
 }
 
-// Removes black bars from the input image.
-cv::Mat cropBlackBars(const cv::Mat& image, int threshold_value = 10, int margin = 20) {
+// Finds the picture inside symmetric black bars; the whole image if there are none.
+// conclusive is set to false when every row is black, so a dark frame cannot tell where
+// the bars are.
+cv::Rect detectContentRect(const cv::Mat& image, int threshold_value = 10, int margin = 20,
+                           bool* conclusive = nullptr) {
     // Convert image to grayscale.
     cv::Mat gray;
-    cv::cvtColor(image, gray, cv::COLOR_BGR2GRAY);
+    cv::cvtColor(image, gray, grayConversion(image));
     
     int rows = gray.rows;
     int cols = gray.cols;
@@ -493,6 +895,11 @@ cv::Mat cropBlackBars(const cv::Mat& image, int threshold_value = 10, int margin
         right--;
     }
 
+    bool dark = top >= rows/2 && bottom <= rows/2;  // Every row is black
+    if (conclusive) {
+        *conclusive = !dark;
+    }
+
     // Compute how much is cropped on each side.
     int topCrop = top;                     // number of rows cropped from the top
     int bottomCrop = rows - 1 - bottom;      // number of rows cropped from the bottom
@@ -513,70 +920,206 @@ cv::Mat cropBlackBars(const cv::Mat& image, int threshold_value = 10, int margin
         cropHorizontal = true;
     }
 
-    cv::Mat cropped;
+    // A black frame has no picture to find; keep the original image.
+    if (dark) {
+        #ifdef DEBUG
+        std::cerr << "Frame is black; returning original image.\n";
+        #endif
+        return cv::Rect(0, 0, cols, rows);
+    }
 
-    // Only crop if a symmetric letterbox is detected on one axis.
-    // Typically, letterboxing appears as either vertical bars (pillarbox) or horizontal bars.
-    if (cropVertical && !cropHorizontal) {
-        // Crop vertical letterbox while keeping full width.
-        cv::Rect roi(0, top, cols, bottom - top + 1);
+    // Crop every axis with symmetric bars; letterbox (vertical) and pillarbox (horizontal)
+    // bars can appear together.
+    cv::Rect content(0, 0, cols, rows);
+    if (cropVertical) {
         #ifdef DEBUG
         std::cerr << "Detected vertical letterbox: topCrop=" << topCrop 
                   << ", bottomCrop=" << bottomCrop << "\n";
-        std::cerr << "Cropping to: x=0, y=" << top 
-                  << ", width=" << cols << ", height=" << bottom - top + 1 << "\n";
         #endif
-        cropped = image(roi);
-    } else if (cropHorizontal && !cropVertical) {
-        // Crop horizontal letterbox while keeping full height.
-        cv::Rect roi(left, 0, right - left + 1, rows);
+        content.y = top;
+        content.height = bottom - top + 1;
+    }
+    if (cropHorizontal) {
         #ifdef DEBUG
         std::cerr << "Detected horizontal letterbox: leftCrop=" << leftCrop 
                   << ", rightCrop=" << rightCrop << "\n";
-        std::cerr << "Cropping to: x=" << left << ", y=0, width=" << right - left + 1 
-                  << ", height=" << rows << "\n";
-        #endif
-        cropped = image(roi);
-    } else {
-        // If no clear symmetric letterbox is detected, return the original image.
-        #ifdef DEBUG
-        std::cerr << "No symmetric letterbox detected; returning original image.\n";
         #endif
-        return image;
+        content.x = left;
+        content.width = right - left + 1;
     }
+    return content;
+}
+
+// Moves segment rectangles of a full frame of the given size into the content rectangle, so
+// a letterboxed picture is read in place instead of being stretched over the whole frame.
+std::map<int, cv::Rect> remapSegments(const std::map<int, cv::Rect>& segments, const cv::Rect& content,
+                                      const cv::Size& size) {
+    auto mapX = [&](int x) { return content.x + (x * content.width + size.width / 2) / size.width; };
+    auto mapY = [&](int y) { return content.y + (y * content.height + size.height / 2) / size.height; };
+    std::map<int, cv::Rect> remapped;
+    for (const auto& [segment, rect] : segments) {
+        int left = mapX(rect.x);
+        int top = mapY(rect.y);
+        int right = mapX(rect.x + rect.width);
+        int bottom = mapY(rect.y + rect.height);
+        remapped[segment] = cv::Rect(left, top, (std::max)(right - left, 1), (std::max)(bottom - top, 1));
+    }
+    return remapped;
+}
 
-    // Resize the cropped image back to the original dimensions.
-    // This ensures that any segment coordinates (based on the original image size)
-    // will fall within the image boundaries.
+// Crops the image to the content rectangle and resizes it back to the original dimensions.
+// This ensures that any segment coordinates (based on the original image size)
+// will fall within the image boundaries.
+cv::Mat cropToContent(const cv::Mat& image, const cv::Rect& content) {
+    if (content.size() == image.size()) {
+        return image;
+    }
+    #ifdef DEBUG
+    std::cerr << "Cropping to: x=" << content.x << ", y=" << content.y
+              << ", width=" << content.width << ", height=" << content.height << "\n";
+    #endif
     cv::Mat resized;
-    cv::resize(cropped, resized, cv::Size(cols, rows));
+    cv::resize(image(content), resized, image.size());
     return resized;
 }
 
-// Apply a proportional boost to the saturation channel of the given color.
-cv::Vec3b applyColorBoost(const cv::Vec3b& color, double boostFactor) {
-    // Create a 1x1 image with the given color
-    cv::Mat bgrPixel(1, 1, CV_8UC3, color);
-    cv::Mat hsvPixel;
-    cv::cvtColor(bgrPixel, hsvPixel, cv::COLOR_BGR2HSV);
-
-    cv::Vec3b hsv = hsvPixel.at<cv::Vec3b>(0, 0);
-    // Boost the saturation channel (hsv[1])
-    int boostedS = std::min(255, static_cast<int>(hsv[1] * boostFactor));
-    hsv[1] = static_cast<uchar>(boostedS);
-    hsvPixel.at<cv::Vec3b>(0, 0) = hsv;
-
-    cv::Mat boostedBGR;
-    cv::cvtColor(hsvPixel, boostedBGR, cv::COLOR_HSV2BGR);
-    return boostedBGR.at<cv::Vec3b>(0, 0);
+// Removes black bars from the input image.
+cv::Mat cropBlackBars(const cv::Mat& image, int threshold_value = 10, int margin = 20) {
+    return cropToContent(image, detectContentRect(image, threshold_value, margin));
+}
+
+constexpr int kLetterboxInterval = 30;  // Frames between full detections while the edges look the same
+constexpr int kLetterboxConfirm = 3;    // Consecutive detections needed before the letterbox changes
+
+// True if no edge of the two rectangles differs by more than margin.
+bool sameContent(const cv::Rect& a, const cv::Rect& b, int margin) {
+    return std::abs(a.x - b.x) <= margin && std::abs(a.y - b.y) <= margin &&
+           std::abs(a.br().x - b.br().x) <= margin && std::abs(a.br().y - b.br().y) <= margin;
 }
 
+// Caches the detected content rectangle between frames. Full detection runs every
+// kLetterboxInterval frames, or sooner when a row or column just inside or outside the cached
+// edges turns black or stops being black. A different rectangle must be detected
+// kLetterboxConfirm times in a row before it is used, and frames too dark to tell keep the
+// current one, so the bars do not flicker during fades.
+class LetterboxTracker {
+public:
+    // Return the content rectangle to use for this frame.
+    cv::Rect update(const cv::Mat& image, int threshold_value, int margin) {
+        if (image.size() != frameSize) {
+            reset();
+            frameSize = image.size();
+            setContent(detectContentRect(image, threshold_value, margin));
+            edges = edgeState(image, threshold_value);
+            return content;
+        }
+
+        ++framesSinceCheck;
+        uint32_t state = edgeState(image, threshold_value);
+        if (framesSinceCheck < kLetterboxInterval && state == edges && confirmations == 0) {
+            return content;
+        }
+        edges = state;
+        framesSinceCheck = 0;
+
+        bool conclusive = true;
+        cv::Rect detected = detectContentRect(image, threshold_value, margin, &conclusive);
+        if (!conclusive || sameContent(detected, content, margin)) {
+            confirmations = 0;
+            return content;
+        }
+        if (confirmations > 0 && sameContent(detected, candidate, margin)) {
+            ++confirmations;
+        } else {
+            candidate = detected;
+            confirmations = 1;
+        }
+        if (confirmations >= kLetterboxConfirm) {
+            setContent(candidate);
+            confirmations = 0;
+            edges = edgeState(image, threshold_value);
+        }
+        return content;
+    }
+
+    void reset() {
+        setContent(cv::Rect());
+        frameSize = cv::Size();
+        candidate = cv::Rect();
+        confirmations = 0;
+        framesSinceCheck = 0;
+        edges = 0;
+    }
+
+    // The cached content rectangle at the analysis resolution; empty before the first frame.
+    cv::Rect current() const {
+        std::lock_guard<std::mutex> lock(contentMutex);
+        return content;
+    }
+
+private:
+    void setContent(const cv::Rect& rect) {
+        std::lock_guard<std::mutex> lock(contentMutex);
+        content = rect;
+    }
+
+    // One bit per line on either side of each cached edge: set if the line is black.
+    uint32_t edgeState(const cv::Mat& image, int threshold_value) const {
+        const int rows[] = {content.y, (std::max)(content.y - 1, 0),
+                            content.y + content.height - 1, (std::min)(content.y + content.height, image.rows - 1)};
+        const int cols[] = {content.x, (std::max)(content.x - 1, 0),
+                            content.x + content.width - 1, (std::min)(content.x + content.width, image.cols - 1)};
+        uint32_t state = 0;
+        int bit = 0;
+        for (int y : rows) {
+            state |= static_cast<uint32_t>(isBlack(cv::mean(image.row(y)), threshold_value)) << bit++;
+        }
+        for (int x : cols) {
+            state |= static_cast<uint32_t>(isBlack(cv::mean(image.col(x)), threshold_value)) << bit++;
+        }
+        return state;
+    }
+
+    static bool isBlack(const cv::Scalar& mean, int threshold_value) {
+        // Same weights cv::cvtColor uses for BGR -> grayscale.
+        return 0.114 * mean[0] + 0.587 * mean[1] + 0.299 * mean[2] <= threshold_value;
+    }
+
+    cv::Rect content;
+    mutable std::mutex contentMutex;  // The UI reads the rectangle while frames are analyzed
+    cv::Size frameSize;
+    cv::Rect candidate;
+    int confirmations = 0;
+    int framesSinceCheck = 0;
+    uint32_t edges = 0;
+};
 
 struct SegmentData {
     int segment;
     cv::Vec3b color;
 };
 
+// Last full analysis of a segment, reused while its change signature stays within the tolerance.
+struct SegmentCache {
+    cv::Mat signature;
+    cv::Vec3b color;
+    std::vector<cv::Vec3f> centroids;  // Palette clusters of the last frame, to warm-start k-means
+};
+
+// Per-segment result handed to Python as a NumPy structured array.
+struct SegmentRecord {
+    int32_t segment;
+    uint8_t r, g, b;
+    uint16_t h, s, v;  // Device ranges: hue 0-360, saturation and value 0-1000
+    bool changed;      // True when the change is significant and a command was built
+};
+
+// Result of analyzing one frame: every segment plus the DPS 61 commands for the changed ones.
+struct FrameResult {
+    std::vector<SegmentRecord> segments;
+    std::vector<std::pair<int, std::string>> commands;
+};
+
 // Precompute scaled segment positions and store them in a map
 std::map<int, cv::Rect> precomputeScaledSegments(const std::map<int, cv::Rect>& originalSegments, double scaleFactor) {
     std::map<int, cv::Rect> scaledSegments;
@@ -591,6 +1134,225 @@ std::map<int, cv::Rect> precomputeScaledSegments(const std::map<int, cv::Rect>&
     return scaledSegments;
 }
 
+// Downscale an image by a power-of-two divisor with a pyramid of 2x2 box filters.
+// A divisor of 1 returns the image itself without copying.
+cv::Mat buildAnalysisImage(const cv::Mat& image, int divisor) {
+    cv::Mat level = image;
+    for (int d = divisor; d > 1 && level.cols >= 2 && level.rows >= 2; d /= 2) {
+        cv::Mat next;
+        cv::resize(level, next, cv::Size(level.cols / 2, level.rows / 2), 0, 0, cv::INTER_AREA);
+        level = next;
+    }
+    return level;
+}
+
+// Round a requested analysis scale down to a supported power-of-two divisor (1-8).
+int analysisDivisor(int scale) {
+    int divisor = 1;
+    while (divisor < 8 && divisor * 2 <= scale) {
+        divisor *= 2;
+    }
+    return divisor;
+}
+
+// A screen area that is captured and the position it is copied to in the packed frame.
+struct CaptureRegion {
+    cv::Rect source;  // Monitor coordinates
+    cv::Point target;  // Position in the packed frame
+};
+
+// Where the screen is captured from and where each segment ends up in the captured frame.
+// Without regions the full monitor is captured and the segments keep their coordinates.
+struct CaptureLayout {
+    std::vector<CaptureRegion> regions;
+    cv::Size canvas;
+    std::map<int, cv::Rect> segments;
+};
+cv::Mat captureScreenRegions(const std::vector<CaptureRegion>& regions, const cv::Size& canvasSize);
+
+// Capture regions start and end on multiples of the largest analysis divisor.
+constexpr int kCaptureAlign = 8;
+// Two areas are captured together if their bounding box costs at most this much extra.
+constexpr double kRegionMergeSlack = 1.25;
+
+// Group the segments into capture regions packed into one compact frame. Segments in the
+// same row share a region when capturing their bounding box wastes little, which typically
+// turns the top and bottom edges into one strip each; stacked segments are not merged so a
+// side column packs as a row of short regions instead of one tall strip. Regions are aligned
+// to kCaptureAlign on the screen and in the packed frame, so downscaling the packed frame
+// gives the same pixels as downscaling the full frame. They are placed on shelves, tallest
+// first, and every segment is offset to its region's position in the packed frame.
+CaptureLayout planCaptureRegions(const std::map<int, cv::Rect>& segments) {
+    CaptureLayout layout;
+    std::vector<cv::Rect> areas;
+    std::vector<std::vector<int>> members;
+    for (const auto& [segment, rect] : segments) {
+        if (rect.width > 0 && rect.height > 0) {
+            int left = rect.x / kCaptureAlign * kCaptureAlign;
+            int top = rect.y / kCaptureAlign * kCaptureAlign;
+            int right = (rect.x + rect.width + kCaptureAlign - 1) / kCaptureAlign * kCaptureAlign;
+            int bottom = (rect.y + rect.height + kCaptureAlign - 1) / kCaptureAlign * kCaptureAlign;
+            areas.emplace_back(left, top, right - left, bottom - top);
+            members.push_back({segment});
+        }
+    }
+
+    bool merged = true;
+    while (merged) {
+        merged = false;
+        for (size_t i = 0; i < areas.size() && !merged; ++i) {
+            for (size_t j = i + 1; j < areas.size(); ++j) {
+                cv::Rect bounds = areas[i] | areas[j];
+                double covered = areas[i].area() + areas[j].area() - (areas[i] & areas[j]).area();
+                bool sameRow = bounds.height <= (std::max)(areas[i].height, areas[j].height);
+                if (sameRow && bounds.area() <= covered * kRegionMergeSlack) {
+                    areas[i] = bounds;
+                    members[i].insert(members[i].end(), members[j].begin(), members[j].end());
+                    areas.erase(areas.begin() + j);
+                    members.erase(members.begin() + j);
+                    merged = true;
+                    break;
+                }
+            }
+        }
+    }
+
+    std::vector<size_t> order(areas.size());
+    std::iota(order.begin(), order.end(), 0);
+    std::stable_sort(order.begin(), order.end(), [&](size_t a, size_t b) { return areas[a].height > areas[b].height; });
+    int canvasWidth = 0;
+    for (const cv::Rect& area : areas) {
+        canvasWidth = (std::max)(canvasWidth, area.width);
+    }
+
+    int x = 0, y = 0, shelfHeight = 0;
+    for (size_t index : order) {
+        const cv::Rect& area = areas[index];
+        if (x > 0 && x + area.width > canvasWidth) {
+            x = 0;
+            y += shelfHeight;
+            shelfHeight = 0;
+        }
+        cv::Point target(x, y);
+        layout.regions.push_back({area, target});
+        for (int segment : members[index]) {
+            const cv::Rect& rect = segments.at(segment);
+            layout.segments[segment] = cv::Rect(rect.tl() - area.tl() + target, rect.size());
+        }
+        x += area.width;
+        shelfHeight = (std::max)(shelfHeight, area.height);
+    }
+    layout.canvas = cv::Size(canvasWidth, y + shelfHeight);
+    return layout;
+}
+
+// Copy the layout's regions out of a full frame into a packed frame; areas outside the frame
+// stay black.
+cv::Mat packCaptureRegions(const cv::Mat& frame, const CaptureLayout& layout) {
+    cv::Mat packed = cv::Mat::zeros(layout.canvas, frame.type());
+    const cv::Rect bounds(0, 0, frame.cols, frame.rows);
+    for (const CaptureRegion& region : layout.regions) {
+        cv::Rect visible = region.source & bounds;
+        if (visible.empty()) {
+            continue;
+        }
+        cv::Rect target(visible.tl() - region.source.tl() + region.target, visible.size());
+        frame(visible).copyTo(packed(target));
+    }
+    return packed;
+}
+
+constexpr double kOneEuroBeta = 0.05;              // One-euro cutoff increase (Hz) per color unit per second
+constexpr double kOneEuroDerivativeCutoff = 1.0;   // Hz
+constexpr double kMaxSmoothingStep = 1.0;          // Longer gaps between frames are treated as one second
+
+// Low-pass filter gain for a time step and cutoff frequency (one-euro filter).
+inline double smoothingAlpha(double dt, double cutoff) {
+    return 1.0 / (1.0 + 1.0 / (2.0 * CV_PI * cutoff * dt));
+}
+
+// Per-segment temporal smoothing of the adjusted colors. The state of every segment slot is
+// kept in flat arrays and each frame's segments are filtered in one pass over them. The
+// filters, selected by smoothing_mode, all use smoothing_time as their time constant:
+//   "ema"      - exponential moving average
+//   "one_euro" - one-euro filter: heavy smoothing of small jitter, fast on large changes
+//   "spring"   - critically damped spring: smooth, without overshoot
+class SmoothingFilter {
+public:
+    // Smooth the BGR colors of the valid segments in place; dt is seconds since the last frame.
+    void apply(const std::vector<int>& ids, std::vector<cv::Vec3b>& colors, const std::vector<char>& valid,
+               double dt) {
+        if (smoothing_mode != mode) {
+            mode = smoothing_mode;
+            reset();
+        }
+        const double tau = smoothing_time / 1000.0;
+        const bool ema = mode == "ema", oneEuro = mode == "one_euro", spring = mode == "spring";
+        if (!(ema || oneEuro || spring) || tau <= 0.0) {
+            return;
+        }
+        dt = std::clamp(dt, 1e-3, kMaxSmoothingStep);
+        const double emaGain = 1.0 - std::exp(-dt / tau);
+        const double minCutoff = 1.0 / (2.0 * CV_PI * tau);
+        const double derivativeGain = smoothingAlpha(dt, kOneEuroDerivativeCutoff);
+        const double omega = 2.0 / tau;
+        const double decay = std::exp(-omega * dt);
+
+        for (size_t i = 0; i < ids.size(); ++i) {
+            const int segment = ids[i];
+            if (!valid[i] || segment <= 0 || segment >= kSegmentSlots) {
+                continue;
+            }
+            auto& x = value[segment];
+            auto& v = rate[segment];
+            if (!primed[segment]) {
+                // Segments without history start at their current color.
+                for (int c = 0; c < 3; ++c) {
+                    x[c] = colors[i][c];
+                    v[c] = 0.0;
+                }
+                primed[segment] = true;
+            }
+            for (int c = 0; c < 3; ++c) {
+                const double target = colors[i][c];
+                if (ema) {
+                    x[c] += emaGain * (target - x[c]);
+                } else if (oneEuro) {
+                    v[c] += derivativeGain * ((target - x[c]) / dt - v[c]);
+                    x[c] += smoothingAlpha(dt, minCutoff + kOneEuroBeta * std::abs(v[c])) * (target - x[c]);
+                } else {
+                    const double delta = x[c] - target;
+                    const double step = (v[c] + omega * delta) * dt;
+                    v[c] = (v[c] - omega * step) * decay;
+                    x[c] = target + (delta + step) * decay;
+                }
+                colors[i][c] = cv::saturate_cast<uchar>(x[c]);
+            }
+        }
+    }
+
+    void reset() {
+        primed.fill(false);
+        for (auto& v : rate) {
+            v.fill(0.0);
+        }
+    }
+
+    // Drop the history of the segments, so they restart at their next color.
+    void forget(const std::vector<int>& segments) {
+        for (int segment : segments) {
+            if (segment > 0 && segment < kSegmentSlots) {
+                primed[segment] = false;
+            }
+        }
+    }
+
+private:
+    std::string mode = "off";
+    std::array<std::array<double, 3>, kSegmentSlots> value{};
+    std::array<std::array<double, 3>, kSegmentSlots> rate{};  // Filtered derivative or spring velocity
+    std::array<bool, kSegmentSlots> primed{};
+};
 
 class ThreadPool {
 public:
@@ -605,8 +1367,16 @@ public:
                         if (stop && tasks.empty()) return;
                         task = std::move(tasks.front());
                         tasks.pop();
+                        ++active;
                     }
                     task();
+                    {
+                        std::unique_lock<std::mutex> lock(queueMutex);
+                        --active;
+                        if (tasks.empty() && active == 0) {
+                            idle.notify_all();
+                        }
+                    }
                 }
             });
         }
@@ -631,58 +1401,308 @@ public:
         condition.notify_one();
     }
 
+    // Block until every queued task has finished. The workers stay alive for the next frame.
+    void wait() {
+        std::unique_lock<std::mutex> lock(queueMutex);
+        idle.wait(lock, [this] { return tasks.empty() && active == 0; });
+    }
+
 private:
     std::vector<std::thread> workers;
     std::queue<std::function<void()>> tasks;
     std::mutex queueMutex;
     std::condition_variable condition;
+    std::condition_variable idle;
+    size_t active = 0;
     bool stop = false;
 };
 
-// Main function to process the screen capture and compute the dominant color for each segment.
-int main() {
-    #ifdef DEBUG
-    std::cerr << "Starting the C++ process with motion and edge detection...\n";
-    #endif
-    cv::setUseOptimized(true);
-    cv::setNumThreads(std::thread::hardware_concurrency());
-    loadSettings();
+// Returns the last write time of a file, or the minimum time if it does not exist.
+std::filesystem::file_time_type fileStamp(const std::string& filename) {
+    std::error_code ec;
+    auto stamp = std::filesystem::last_write_time(filename, ec);
+    return ec ? std::filesystem::file_time_type::min() : stamp;
+}
+
+// Long-lived screen processor. Settings, the segment layout, the previous colors and the
+// worker threads are loaded once and kept between frames instead of being rebuilt on every call.
+class Processor {
+public:
+    Processor() : pool((std::max)(1u, std::thread::hardware_concurrency())) {
+        cv::setUseOptimized(true);
+        cv::setNumThreads(std::thread::hardware_concurrency());
+        reload();
+        ColorMap saved;
+        loadPrevColors(colorFile, saved);
+        prevColors = toColorTable(saved);
+    }
+
+    // Re-read settings.json and segments.json.
+    void reload() {
+        reloadSettings();
+        reloadSegments();
+    }
+
+    void reloadSettings() {
+        loadSettings();
+        settingsStamp = fileStamp(settingsFile);
+        applyAnalysisScale();
+    }
+
+    void reloadSegments() {
+        originalSegments = loadSegmentData(segmentFile);
+        captureLayout = planCaptureRegions(originalSegments);
+        scaledSegmentCache.clear();
+        motionBuffer.reset();  // The packed capture layout may have moved
+        segmentsStamp = fileStamp(segmentFile);
+        applyAnalysisScale();
+    }
+
+    // Compute the dominant color and command for each segment of a frame. Without a frame
+    // the selected monitor is captured; frames from other sources use captureScreen()'s layout.
+    FrameResult analyze(cv::Mat frame = cv::Mat());
+
+    // Same as analyze(), serialized to the JSON output of the original executable.
+    std::string process();
+
+    // Start analyzing the next frame on a background thread so it overlaps with the caller
+    // sending the previous frame's commands. Returns false if a frame is already pending.
+    // The frame must stay valid until the result is collected; pass an owned copy.
+    bool submit(cv::Mat frame = cv::Mat()) {
+        std::lock_guard<std::mutex> lock(pendingMutex);
+        if (pending.valid()) {
+            return false;
+        }
+        pending = std::async(std::launch::async, [this, frame] { return analyze(frame); });
+        return true;
+    }
+
+    // True while a submitted frame has not been collected with poll() or wait().
+    bool hasPending() {
+        std::lock_guard<std::mutex> lock(pendingMutex);
+        return pending.valid();
+    }
+
+    // Return the submitted frame's result if it has finished, without blocking.
+    std::optional<FrameResult> poll() {
+        std::lock_guard<std::mutex> lock(pendingMutex);
+        if (!pending.valid() ||
+            pending.wait_for(std::chrono::seconds(0)) != std::future_status::ready) {
+            return std::nullopt;
+        }
+        return pending.get();
+    }
+
+    // Previous colors, updated in memory every frame and shared with Python as a read-only
+    // NumPy view. Writes go through forget(), which holds colorsMutex like analyze().
+    const ColorTable& previousColors() const {
+        return prevColors;
+    }
+
+    // Drop the previous colors of the segments, e.g. after their commands failed to send, so
+    // they are reported as changed on the next frame. Their smoothing restarts at the current
+    // color, which is sent as is.
+    void forget(const std::vector<int>& segments) {
+        std::lock_guard<std::mutex> lock(colorsMutex);
+        for (int segment : segments) {
+            if (segment > 0 && segment < kSegmentSlots) {
+                prevColors[segment] = {-1, -1, -1};
+                forgotten.push_back(segment);
+            }
+        }
+    }
+
+    // Write the previous colors to prev_colors.txt. Called explicitly (on stop and on a timer)
+    // instead of after every frame.
+    void snapshot() {
+        ColorMap colors;
+        {
+            std::lock_guard<std::mutex> lock(colorsMutex);
+            colors = toColorMap(prevColors);
+        }
+        savePrevColors(colorFile, colors);
+    }
+
+    // The picture inside the detected black bars in frame pixels; empty without detection.
+    cv::Rect letterboxRect() const {
+        cv::Rect content = letterbox.current();
+        int scale = divisor;
+        return cv::Rect(content.x * scale, content.y * scale, content.width * scale, content.height * scale);
+    }
+
+    // Block until the submitted frame has been analyzed and return its result.
+    FrameResult wait() {
+        std::future<FrameResult> frame;
+        {
+            std::lock_guard<std::mutex> lock(pendingMutex);
+            if (!pending.valid()) {
+                throw std::runtime_error("No frame has been submitted.");
+            }
+            frame = std::move(pending);
+        }
+        return frame.get();
+    }
+
+private:
+    // Letterbox detection needs the whole frame, so regions are only captured without it.
+    bool useRegionCapture() const {
+        return capture_regions && !enable_letterbox_detection && !captureLayout.regions.empty();
+    }
+
+    // Select the segment rectangles for the current capture mode and analysis resolution.
+    // Scaled positions are cached per divisor until segments.json or the capture mode changes.
+    void applyAnalysisScale() {
+        segmentCache.clear();  // Cached colors depend on the settings and the layout
+        bool regions = useRegionCapture();
+        if (regions != regionMode) {
+            regionMode = regions;
+            scaledSegmentCache.clear();
+        }
+        divisor = analysisDivisor(analysis_scale);
+        auto cached = scaledSegmentCache.find(divisor);
+        if (cached == scaledSegmentCache.end()) {
+            const auto& base = regionMode ? captureLayout.segments : originalSegments;
+            cached = scaledSegmentCache.emplace(divisor, precomputeScaledSegments(base, 1.0 / divisor)).first;
+        }
+        if (scaledSegments != cached->second) {
+            scaledSegments = cached->second;
+            contentRect = cv::Rect();
+            segments = scaledSegments;
+        }
+        rebuildSamplePoints();
+    }
+
+    // Move the segments into the picture area of the frame (the whole frame without black bars).
+    void applyContentRect(const cv::Rect& content, const cv::Size& size) {
+        if (content == contentRect) {
+            return;
+        }
+        contentRect = content;
+        segments = content.size() == size ? scaledSegments : remapSegments(scaledSegments, content, size);
+        segmentCache.clear();
+        rebuildSamplePoints();
+    }
+
+    // Sample coordinates only depend on the segment sizes and the sampling settings, so they
+    // are computed once per layout and reused every frame.
+    void rebuildSamplePoints() {
+        samplePoints.clear();
+        for (const auto& [segment, rect] : segments) {
+            samplePoints[segment] = computeSamplePoints(rect.size(), segment);
+        }
+    }
+
+    // The UI still writes settings.json and segments.json while syncing; only re-parse them
+    // when their modification time changes.
+    void refreshIfChanged() {
+        if (fileStamp(settingsFile) != settingsStamp) {
+            reloadSettings();
+        }
+        if (fileStamp(segmentFile) != segmentsStamp) {
+            reloadSegments();
+        }
+    }
+
+    const std::string settingsFile = "settings.json";
+    const std::string segmentFile = "segments.json";
     const std::string colorFile = "prev_colors.txt";
 
-    loadPrevColors(colorFile);
+    std::filesystem::file_time_type settingsStamp;
+    std::filesystem::file_time_type segmentsStamp;
+    std::map<int, cv::Rect> originalSegments;
+    CaptureLayout captureLayout;  // Packed capture regions of originalSegments
+    bool regionMode = false;      // Segments are in packed-frame coordinates
+    std::map<int, std::map<int, cv::Rect>> scaledSegmentCache;  // Keyed by analysis divisor
+    std::map<int, cv::Rect> scaledSegments;                     // Rectangles at the current divisor
+    std::map<int, cv::Rect> segments;                           // scaledSegments moved into contentRect
+    cv::Rect contentRect;                                       // Picture area inside black bars
+    int divisor = 1;
+    std::map<int, std::vector<cv::Point>> samplePoints;  // Empty when every pixel is used
+    std::map<int, SegmentCache> segmentCache;
+    LetterboxTracker letterbox;
+    ColorTable prevColors;
+    std::mutex colorsMutex;
+    std::vector<int> forgotten;  // Segments whose smoothing restarts on the next frame, under colorsMutex
+    MotionBuffer motionBuffer;
+    SmoothingFilter smoothing;
+    std::chrono::steady_clock::time_point lastFrameTime;  // Previous frame, for smoothing
+    ThreadPool pool;
+    std::mutex frameMutex;    // One frame is analyzed at a time
+    std::mutex pendingMutex;
+    std::future<FrameResult> pending;  // Declared last so it is joined before the pool goes away
+};
+
+FrameResult Processor::analyze(cv::Mat frame) {
+    std::lock_guard<std::mutex> frameLock(frameMutex);
+    refreshIfChanged();
+    if (useRegionCapture() != regionMode) {
+        applyAnalysisScale();  // Letterbox detection was toggled
+    }
 
-    cv::Mat image = captureScreen();
+    cv::Mat image;
+    if (frame.empty()) {
+        image = regionMode ? captureScreenRegions(captureLayout.regions, captureLayout.canvas) : captureScreen();
+    } else {
+        image = regionMode ? packCaptureRegions(frame, captureLayout) : frame;
+    }
     if (image.empty()) {
         #ifdef DEBUG
         std::cerr << "Error: Screen capture failed.\n";
         #endif
-        return 1;
+        throw std::runtime_error("Screen capture failed.");
     }
 
-    // Use letterbox detection only if enabled
-    cv::Mat croppedImage;
+    // Reduce to the analysis resolution first so letterbox detection, segments, motion and
+    // edges all work on the smaller image.
+    cv::Mat scaledImage = buildAnalysisImage(image, divisor);
+
+    // Use letterbox detection only if enabled. Segments are moved into the picture area
+    // instead of stretching the picture over the whole frame.
+    cv::Rect content(0, 0, scaledImage.cols, scaledImage.rows);
     if (enable_letterbox_detection) {
-        croppedImage = cropBlackBars(image, threshold_value);
+        content = letterbox.update(scaledImage, threshold_value, (std::max)(1, 20 / divisor));
     } else {
-        croppedImage = image;
+        letterbox.reset();
     }
-
-    cv::Mat scaledImage;
-    double scaleFactor = 1.0;
-    cv::resize(croppedImage, scaledImage, cv::Size(), scaleFactor, scaleFactor, cv::INTER_AREA);
-
-    const std::string segmentFile = "segments.json";
-    auto segmentData = loadSegmentData(segmentFile);
-
-    // Precompute scaled segment positions
-    auto scaledSegments = precomputeScaledSegments(segmentData, scaleFactor);
-
-    std::vector<SegmentData> segmentResults;  // Collect results
-    ThreadPool pool(std::thread::hardware_concurrency());
-    std::mutex resultsMutex;
-
-    for (const auto& [segment, scaledRect] : scaledSegments) {
-        pool.enqueue([&, segment, scaledRect]() {
+    applyContentRect(content, scaledImage.size());
+
+    // Per-segment analysis results; each task writes only its own slot.
+    const size_t count = segments.size();
+    std::vector<int> ids(count);
+    std::vector<cv::Vec3b> colors(count);
+    std::vector<double> motion(count, 0.0);
+    std::vector<double> edges(count, 0.0);
+    std::vector<char> valid(count, 0);
+    const int tolerance = signature_tolerance;
+    const bool palette = color_method == "palette";
+    // The iteration budget is shared by all segments; warm-started segments need one or two.
+    const int paletteIterations = (std::clamp)(palette_iterations / (std::max)(1, static_cast<int>(count)),
+                                               1, kPaletteMaxIterations);
+
+    // Motion and edges of every segment come from one pass over the whole frame. In the
+    // "mean" analysis mode so do the colors, and no per-segment tasks are needed.
+    const bool meanMode = analysis_mode == "mean";
+    motionBuffer.update(scaledImage, edge_weighting, meanMode);
+
+    size_t index = 0;
+    for (const auto& [segment, scaledRect] : segments) {
+        if (meanMode) {
+            const size_t slot = index++;
+            ids[slot] = segment;
+            if (scaledRect.x + scaledRect.width <= scaledImage.cols &&
+                scaledRect.y + scaledRect.height <= scaledImage.rows && !scaledRect.empty()) {
+                colors[slot] = motionBuffer.meanColor(scaledRect);
+                motion[slot] = motionBuffer.intensity(scaledRect);
+                edges[slot] = motionBuffer.edgeIntensity(scaledRect);
+                valid[slot] = 1;
+            }
+            continue;
+        }
+        const std::vector<cv::Point>& points = samplePoints[segment];
+        SegmentCache* cache = &segmentCache[segment];  // Created here; each task only touches its own entry
+        const size_t slot = index++;
+        ids[slot] = segment;
+        pool.enqueue([&, segment, scaledRect, cache, slot]() {
             if (scaledRect.x + scaledRect.width > scaledImage.cols || 
                 scaledRect.y + scaledRect.height > scaledImage.rows) {
                 std::cerr << "Warning: Segment " << segment << " exceeds scaled image bounds. Skipping." << std::endl;
@@ -696,47 +1716,86 @@ int main() {
                 return;
             }
 
-            // Compute motion intensity if there's a previous frame.
-            double motionIntensity = 0.0;
-            if (!prevFrame.empty() &&
-                scaledRect.x + scaledRect.width <= prevFrame.cols &&
-                scaledRect.y + scaledRect.height <= prevFrame.rows) {
-                cv::Mat prevSegment = prevFrame.rowRange(scaledRect.y, scaledRect.y + scaledRect.height)
-                                                   .colRange(scaledRect.x, scaledRect.x + scaledRect.width);
-                motionIntensity = computeMotionIntensity(segment_image, prevSegment);
+            motion[slot] = motionBuffer.intensity(scaledRect);
+            edges[slot] = motionBuffer.edgeIntensity(scaledRect);
+
+            // Segments that did not visibly change reuse their last color and skip the hue
+            // histogram.
+            cv::Mat signature;
+            if (tolerance > 0) {
+                signature = computeSignature(segment_image);
+                if (signatureUnchanged(signature, cache->signature, tolerance)) {
+                    colors[slot] = cache->color;
+                    valid[slot] = 1;
+                    return;
+                }
             }
 
-            // Compute edge intensity from the current segment.
-            double edgeIntensity = computeEdgeIntensity(segment_image);
-
-            cv::Vec3b dominantColor = computeDominantColor(segment_image);
-
-            // Apply uniform brightness and color boost as before, if enabled.
-            if (set_uniform_brightness) {
-                dominantColor = applyProportionalBrightness(dominantColor, uniform_brightness);
+            if (palette) {
+                colors[slot] = points.empty()
+                    ? computePaletteColor(segment_image, cache->centroids, paletteIterations)
+                    : computePaletteColor(gatherSamples(segment_image, points), cache->centroids, paletteIterations);
+            } else {
+                colors[slot] = points.empty()
+                    ? computeDominantColor(segment_image)
+                    : computeDominantColor(gatherSamples(segment_image, points));
             }
-            if (set_color_boost) {
-                dominantColor = applyColorBoost(dominantColor, color_boost_factor);
+            if (tolerance > 0) {
+                cache->signature = signature;
+                cache->color = colors[slot];
             }
+            valid[slot] = 1;
+        });
+    }
 
-            // Adjust the dominant color based on motion and edge detection.
-            dominantColor = adjustColorWithMotionAndEdges(dominantColor, motionIntensity, edgeIntensity);
-
-            {
-                std::lock_guard<std::mutex> lock(resultsMutex);
-                if (is_significant_change(segment, dominantColor)) {
-                    segmentResults.push_back({segment, dominantColor});
-                    prev_colors[segment] = std::make_tuple(dominantColor[2], dominantColor[1], dominantColor[0]);
-                }
+    // Wait for all segments to finish; the pool is reused for the next frame.
+    pool.wait();
+
+    // Brightness, color boost and the motion/edge adjustment for all segments in one pass.
+    postProcessColors(colors, motion, edges);
+
+    // Temporal smoothing, so noisy content crosses the change thresholds less often.
+    auto now = std::chrono::steady_clock::now();
+    double dt = lastFrameTime.time_since_epoch().count() == 0
+        ? 0.0 : std::chrono::duration<double>(now - lastFrameTime).count();
+    lastFrameTime = now;
+    {
+        std::lock_guard<std::mutex> lock(colorsMutex);
+        smoothing.forget(forgotten);
+        forgotten.clear();
+    }
+    smoothing.apply(ids, colors, valid, dt);
+
+    // Segments are visited in map order, so the records come out sorted by segment.
+    FrameResult result;
+    result.segments.reserve(count);
+    std::lock_guard<std::mutex> colorsLock(colorsMutex);
+    for (size_t i = 0; i < count; ++i) {
+        if (!valid[i]) {
+            continue;
+        }
+        const cv::Vec3b& dominantColor = colors[i];
+        cv::Vec3i deviceHSV = toDeviceHSV(dominantColor);
+        SegmentRecord record{ids[i], dominantColor[2], dominantColor[1], dominantColor[0],
+                             static_cast<uint16_t>(deviceHSV[0]), static_cast<uint16_t>(deviceHSV[1]),
+                             static_cast<uint16_t>(deviceHSV[2]), false};
+        if (is_significant_change(prevColors, ids[i], dominantColor)) {
+            record.changed = true;
+            if (ids[i] > 0 && ids[i] < kSegmentSlots) {
+                prevColors[ids[i]] = {dominantColor[2], dominantColor[1], dominantColor[0]};
             }
-        });
+            if (record.segment <= kDeviceSegments) {  // Further segments are analyzed, not sent
+                result.commands.emplace_back(record.segment, encodeCommand(record.segment, deviceHSV));
+            }
+        }
+        result.segments.push_back(record);
     }
 
-    // Wait for all threads to finish (explicit destructor call)
-    pool.~ThreadPool();
+    return result;
+}
 
-    // Update the previous frame for the next call
-    prevFrame = scaledImage.clone();
+std::string Processor::process() {
+    FrameResult result = analyze();
 
     rapidjson::Document output;
     output.SetObject();
@@ -745,21 +1804,25 @@ int main() {
     rapidjson::Value commands(rapidjson::kObjectType);
     rapidjson::Value allSegments(rapidjson::kArrayType);
 
-    for (const auto& data : segmentResults) {
-        std::string command = buildCommand(data.segment, data.color);
+    for (const auto& [segment, command] : result.commands) {
         commands.AddMember(
-            rapidjson::Value(("61_" + std::to_string(data.segment)).c_str(), allocator).Move(),
+            rapidjson::Value(("61_" + std::to_string(segment)).c_str(), allocator).Move(),
             rapidjson::Value(command.c_str(), allocator).Move(), 
             allocator
         );
+    }
 
+    for (const auto& record : result.segments) {
+        if (!record.changed) {
+            continue;
+        }
         rapidjson::Value segmentJson(rapidjson::kObjectType);
-        segmentJson.AddMember("segment", data.segment, allocator);
+        segmentJson.AddMember("segment", record.segment, allocator);
         
         rapidjson::Value colorArray(rapidjson::kArrayType);
-        colorArray.PushBack(data.color[2], allocator);
-        colorArray.PushBack(data.color[1], allocator);
-        colorArray.PushBack(data.color[0], allocator);
+        colorArray.PushBack(record.r, allocator);
+        colorArray.PushBack(record.g, allocator);
+        colorArray.PushBack(record.b, allocator);
         segmentJson.AddMember("dominantColor", colorArray, allocator);
 
         allSegments.PushBack(segmentJson, allocator);
@@ -784,18 +1847,32 @@ int main() {
     rapidjson::Writer<rapidjson::StringBuffer> writer(buffer);
     output.Accept(writer);
 
-    std::cout << buffer.GetString() << std::endl;
+    return buffer.GetString();
+}
+
+// Main function to process a single screen capture and print the dominant color for each segment.
+int main() {
+    #ifdef DEBUG
+    std::cerr << "Starting the C++ process with motion and edge detection...\n";
+    #endif
+    Processor processor;
+    try {
+        std::cout << processor.process() << std::endl;
+        processor.snapshot();
+    } catch (const std::exception& e) {
+        std::cerr << "Error: " << e.what() << "\n";
+        return 1;
+    }
     #ifdef DEBUG
     std::cerr << "C++ process completed successfully.\n";
     #endif
-    savePrevColors(colorFile);
-
     return 0;
 }
 
 
 // Capture the screen using the Windows GDI API.
 cv::Mat captureScreen() {
+    std::lock_guard<std::recursive_mutex> lock(g_captureMutex);
     if (!g_initialized) {
         initScreenCapture();
         if (!g_initialized) return cv::Mat();
@@ -824,9 +1901,64 @@ cv::Mat captureScreen() {
         return cv::Mat();
     }
 
-    cv::Mat bgrImage;
-    cv::cvtColor(bgraImage, bgrImage, cv::COLOR_BGRA2RGB);
-    return bgrImage;
+    // Analyzed in place as BGRA; see grayConversion().
+    return bgraImage;
+}
+
+// Capture only the given monitor regions, packed into one frame of canvasSize. Each region
+// is copied into the packed bitmap with its own BitBlt and the bitmap is read back once.
+cv::Mat captureScreenRegions(const std::vector<CaptureRegion>& regions, const cv::Size& canvasSize) {
+    std::lock_guard<std::recursive_mutex> lock(g_captureMutex);
+    if (!g_initialized) {
+        initScreenCapture();
+        if (!g_initialized) return cv::Mat();
+    }
+
+    if (!g_hbcanvas || g_canvasSize != canvasSize) {
+        if (g_hbcanvas) {
+            DeleteObject(g_hbcanvas);
+        }
+        g_hbcanvas = CreateCompatibleBitmap(g_hwindowDC, canvasSize.width, canvasSize.height);
+        g_canvasSize = canvasSize;
+        if (!g_hbcanvas) {
+            return cv::Mat();
+        }
+        // Gaps between regions are never copied to; keep them black.
+        SelectObject(g_hwindowCompatibleDC, g_hbcanvas);
+        PatBlt(g_hwindowCompatibleDC, 0, 0, canvasSize.width, canvasSize.height, BLACKNESS);
+    }
+    SelectObject(g_hwindowCompatibleDC, g_hbcanvas);
+
+    const cv::Rect monitor(0, 0, g_screenWidth, g_screenHeight);
+    for (const CaptureRegion& region : regions) {
+        cv::Rect visible = region.source & monitor;
+        if (visible.empty()) {
+            continue;
+        }
+        cv::Point target = visible.tl() - region.source.tl() + region.target;
+        if (!BitBlt(g_hwindowCompatibleDC, target.x, target.y, visible.width, visible.height,
+                    g_hwindowDC, g_monitorX + visible.x, g_monitorY + visible.y, SRCCOPY)) {
+            return cv::Mat();
+        }
+    }
+
+    BITMAPINFOHEADER bi;
+    memset(&bi, 0, sizeof(BITMAPINFOHEADER));
+    bi.biSize = sizeof(BITMAPINFOHEADER);
+    bi.biWidth = canvasSize.width;
+    bi.biHeight = -canvasSize.height; // Top-down bitmap
+    bi.biPlanes = 1;
+    bi.biBitCount = 32;
+    bi.biCompression = BI_RGB;
+
+    cv::Mat bgraImage(canvasSize, CV_8UC4);
+    if (!GetDIBits(g_hwindowCompatibleDC, g_hbcanvas, 0, canvasSize.height, bgraImage.data,
+                   (BITMAPINFO*)&bi, DIB_RGB_COLORS)) {
+        return cv::Mat();
+    }
+
+    // Analyzed in place as BGRA; see grayConversion().
+    return bgraImage;
 }
 
 // Compute the dominant color in the given region of interest (ROI).
@@ -839,7 +1971,7 @@ cv::Vec3b computeDominantColor(const cv::Mat& roi) {
         return cv::Vec3b(0, 0, 0); // Return default color
     }
 
-    // Convert image to HSV
+    // Convert image to HSV (BGR2HSV also reads BGRA and drops the alpha channel)
     cv::Mat hsv;
     cv::cvtColor(roi, hsv, cv::COLOR_BGR2HSV);
 
@@ -864,9 +1996,89 @@ cv::Vec3b computeDominantColor(const cv::Mat& roi) {
     cv::Mat mask;
     cv::inRange(hsvChannels[0], maxIdx.y, maxIdx.y + 1, mask);
 
-    // Compute the mean color in the masked region
+    // Compute the mean color in the masked region, rounded like time_numpy.dominant_colors()
     cv::Scalar meanColor = cv::mean(roi, mask);
-    return cv::Vec3b(meanColor[0], meanColor[1], meanColor[2]);
+    return cv::Vec3b(cv::saturate_cast<uchar>(meanColor[0]), cv::saturate_cast<uchar>(meanColor[1]),
+                     cv::saturate_cast<uchar>(meanColor[2]));
+}
+
+// Dominant color from a palette: up to `iterations` rounds of k-means over the sampled pixels,
+// each pixel weighted by its chroma so grays and black bars count less than colors. Starts
+// from `centroids` when it holds palette_clusters entries (the previous frame's palette) and
+// stores the new palette there. Returns the center of the cluster with the largest weight.
+cv::Vec3b computePaletteColor(const cv::Mat& samples, std::vector<cv::Vec3f>& centroids, int iterations) {
+    if (samples.empty()) {
+        return cv::Vec3b(0, 0, 0);
+    }
+    const int clusters = (std::max)(1, palette_clusters);
+    const int channels = samples.channels();
+    std::vector<cv::Vec3f> pixels;
+    std::vector<float> weights;
+    pixels.reserve(samples.total());
+    weights.reserve(samples.total());
+    for (int y = 0; y < samples.rows; ++y) {
+        const uchar* row = samples.ptr<uchar>(y);
+        for (int x = 0; x < samples.cols; ++x) {
+            const uchar* p = row + x * channels;
+            pixels.emplace_back(p[0], p[1], p[2]);
+            weights.push_back((std::max)({p[0], p[1], p[2]}) - (std::min)({p[0], p[1], p[2]}) + kPaletteGrayWeight);
+        }
+    }
+
+    if (static_cast<int>(centroids.size()) != clusters) {
+        // Cold start: the most saturated pixel, then repeatedly the pixel farthest from all
+        // centers so far.
+        centroids.assign(1, pixels[std::max_element(weights.begin(), weights.end()) - weights.begin()]);
+        std::vector<float> nearest(pixels.size(), std::numeric_limits<float>::max());
+        while (static_cast<int>(centroids.size()) < clusters) {
+            size_t farthest = 0;
+            for (size_t i = 0; i < pixels.size(); ++i) {
+                cv::Vec3f d = pixels[i] - centroids.back();
+                nearest[i] = (std::min)(nearest[i], d.dot(d));
+                if (nearest[i] > nearest[farthest]) {
+                    farthest = i;
+                }
+            }
+            centroids.push_back(pixels[farthest]);
+        }
+    }
+
+    std::vector<cv::Vec3f> sums(clusters);
+    std::vector<float> totals(clusters);
+    for (int iteration = 0; iteration < iterations; ++iteration) {
+        std::fill(sums.begin(), sums.end(), cv::Vec3f());
+        std::fill(totals.begin(), totals.end(), 0.0f);
+        for (size_t i = 0; i < pixels.size(); ++i) {
+            int nearest = 0;
+            float best = std::numeric_limits<float>::max();
+            for (int k = 0; k < clusters; ++k) {
+                cv::Vec3f d = pixels[i] - centroids[k];
+                float distance = d.dot(d);
+                if (distance < best) {
+                    best = distance;
+                    nearest = k;
+                }
+            }
+            sums[nearest] += pixels[i] * weights[i];
+            totals[nearest] += weights[i];
+        }
+        float shift = 0.0f;
+        for (int k = 0; k < clusters; ++k) {
+            if (totals[k] > 0.0f) {  // Empty clusters keep their center
+                cv::Vec3f center = sums[k] / totals[k];
+                shift = (std::max)(shift, static_cast<float>(cv::norm(center - centroids[k], cv::NORM_INF)));
+                centroids[k] = center;
+            }
+        }
+        if (shift < kPaletteConvergence) {
+            break;
+        }
+    }
+
+    int salient = static_cast<int>(std::max_element(totals.begin(), totals.end()) - totals.begin());
+    const cv::Vec3f& color = centroids[salient];
+    return cv::Vec3b(cv::saturate_cast<uchar>(color[0]), cv::saturate_cast<uchar>(color[1]),
+                     cv::saturate_cast<uchar>(color[2]));
 }
 
 
@@ -890,33 +2102,20 @@ std::string convertToBase64(const std::vector<uint8_t>& data) {
     return result;
 }
 
-// Build the command payload for a given segment and color.
-std::string buildCommand(int segment, const cv::Vec3b& color) {
-    #ifdef DEBUG
-    std::cerr << "Building command for segment: " << segment << std::endl;    // Un-comment for debugging
-    #endif
-    // Convert BGR to RGB
-    cv::Vec3b rgbColor = cv::Vec3b(color[2], color[1], color[0]);
-
+// Convert a BGR color to the device HSV ranges (hue 0-360, saturation and value 0-1000),
+// applying the near-black cap and uniform brightness.
+cv::Vec3i toDeviceHSV(const cv::Vec3b& color) {
     // Convert color components to integers
     int b = static_cast<int>(color[0]);
     int g = static_cast<int>(color[1]);
     int r = static_cast<int>(color[2]);
 
-    int rr = static_cast<int>(rgbColor[0]);
-    int gg = static_cast<int>(rgbColor[1]);
-    int bb = static_cast<int>(rgbColor[2]);
-
-    // Debug: Output BGR and RGB colors in decimal format
+    // Debug: Output BGR color in decimal format
     #ifdef DEBUG
     std::cerr << "BGR Color: [" << b << ", " << g << ", " << r << "]\n";
-    std::cerr << "RGB Color: [" << rr << ", " << gg << ", " << bb << "]\n";
     #endif
     // Convert color to HSV
-    cv::Mat rgb(1, 1, CV_8UC3, cv::Scalar(bb, gg, rr));
-    cv::Mat hsv;
-    cv::cvtColor(rgb, hsv, cv::COLOR_RGB2HSV);
-    cv::Vec3b hsvColor = hsv.at<cv::Vec3b>(0, 0);
+    cv::Vec3b hsvColor = bgrToHsv(color);
 
     // Convert HSV components to integers
     int hue = static_cast<int>(hsvColor[0]);
@@ -951,74 +2150,92 @@ std::string buildCommand(int segment, const cv::Vec3b& color) {
         val = uniform_brightness;  // Apply uniform brightness for non-black colors
     }
 
+    return cv::Vec3i(hue, sat, val);
+}
 
+// Bounded LRU cache of encoded commands keyed on (segment, hue, saturation, value).
+// Colors repeat a lot between frames, so most commands are served from here.
+class CommandCache {
+public:
+    explicit CommandCache(size_t capacity) : capacity(capacity) {}
 
-    // Construct HSV Hex value
-    std::stringstream ss;
-    ss << std::hex << std::setw(4) << std::setfill('0') << hue
-       << std::setw(4) << std::setfill('0') << sat
-       << std::setw(4) << std::setfill('0') << val;
-    std::string hsvHex = ss.str();
-    #ifdef DEBUG
-    std::cerr << "HSV Hex: " << hsvHex << std::endl;  // Un-comment for debugging
-    #endif
-    // Original payloads for individual segments (20-1, top-down)
-    std::vector<std::vector<uint8_t>> original_payloads = {
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x14},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x13},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x12},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x11},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x10},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x0f},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x0e},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x0d},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x0c},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x0b},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x0a},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x09},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x08},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x07},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x06},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x05},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x04},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x03},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x02},
-        {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x01},
-    };
-
-    std::vector<uint8_t> byte_array = original_payloads[segment - 1];
-    std::vector<uint8_t> hsv_bytes;
+    std::optional<std::string> get(uint64_t key) {
+        std::lock_guard<std::mutex> lock(mutex);
+        auto it = index.find(key);
+        if (it == index.end()) {
+            return std::nullopt;
+        }
+        entries.splice(entries.begin(), entries, it->second);  // Mark as most recently used
+        return it->second->second;
+    }
 
-    // Convert HSV Hex to byte array
-    for (size_t i = 0; i < hsvHex.length(); i += 2) {
-        std::string byteString = hsvHex.substr(i, 2);
-        uint8_t byte = static_cast<uint8_t>(strtol(byteString.c_str(), nullptr, 16));
-        hsv_bytes.push_back(byte);
+    void put(uint64_t key, const std::string& command) {
+        std::lock_guard<std::mutex> lock(mutex);
+        if (index.count(key)) {
+            return;
+        }
+        entries.emplace_front(key, command);
+        index[key] = entries.begin();
+        if (entries.size() > capacity) {
+            index.erase(entries.back().first);
+            entries.pop_back();
+        }
     }
 
-    // Insert HSV values into the payload at the correct position
-    for (size_t i = 0; i < hsv_bytes.size(); ++i) {
-        byte_array[5 + i] = hsv_bytes[i];
+private:
+    size_t capacity;
+    std::list<std::pair<uint64_t, std::string>> entries;
+    std::unordered_map<uint64_t, std::list<std::pair<uint64_t, std::string>>::iterator> index;
+    std::mutex mutex;
+};
+
+// Encode device HSV values into the DPS 61 payload for a given segment.
+std::string encodeCommand(int segment, const cv::Vec3i& deviceHSV) {
+    if (segment < 1 || segment > kDeviceSegments) {
+        throw std::invalid_argument("Segment must be between 1 and " + std::to_string(kDeviceSegments) + ".");
+    }
+    int hue = std::min<int>(std::max<int>(deviceHSV[0], 0), 360);
+    int sat = std::min<int>(std::max<int>(deviceHSV[1], 0), 1000);
+    int val = std::min<int>(std::max<int>(deviceHSV[2], 0), 1000);
+
+    static CommandCache cache(4096);
+    uint64_t key = (static_cast<uint64_t>(segment) << 32) | (static_cast<uint64_t>(hue) << 20) |
+                   (static_cast<uint64_t>(sat) << 10) | static_cast<uint64_t>(val);
+    if (std::optional<std::string> cached = cache.get(key)) {
+        return *cached;
     }
 
-    std::string encoded_data = convertToBase64(byte_array);
+    // Payload template; bytes 5-10 hold the big-endian hue, saturation and value and the
+    // last byte addresses the segment (20-1, top-down).
+    std::array<uint8_t, 13> payload = {0x00, 0x02, 0x00, 0x14, 0x01, 0x00, 0x00, 0x03, 0xe8, 0x03, 0xe8, 0x81, 0x00};
+    payload[5] = static_cast<uint8_t>(hue >> 8);
+    payload[6] = static_cast<uint8_t>(hue & 0xFF);
+    payload[7] = static_cast<uint8_t>(sat >> 8);
+    payload[8] = static_cast<uint8_t>(sat & 0xFF);
+    payload[9] = static_cast<uint8_t>(val >> 8);
+    payload[10] = static_cast<uint8_t>(val & 0xFF);
+    payload[12] = static_cast<uint8_t>(21 - segment);
+
+    std::string encoded_data = convertToBase64(std::vector<uint8_t>(payload.begin(), payload.end()));
 
     // Debug information  
     #ifdef DEBUG
     std::cerr << "Segment " << segment << ":\n";
-    std::cerr << "  BGR Color: [" << b << ", " << g << ", " << r << "]\n";
-    std::cerr << "  RGB Color: [" << rr << ", " << gg << ", " << bb << "]\n";
     std::cerr << "  HSV Color (converted): [" << hue << ", " << sat << ", " << val << "]\n";
-    std::cerr << "  HSV Hex: " << hsvHex << "\n";
     std::cerr << "  Byte Array: ";
-    #endif
-    for (uint8_t byte : byte_array) {
-        #ifdef DEBUG
+    for (uint8_t byte : payload) {
         std::cerr << std::hex << std::setw(2) << std::setfill('0') << (int)byte << " ";
-        #endif
     }
-    #ifdef DEBUG
-    std::cerr << "\n  Encoded Data: " << encoded_data << "\n";
+    std::cerr << std::dec << "\n  Encoded Data: " << encoded_data << "\n";
     #endif
+    cache.put(key, encoded_data);
     return encoded_data;
 }
+
+// Build the command payload for a given segment and color.
+std::string buildCommand(int segment, const cv::Vec3b& color) {
+    #ifdef DEBUG
+    std::cerr << "Building command for segment: " << segment << std::endl;    // Un-comment for debugging
+    #endif
+    return encodeCommand(segment, toDeviceHSV(color));
+}
@@ -6,10 +6,13 @@ from PyQt6.QtCore import Qt, QThread, pyqtSignal, QRect, QPoint, QSize, QRectF,
 import tinytuya
 import subprocess
 import json
+import multiprocessing
 import time
-import mss
 import numpy as np
-import time_bindings  # Import the compiled C++ module
+import time_numpy  # Portable NumPy analysis backend
+from analysis_process import AnalysisService, load_native_engine
+from frame_sources import CaptureThread, create_frame_source, get_monitors, monitor_geometry, open_frame_source
+native_bindings = load_native_engine()  # The compiled C++ module, or None if missing or outdated
 import logging
 import threading
 
@@ -50,6 +53,28 @@ def patched_status(self, *args, **kwargs):
 # Monkey-patch the status method so that the error stops the connection.
 tinytuya.OutletDevice.status = patched_status
 
+# Pick the analysis engine at startup: the compiled C++ module unless settings.json selects
+# the NumPy backend, or the native module is not available on this platform.
+def load_analysis_backend():
+    try:
+        with open("settings.json", "r") as file:
+            backend = json.load(file).get("analysis_backend", "native")
+    except Exception:
+        backend = "native"
+    if backend == "numpy" or native_bindings is None:
+        return time_numpy
+    return native_bindings
+
+time_bindings = load_analysis_backend()
+
+# Device HSV of the fixed segment colors (black, and orange for the editor's selection).
+BLACK_HSV = time_numpy.BLACK_HSV
+HIGHLIGHT_HSV = time_numpy.HIGHLIGHT_HSV
+
+# DPS 61 commands that set each of the 20 segments to the given device HSV color.
+def segment_codes(hsv):
+    return time_numpy.segment_codes(hsv, time_bindings.encodeCommand)
+
 # Resource path for PyInstaller helper
 def resource_path(relative_path):
     try:
@@ -910,50 +935,8 @@ class ResizableRect(QGraphicsRectItem):
                 else:
                     selected_seg = self.segment_id
                     # Command codes to highlight selected segment.
-                    orange_codes = {
-                        1: "AAIAFAEAEAPoA+iBFA==",
-                        2: "AAIAFAEAEAPoA+iBEw==",
-                        3: "AAIAFAEAEAPoA+iBEg==",
-                        4: "AAIAFAEAEAPoA+iBEQ==",
-                        5: "AAIAFAEAEAPoA+iBEA==",
-                        6: "AAIAFAEAEAPoA+iBDw==",
-                        7: "AAIAFAEAEAPoA+iBDg==",
-                        8: "AAIAFAEAEAPoA+iBDQ==",
-                        9: "AAIAFAEAEAPoA+iBDA==",
-                        10: "AAIAFAEAEAPoA+iBCw==",
-                        11: "AAIAFAEAEAPoA+iBCg==",
-                        12: "AAIAFAEAEAPoA+iBCQ==",
-                        13: "AAIAFAEAEAPoA+iBCA==",
-                        14: "AAIAFAEAEAPoA+iBBw==",
-                        15: "AAIAFAEAEAPoA+iBBg==",
-                        16: "AAIAFAEAEAPoA+iBBQ==",
-                        17: "AAIAFAEAEAPoA+iBBA==",
-                        18: "AAIAFAEAEAPoA+iBAw==",
-                        19: "AAIAFAEAEAPoA+iBAg==",
-                        20: "AAIAFAEAEAPoA+iBAQ=="
-                    }
-                    black_codes = {
-                        1: "AAIAFAEAAAAAAACBFA==",
-                        2: "AAIAFAEAAAAAAACBEw==",
-                        3: "AAIAFAEAAAAAAACBEg==",
-                        4: "AAIAFAEAAAAAAACBEQ==",
-                        5: "AAIAFAEAAAAAAACBEA==",
-                        6: "AAIAFAEAAAAAAACBDw==",
-                        7: "AAIAFAEAAAAAAACBDg==",
-                        8: "AAIAFAEAAAAAAACBDQ==",
-                        9: "AAIAFAEAAAAAAACBDA==",
-                        10: "AAIAFAEAAAAAAACBCw==",
-                        11: "AAIAFAEAAAAAAACBCg==",
-                        12: "AAIAFAEAAAAAAACBCQ==",
-                        13: "AAIAFAEAAAAAAACBCA==",
-                        14: "AAIAFAEAAAAAAACBBw==",
-                        15: "AAIAFAEAAAAAAACBBg==",
-                        16: "AAIAFAEAAAAAAACBBQ==",
-                        17: "AAIAFAEAAAAAAACBBA==",
-                        18: "AAIAFAEAAAAAAACBAw==",
-                        19: "AAIAFAEAAAAAAACBAg==",
-                        20: "AAIAFAEAAAAAAACBAQ=="
-                    }
+                    orange_codes = segment_codes(HIGHLIGHT_HSV)
+                    black_codes = segment_codes(BLACK_HSV)
                     commands = {}
                     # For the selected segment, send the orange command:
                     commands[f"61_{selected_seg}"] = orange_codes[selected_seg]
@@ -1049,8 +1032,7 @@ class ResizableRect(QGraphicsRectItem):
         ########################
 
 def get_available_monitors():
-    with mss.mss() as sct:
-        monitors = sct.monitors  # List of all monitors (first entry is the virtual full-screen)
+    monitors = get_monitors()  # List of all monitors (first entry is the virtual full-screen)
     return monitors[1:]  # Skip the first entry (it's the full virtual screen)
 
 class SegmentDisplayDialog(QDialog):
@@ -1063,14 +1045,11 @@ class SegmentDisplayDialog(QDialog):
         self.monitor_index = monitor_index
 
         # Determine the selected monitor's resolution.
-        import mss
-        with mss.mss() as sct:
-            monitors = sct.monitors
-            if self.monitor_index < 1 or self.monitor_index >= len(monitors):
-                self.monitor_index = 1
-            mon = monitors[self.monitor_index]
-            mon_width = mon["width"]
-            mon_height = mon["height"]
+        if self.monitor_index < 1 or self.monitor_index >= len(get_monitors()):
+            self.monitor_index = 1
+        mon = monitor_geometry(self.monitor_index)
+        mon_width = mon["width"]
+        mon_height = mon["height"]
 
         # Set the dialog size to a fixed width, adjusting height to match the monitor's aspect ratio.
         desired_width = 800
@@ -1101,6 +1080,7 @@ class SegmentDisplayDialog(QDialog):
 
         # Store the captured screen as a QPixmap.
         self.original_screen = None
+        self.frame_source = create_frame_source("mss", self.monitor_index)
         self.overlay_opacity = overlay_opacity
 
         layout = QVBoxLayout(self)
@@ -1111,23 +1091,24 @@ class SegmentDisplayDialog(QDialog):
 
     def refresh_capture(self):
         """Capture the screen of the selected monitor and store it as a scaled QPixmap."""
-        with mss.mss() as sct:
-            monitors = sct.monitors
-            if self.monitor_index < 1 or self.monitor_index >= len(monitors):
-                self.monitor_index = 1
-            screen = sct.grab(monitors[self.monitor_index])
-            frame = np.array(screen)
-            # Convert BGRA to RGB.
-            frame = frame[:, :, :3][:, :, ::-1]
-            h, w, _ = frame.shape
-            qimage = QImage(frame.tobytes(), w, h, 3 * w, QImage.Format.Format_RGB888)
-            pixmap = QPixmap.fromImage(qimage)
-            # Scale the captured image to the dialog's size while keeping aspect ratio.
-            self.original_screen = pixmap.scaled(
-                self.size(), 
-                Qt.AspectRatioMode.KeepAspectRatio, 
-                Qt.TransformationMode.SmoothTransformation
-            )
+        if self.monitor_index < 1 or self.monitor_index >= len(get_monitors()):
+            self.monitor_index = 1
+        if self.frame_source.monitor_index != self.monitor_index:
+            self.frame_source.set_monitor(self.monitor_index)
+        frame = self.frame_source.grab()
+        if frame is None:
+            return
+        # Convert BGR to RGB.
+        frame = frame[:, :, ::-1]
+        h, w, _ = frame.shape
+        qimage = QImage(frame.tobytes(), w, h, 3 * w, QImage.Format.Format_RGB888)
+        pixmap = QPixmap.fromImage(qimage)
+        # Scale the captured image to the dialog's size while keeping aspect ratio.
+        self.original_screen = pixmap.scaled(
+            self.size(), 
+            Qt.AspectRatioMode.KeepAspectRatio, 
+            Qt.TransformationMode.SmoothTransformation
+        )
         self.update()
 
     def paintEvent(self, event):
@@ -1159,8 +1140,41 @@ class SegmentDisplayDialog(QDialog):
         #    CALL C++ MODULE   #
         ########################
 
-def call_cpp_processor():
+def grab_frame(source):
+    """Next frame from a frame source, or None to let the processor capture the screen itself."""
+    if source is None:
+        return None
+    frame = source.grab()
+    if frame is None:
+        raise RuntimeError("Screen capture failed.")
+    return frame
+
+submitted_at = None  # perf_counter() time the pending frame was captured
+
+def call_cpp_processor(processor=None, source=None):
+    global submitted_at
     try:
+        if processor is not None and isinstance(source, CaptureThread):
+            # The capture thread always holds a fresh frame, so analyze the newest one now
+            # instead of a frame prefetched before the last send.
+            if processor.pending:
+                processor.wait()
+            frame = grab_frame(source)
+            captured_at = source.frame_time
+            segments, commands = processor.analyze(frame)
+            return {"commands": commands, "segments": segments, "captured_at": captured_at}
+        if processor is not None:
+            # Collect the frame analyzed in the background and immediately start on the next one,
+            # so capture and analysis overlap with sending this frame's commands.
+            if not processor.pending:
+                submitted_at = time.perf_counter()
+                processor.submit(grab_frame(source))
+            captured_at = submitted_at
+            segments, commands = processor.wait()
+            submitted_at = time.perf_counter()
+            processor.submit(grab_frame(source))
+            # Structured result: a NumPy record array of every segment and a dict of ready commands.
+            return {"commands": commands, "segments": segments, "captured_at": captured_at}
         output = time_bindings.process_screen()
         ##print("C++ Output:", output)      # DEBUG
         return json.loads(output)
@@ -1170,6 +1184,18 @@ def call_cpp_processor():
     except Exception as e:
         #print(f"Error calling C++ function: {e}")      # DEBUG
         return {"commands": {}}
+
+def read_analysis_service(service):
+    """Newest result of an analysis process, in the same form as call_cpp_processor()."""
+    latest = service.read()
+    if latest is None:
+        return {"commands": {}}
+    segments, captured_at = latest
+    commands = {
+        f"61_{record['segment']}": time_bindings.encodeCommand(int(record["segment"]), int(record["h"]), int(record["s"]), int(record["v"]))
+        for record in segments if record["changed"] and record["segment"] <= time_numpy.DEVICE_SEGMENTS
+    }
+    return {"commands": commands, "segments": segments, "captured_at": captured_at}
     
 class Worker(QThread):
     stop_signal = pyqtSignal()
@@ -1228,6 +1254,7 @@ class Worker(QThread):
 
 class ColorPicker(QMainWindow):
     deviceOffline = pyqtSignal(str)
+    frameAgeUpdated = pyqtSignal(float)  # Seconds from capture to sending the frame's commands
     def __init__(self):
         super().__init__()
         self.setWindowIcon(QIcon(resource_path("icons/main_icon.png")))
@@ -1239,10 +1266,16 @@ class ColorPicker(QMainWindow):
 
 
         self.worker = None
+        self.processor = None  # Long-lived C++ processor, created when syncing starts
+        self.frame_source = None  # Python frame source; None lets the engine capture the screen itself
+        self.analysis_service = None  # Capture and analysis child process, if enabled in the advanced settings
+        # The processor keeps its previous colors in memory; write them to prev_colors.txt periodically.
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.setInterval(30000)
+        self.snapshot_timer.timeout.connect(self.snapshot_prev_colors)
         self.sync_running = False
         self.full_screen = True
         self.commands = {}
-        self.prev_colors = {}  # Dictionary to store previous colors
         self.last_sent_payloads = {}  # Dictionary to store last sent payloads
         self.inactive_segments_set = False
 
@@ -1262,7 +1295,24 @@ class ColorPicker(QMainWindow):
             "command_elapsed_threshold": 11,
             "max_ping_time": 0.11,
             "overlay_opacity": 0.5,
-            "threshold_value": 10
+            "threshold_value": 10,
+            "analysis_backend": "native",
+            "analysis_mode": "roi",
+            "sampling_mode": "full",
+            "sampling_stride": 4,
+            "sample_count": 2000,
+            "color_method": "histogram",
+            "palette_clusters": 4,
+            "palette_iterations": 64,
+            "analysis_scale": 1,
+            "capture_source": "engine",
+            "capture_regions": True,
+            "capture_rate": 0,
+            "signature_tolerance": 2,
+            "edge_weighting": True,
+            "record_frames": False,
+            "recording_file": "recording.npy",
+            "analysis_process": False
         }
         # Initialize advanced settings from defaults.
         self.advanced_retries = self.advanced_defaults["retries"]
@@ -1276,6 +1326,23 @@ class ColorPicker(QMainWindow):
         self.advanced_command_elapsed_threshold = self.advanced_defaults["command_elapsed_threshold"]
         self.advanced_max_ping_time = self.advanced_defaults["max_ping_time"]
         self.advanced_overlay_opacity = self.advanced_defaults["overlay_opacity"]
+        self.advanced_analysis_backend = self.advanced_defaults["analysis_backend"]
+        self.advanced_analysis_mode = self.advanced_defaults["analysis_mode"]
+        self.advanced_sampling_mode = self.advanced_defaults["sampling_mode"]
+        self.advanced_sampling_stride = self.advanced_defaults["sampling_stride"]
+        self.advanced_sample_count = self.advanced_defaults["sample_count"]
+        self.advanced_color_method = self.advanced_defaults["color_method"]
+        self.advanced_palette_clusters = self.advanced_defaults["palette_clusters"]
+        self.advanced_palette_iterations = self.advanced_defaults["palette_iterations"]
+        self.advanced_analysis_scale = self.advanced_defaults["analysis_scale"]
+        self.advanced_capture_source = self.advanced_defaults["capture_source"]
+        self.advanced_capture_regions = self.advanced_defaults["capture_regions"]
+        self.advanced_capture_rate = self.advanced_defaults["capture_rate"]
+        self.advanced_signature_tolerance = self.advanced_defaults["signature_tolerance"]
+        self.advanced_edge_weighting = self.advanced_defaults["edge_weighting"]
+        self.advanced_record_frames = self.advanced_defaults["record_frames"]
+        self.advanced_recording_file = self.advanced_defaults["recording_file"]
+        self.advanced_analysis_process = self.advanced_defaults["analysis_process"]
 
         # Device Setup defaults (if not set in settings, these will be used)
         self.device_default = {
@@ -1291,6 +1358,8 @@ class ColorPicker(QMainWindow):
         self.sync_running = False  
         self.worker = None  
         self.deviceOffline.connect(self.showDeviceOfflineDialog)
+        self.frame_age = None
+        self.frameAgeUpdated.connect(self.update_frame_age)
 
 
     def initUI(self):
@@ -1330,9 +1399,8 @@ class ColorPicker(QMainWindow):
         self.monitor_combobox = QComboBox()
         # Populate monitor combobox using mss to list monitors
         try:
-            with mss.mss() as sct:
-                # sct.monitors[0] is the full virtual screen, so skip it.
-                monitors = sct.monitors[1:]
+            # get_monitors()[0] is the full virtual screen, so skip it.
+            monitors = get_monitors()[1:]
             for i, monitor in enumerate(monitors, start=1):
                 self.monitor_combobox.addItem(
                     f"Monitor {i} ({monitor['width']}x{monitor['height']})", i
@@ -1392,6 +1460,15 @@ class ColorPicker(QMainWindow):
         threshold_group.setToolTip("Thresholds to determine whether a change in color is significant enough to update the device.")
         threshold_layout = QFormLayout()
 
+        # Change Metric
+        self.change_metric_combobox = QComboBox()
+        self.change_metric_combobox.addItem("RGB Distance", "rgb")
+        self.change_metric_combobox.addItem("Perceptual (Delta E 76)", "cie76")
+        self.change_metric_combobox.addItem("Perceptual (Delta E 2000)", "ciede2000")
+        self.change_metric_combobox.setToolTip("How color changes are measured. The perceptual metrics compare colors the way the eye sees them, so dark tones and saturated hues are handled evenly.")
+        self.change_metric_combobox.currentIndexChanged.connect(self.changeMetricChanged)
+        threshold_layout.addRow("Change Metric: ", self.change_metric_combobox)
+
         # Individual (RGB) Threshold
         self.component_threshold_spinbox = QSpinBox()
         self.component_threshold_spinbox.setMinimum(0)
@@ -1411,9 +1488,46 @@ class ColorPicker(QMainWindow):
         self.manhattan_threshold_spinbox.valueChanged.connect(self.save_settings)
         threshold_layout.addRow("Distance Threshold: ", self.manhattan_threshold_spinbox)
 
+        # Perceptual (Delta E) Threshold
+        self.delta_e_threshold_spinbox = QDoubleSpinBox()
+        self.delta_e_threshold_spinbox.setMinimum(0.0)
+        self.delta_e_threshold_spinbox.setMaximum(100.0)
+        self.delta_e_threshold_spinbox.setSingleStep(0.5)
+        self.delta_e_threshold_spinbox.setValue(5.0)  # Default value
+        self.delta_e_threshold_spinbox.setEnabled(False)  # Only enabled for the perceptual metrics
+        self.delta_e_threshold_spinbox.setToolTip("The perceptual difference (delta E) that must be exceeded to trigger an update. About 2.3 is a just noticeable difference.")
+        self.delta_e_threshold_spinbox.valueChanged.connect(self.save_settings)
+        threshold_layout.addRow("Perceptual Threshold: ", self.delta_e_threshold_spinbox)
+
         threshold_group.setLayout(threshold_layout)
         main_layout.addWidget(threshold_group)
 
+        # === Color Smoothing Controls ===
+        smoothing_group = QGroupBox("Color Smoothing")
+        smoothing_group.setToolTip("Smooth each segment's color over time so noisy content sends fewer, steadier updates to the device.")
+        smoothing_layout = QFormLayout()
+
+        self.smoothing_mode_combobox = QComboBox()
+        self.smoothing_mode_combobox.addItem("Off", "off")
+        self.smoothing_mode_combobox.addItem("Moving Average", "ema")
+        self.smoothing_mode_combobox.addItem("One Euro (Adaptive)", "one_euro")
+        self.smoothing_mode_combobox.addItem("Spring", "spring")
+        self.smoothing_mode_combobox.setToolTip("Moving Average evens out all changes. One Euro smooths small flicker but follows large changes immediately. Spring glides to new colors without overshooting.")
+        self.smoothing_mode_combobox.currentIndexChanged.connect(self.save_settings)
+        smoothing_layout.addRow("Filter: ", self.smoothing_mode_combobox)
+
+        self.smoothing_time_spinbox = QSpinBox()
+        self.smoothing_time_spinbox.setMinimum(10)
+        self.smoothing_time_spinbox.setMaximum(2000)
+        self.smoothing_time_spinbox.setSingleStep(10)
+        self.smoothing_time_spinbox.setValue(150)  # Default value
+        self.smoothing_time_spinbox.setToolTip("Time constant of the filter in milliseconds. Higher values give smoother but slower color changes.")
+        self.smoothing_time_spinbox.valueChanged.connect(self.save_settings)
+        smoothing_layout.addRow("Smoothing Time (ms): ", self.smoothing_time_spinbox)
+
+        smoothing_group.setLayout(smoothing_layout)
+        main_layout.addWidget(smoothing_group)
+
         # === Letterbox Detection ===
         self.letterbox_checkbox = QCheckBox('Enable Letterbox Detection')
         self.letterbox_checkbox.setToolTip("Enable detection and cropping of black letterbox bars from the screen capture. Disabling this will leave the full screen intact.")
@@ -1603,6 +1717,159 @@ class ColorPicker(QMainWindow):
         self.threshold_value_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('threshold_value', val))
         form_layout.addRow("Letterbox Threshold:", self.threshold_value_spinbox)
 
+        # Analysis Engine Selection
+        self.analysis_backend_combobox = QComboBox()
+        self.analysis_backend_combobox.addItem("Native (C++)", "native")
+        self.analysis_backend_combobox.addItem("NumPy", "numpy")
+        self.analysis_backend_combobox.setCurrentIndex(self.analysis_backend_combobox.findData(self.advanced_analysis_backend))
+        self.analysis_backend_combobox.setToolTip("Engine used to analyze the screen. The NumPy engine also runs where the native module is unavailable. Takes effect after restarting the application.")
+        self.analysis_backend_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('analysis_backend', self.analysis_backend_combobox.itemData(idx)))
+        form_layout.addRow("Analysis Engine:", self.analysis_backend_combobox)
+
+        # Analysis Mode Selection
+        self.analysis_mode_combobox = QComboBox()
+        self.analysis_mode_combobox.addItem("Per Segment", "roi")
+        self.analysis_mode_combobox.addItem("Label Map", "labelmap")
+        self.analysis_mode_combobox.addItem("Mean Color (Fast)", "mean")
+        if time_bindings is not time_numpy:
+            # The native engine has no label map and would analyze per segment anyway.
+            self.analysis_mode_combobox.model().item(self.analysis_mode_combobox.findData("labelmap")).setEnabled(False)
+        self.analysis_mode_combobox.setCurrentIndex(self.analysis_mode_combobox.findData(self.advanced_analysis_mode))
+        self.analysis_mode_combobox.setToolTip("'Label Map' (NumPy engine only) analyzes all segments in a single pass over a precomputed per-pixel segment map, which is faster with many or overlapping segments. 'Mean Color' uses each segment's plain average color, read from a summed table built once per frame, so the cost does not grow with segment size; the Dominant Color method is not used.")
+        self.analysis_mode_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('analysis_mode', self.analysis_mode_combobox.itemData(idx)))
+        form_layout.addRow("Analysis Mode:", self.analysis_mode_combobox)
+
+        # Pixel Sampling Controls
+        self.sampling_mode_combobox = QComboBox()
+        self.sampling_mode_combobox.addItem("All Pixels", "full")
+        self.sampling_mode_combobox.addItem("Fixed Stride", "stride")
+        self.sampling_mode_combobox.addItem("Blue Noise", "blue_noise")
+        self.sampling_mode_combobox.addItem("Sample Count", "count")
+        self.sampling_mode_combobox.setCurrentIndex(self.sampling_mode_combobox.findData(self.advanced_sampling_mode))
+        self.sampling_mode_combobox.setToolTip("Pixels used to estimate each segment's dominant color. Sampling large segments gives nearly the same color at a fraction of the cost. Not used by the NumPy 'Label Map' mode.")
+        self.sampling_mode_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('sampling_mode', self.sampling_mode_combobox.itemData(idx)))
+        form_layout.addRow("Pixel Sampling:", self.sampling_mode_combobox)
+
+        self.sampling_stride_spinbox = QSpinBox()
+        self.sampling_stride_spinbox.setRange(1, 64)
+        self.sampling_stride_spinbox.setValue(self.advanced_sampling_stride)
+        self.sampling_stride_spinbox.setToolTip("Distance in pixels between samples for the 'Fixed Stride' mode.")
+        self.sampling_stride_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('sampling_stride', val))
+        form_layout.addRow("Sampling Stride:", self.sampling_stride_spinbox)
+
+        self.sample_count_spinbox = QSpinBox()
+        self.sample_count_spinbox.setRange(100, 100000)
+        self.sample_count_spinbox.setSingleStep(100)
+        self.sample_count_spinbox.setValue(self.advanced_sample_count)
+        self.sample_count_spinbox.setToolTip("Target number of samples per segment for the 'Blue Noise' and 'Sample Count' modes.")
+        self.sample_count_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('sample_count', val))
+        form_layout.addRow("Samples per Segment:", self.sample_count_spinbox)
+
+        # Dominant Color Method Selection
+        self.color_method_combobox = QComboBox()
+        self.color_method_combobox.addItem("Hue Histogram", "histogram")
+        self.color_method_combobox.addItem("Palette (k-means)", "palette")
+        self.color_method_combobox.setCurrentIndex(self.color_method_combobox.findData(self.advanced_color_method))
+        self.color_method_combobox.setToolTip("Hue Histogram picks the most frequent hue. Palette groups each segment's sampled pixels into a few clusters and picks the most colorful dominant one, so grays and black bars are not chosen over colored content. Palette always samples pixels (1024 per segment when the Sampling Mode is Full).")
+        self.color_method_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('color_method', self.color_method_combobox.itemData(idx)))
+        form_layout.addRow("Dominant Color:", self.color_method_combobox)
+
+        # Palette Cluster Count
+        self.palette_clusters_spinbox = QSpinBox()
+        self.palette_clusters_spinbox.setRange(2, 8)
+        self.palette_clusters_spinbox.setValue(self.advanced_palette_clusters)
+        self.palette_clusters_spinbox.setToolTip("Number of colors in each segment's palette for the Palette method.")
+        self.palette_clusters_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('palette_clusters', val))
+        form_layout.addRow("Palette Colors:", self.palette_clusters_spinbox)
+
+        # Palette Iteration Budget
+        self.palette_iterations_spinbox = QSpinBox()
+        self.palette_iterations_spinbox.setRange(1, 1000)
+        self.palette_iterations_spinbox.setValue(self.advanced_palette_iterations)
+        self.palette_iterations_spinbox.setToolTip("Palette refinement steps per frame, shared by all segments (at least 1 and at most 8 per segment). Palettes continue from the previous frame, so one or two steps per segment are usually enough.")
+        self.palette_iterations_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('palette_iterations', val))
+        form_layout.addRow("Palette Steps per Frame:", self.palette_iterations_spinbox)
+
+        # Analysis Resolution Selection
+        self.analysis_scale_combobox = QComboBox()
+        self.analysis_scale_combobox.addItem("Full", 1)
+        self.analysis_scale_combobox.addItem("1/2", 2)
+        self.analysis_scale_combobox.addItem("1/4", 4)
+        self.analysis_scale_combobox.addItem("1/8", 8)
+        self.analysis_scale_combobox.setCurrentIndex(self.analysis_scale_combobox.findData(self.advanced_analysis_scale))
+        self.analysis_scale_combobox.setToolTip("Resolution the screen is analyzed at. Lower resolutions are much faster and usually give the same colors.")
+        self.analysis_scale_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('analysis_scale', self.analysis_scale_combobox.itemData(idx)))
+        form_layout.addRow("Analysis Resolution:", self.analysis_scale_combobox)
+
+        # Capture Source Selection
+        self.capture_source_combobox = QComboBox()
+        self.capture_source_combobox.addItem("Engine Default", "engine")
+        self.capture_source_combobox.addItem("MSS", "mss")
+        self.capture_source_combobox.addItem("X11 Shared Memory", "xshm")
+        self.capture_source_combobox.addItem("Synthetic Test Pattern", "synthetic")
+        self.capture_source_combobox.addItem("Recorded Frames", "replay")
+        self.capture_source_combobox.setCurrentIndex(self.capture_source_combobox.findData(self.advanced_capture_source))
+        self.capture_source_combobox.setToolTip("Where screen frames come from. Engine Default uses the analysis engine's own capture; X11 Shared Memory is the fastest option on Linux. Takes effect the next time syncing starts.")
+        self.capture_source_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('capture_source', self.capture_source_combobox.itemData(idx)))
+        form_layout.addRow("Capture Source:", self.capture_source_combobox)
+
+        # Capture Area Selection
+        self.capture_regions_combobox = QComboBox()
+        self.capture_regions_combobox.addItem("Segment Regions", True)
+        self.capture_regions_combobox.addItem("Full Screen", False)
+        self.capture_regions_combobox.setCurrentIndex(self.capture_regions_combobox.findData(self.advanced_capture_regions))
+        self.capture_regions_combobox.setToolTip("Capture only the screen areas covered by segments instead of the whole monitor. Letterbox detection always uses the full screen.")
+        self.capture_regions_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('capture_regions', self.capture_regions_combobox.itemData(idx)))
+        form_layout.addRow("Capture Area:", self.capture_regions_combobox)
+
+        # Capture Thread Rate
+        self.capture_rate_spinbox = QSpinBox()
+        self.capture_rate_spinbox.setRange(0, 120)
+        self.capture_rate_spinbox.setValue(self.advanced_capture_rate)
+        self.capture_rate_spinbox.setToolTip("Frames per second captured on a dedicated thread, so colors are always computed from the newest frame. 0 captures on demand. Takes effect the next time syncing starts.")
+        self.capture_rate_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('capture_rate', val))
+        form_layout.addRow("Capture Rate (FPS):", self.capture_rate_spinbox)
+
+        # Unchanged Segment Tolerance
+        self.signature_tolerance_spinbox = QSpinBox()
+        self.signature_tolerance_spinbox.setRange(0, 64)
+        self.signature_tolerance_spinbox.setValue(self.advanced_signature_tolerance)
+        self.signature_tolerance_spinbox.setToolTip("Segments whose coarse average colors moved by no more than this keep their last color and skip the full analysis, so static screens use almost no CPU. 0 analyzes every segment every frame.")
+        self.signature_tolerance_spinbox.valueChanged.connect(lambda val: self.set_advanced_setting('signature_tolerance', val))
+        form_layout.addRow("Unchanged Tolerance:", self.signature_tolerance_spinbox)
+
+        # Edge Weighting Selection
+        self.edge_weighting_combobox = QComboBox()
+        self.edge_weighting_combobox.addItem("On", True)
+        self.edge_weighting_combobox.addItem("Off", False)
+        self.edge_weighting_combobox.setCurrentIndex(self.edge_weighting_combobox.findData(self.advanced_edge_weighting))
+        self.edge_weighting_combobox.setToolTip("Slightly boost the saturation of segments with detailed content, measured once per frame on a reduced grayscale image. Off skips the edge measurement entirely.")
+        self.edge_weighting_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('edge_weighting', self.edge_weighting_combobox.itemData(idx)))
+        form_layout.addRow("Edge Weighting:", self.edge_weighting_combobox)
+
+        # Frame Recording Controls
+        self.record_frames_combobox = QComboBox()
+        self.record_frames_combobox.addItem("Off", False)
+        self.record_frames_combobox.addItem("Record While Syncing", True)
+        self.record_frames_combobox.setCurrentIndex(self.record_frames_combobox.findData(self.advanced_record_frames))
+        self.record_frames_combobox.setToolTip("Record every captured frame to the recording file while syncing, to replay it later with the 'Recorded Frames' capture source. Recordings grow quickly (about 6 MB per 1080p frame).")
+        self.record_frames_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('record_frames', self.record_frames_combobox.itemData(idx)))
+        form_layout.addRow("Frame Recording:", self.record_frames_combobox)
+
+        self.recording_file_lineedit = QLineEdit(self.advanced_recording_file)
+        self.recording_file_lineedit.setToolTip("File frames are recorded to and replayed from (.npy).")
+        self.recording_file_lineedit.editingFinished.connect(lambda: self.set_advanced_setting('recording_file', self.recording_file_lineedit.text().strip() or self.advanced_defaults["recording_file"]))
+        form_layout.addRow("Recording File:", self.recording_file_lineedit)
+
+        # Analysis Process Selection
+        self.analysis_process_combobox = QComboBox()
+        self.analysis_process_combobox.addItem("In App", False)
+        self.analysis_process_combobox.addItem("Separate Process", True)
+        self.analysis_process_combobox.setCurrentIndex(self.analysis_process_combobox.findData(self.advanced_analysis_process))
+        self.analysis_process_combobox.setToolTip("Capture and analyze the screen in a separate process, so the app only reads the results and sends them to the device. Uses another CPU core. Takes effect the next time syncing starts.")
+        self.analysis_process_combobox.currentIndexChanged.connect(lambda idx: self.set_advanced_setting('analysis_process', self.analysis_process_combobox.itemData(idx)))
+        form_layout.addRow("Analysis Process:", self.analysis_process_combobox)
+
         # Create a QComboBox for theme selection.
         self.theme_combobox = QComboBox()
         self.theme_combobox.addItems(["Light Theme", "Dark Theme"])
@@ -1803,6 +2070,13 @@ class ColorPicker(QMainWindow):
                     <ul>
                         <li><i>Individual Threshold:</i> Sets the minimum change required in any single color channel (RGB) to trigger an update.</li>
                         <li><i>Distance Threshold:</i> Specifies the overall color difference needed before an update is sent.</li>
+                        <li><i>Change Metric:</i> RGB Distance uses the two thresholds above. The perceptual metrics (Delta E 76 and Delta E 2000) compare colors as the eye sees them and use the Perceptual Threshold instead, so fewer invisible changes are sent.</li>
+                    </ul>
+                </li>
+                <li><b>Color Smoothing:</b> 
+                    <ul>
+                        <li><i>Filter:</i> Smooths each segment's color over time. Moving Average evens out all changes, One Euro smooths flicker but follows large changes immediately, and Spring glides to new colors without overshooting.</li>
+                        <li><i>Smoothing Time:</i> How long (in milliseconds) the filter takes to settle; higher values are smoother but slower.</li>
                     </ul>
                 </li>
                 <li><b>Letterbox Detection:</b>
@@ -1940,6 +2214,10 @@ class ColorPicker(QMainWindow):
             self.save_settings()
             # Switch monitor capture in the C++ code.
             time_bindings.switchMonitorCapture()
+            if self.frame_source is not None:
+                self.frame_source.set_monitor(selected_monitor_index)
+            if self.analysis_service is not None:
+                self.analysis_service.set_monitor(selected_monitor_index)
             #print(f"Switched monitor capture to index {selected_monitor_index}.")      # DEBUG
 
     def update_segments_json_from_checkboxes(self):
@@ -2009,16 +2287,14 @@ class ColorPicker(QMainWindow):
             return
 
         active_segments = [seg for seg, cb in self.segment_checkboxes.items() if cb.isChecked()]
-        import mss
         from PyQt6.QtCore import QSize
-        with mss.mss() as sct:
-            monitors = sct.monitors
-            monitor_index = self.monitor_combobox.currentData() or 1
-            if monitor_index < len(monitors):
-                selected_monitor = monitors[monitor_index]
-                selected_screen_size = QSize(selected_monitor["width"], selected_monitor["height"])
-            else:
-                selected_screen_size = QApplication.primaryScreen().size()
+        monitors = get_monitors()
+        monitor_index = self.monitor_combobox.currentData() or 1
+        if monitor_index < len(monitors):
+            selected_monitor = monitors[monitor_index]
+            selected_screen_size = QSize(selected_monitor["width"], selected_monitor["height"])
+        else:
+            selected_screen_size = QApplication.primaryScreen().size()
 
         editor = SegmentEditor(self.device, active_segments=active_segments, screen_size=selected_screen_size)
         editor.show()
@@ -2064,11 +2340,20 @@ class ColorPicker(QMainWindow):
         enabled = (state == Qt.CheckState.Checked.value)
         try:
             time_bindings.set_letterbox_detection(enabled)
+            if self.analysis_service is not None:
+                self.analysis_service.set_letterbox_detection(enabled)
             #print("Letterbox detection", "enabled" if enabled else "disabled")     # DEBUG
         except Exception as e:
             print("Error toggling letterbox detection:", e)
         self.save_settings()
 
+    def changeMetricChanged(self, index):
+        perceptual = self.change_metric_combobox.currentData() != "rgb"
+        self.component_threshold_spinbox.setEnabled(not perceptual)
+        self.manhattan_threshold_spinbox.setEnabled(not perceptual)
+        self.delta_e_threshold_spinbox.setEnabled(perceptual)
+        self.save_settings()
+
     def toggleColorBoost(self, state):
         if state == Qt.CheckState.Checked.value:
             self.color_boost_spinbox.setEnabled(True)
@@ -2843,6 +3128,14 @@ class ColorPicker(QMainWindow):
             QMessageBox.warning(self, "No Segments Selected",
                                 "The segments file is empty. Please select segments before syncing.")
             return
+        # Layouts may hold more zones than the device has; those above total_segments are analyzed but not sent.
+        invalid_segments = [key for key in segments_data
+                            if not (key.isdigit() and 1 <= int(key) <= time_numpy.MAX_SEGMENTS)]
+        if invalid_segments:
+            QMessageBox.warning(self, "Segments Error",
+                                f"segments.json contains segments {', '.join(invalid_segments)}, but segments "
+                                f"are numbered 1-{time_numpy.MAX_SEGMENTS}. Please edit the segments before syncing.")
+            return
 
         global DEVICEID, DEVICEIP, DEVICEKEY, DEVICEVERS
         # Update globals from the UI fields.
@@ -2878,7 +3171,19 @@ class ColorPicker(QMainWindow):
             QPixmap(resource_path("icons/green_icon.png")).scaled(
                 24, 24, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
         )
-        time_bindings.initScreenCapture()
+        if self.advanced_analysis_process:
+            # The child process captures, analyzes and saves its previous colors itself.
+            capture = self.capture_options()
+            monitor_index = capture.pop("monitor_index")
+            backend = "numpy" if time_bindings is time_numpy else "native"
+            self.analysis_service = AnalysisService(backend, monitor_index, capture,
+                                                    letterbox_detection=self.letterbox_checkbox.isChecked())
+        else:
+            time_bindings.initScreenCapture()
+            # Keep settings, segments and worker threads loaded for the whole sync session.
+            self.processor = time_bindings.Processor()
+            self.frame_source = self.open_frame_source()
+            self.snapshot_timer.start()
 
         # Create the worker thread and connect its errorOccurred signal to the error handler.
         self.worker = Worker(self.autoSetColors, self.device, self.reconnect_device)
@@ -2902,6 +3207,17 @@ class ColorPicker(QMainWindow):
             self.worker.stop()      # This sets self._running = False in the worker.
             self.commands = {}
             self.worker.wait()      # Wait until the worker thread finishes.
+            self.snapshot_timer.stop()
+            self.snapshot_prev_colors()
+            if self.processor is not None:
+                self.processor.close()
+                self.processor = None
+            if self.frame_source is not None:
+                self.frame_source.close()
+                self.frame_source = None
+            if self.analysis_service is not None:
+                self.analysis_service.close()
+                self.analysis_service = None
             #print("Syncing stopped.")      # DEBUG
 
 
@@ -2925,48 +3241,18 @@ class ColorPicker(QMainWindow):
                 time.sleep(5)
                 self.reconnect_device()
 
-    # Turn "off" inactive segments
+    # Turn "off" inactive segments. Only called when syncing starts and after editing segments,
+    # so the commands are always sent; the editor may just have lit these segments.
     def sendBlackToInactiveSegments(self):
         inactive_segments = [seg for seg, cb in self.segment_checkboxes.items() if not cb.isChecked()]
-        black_commands = {}
-        black_codes = {
-            1: "AAIAFAEAAAAAAACBFA==",
-            2: "AAIAFAEAAAAAAACBEw==",
-            3: "AAIAFAEAAAAAAACBEg==",
-            4: "AAIAFAEAAAAAAACBEQ==",
-            5: "AAIAFAEAAAAAAACBEA==",
-            6: "AAIAFAEAAAAAAACBDw==",
-            7: "AAIAFAEAAAAAAACBDg==",
-            8: "AAIAFAEAAAAAAACBDQ==",
-            9: "AAIAFAEAAAAAAACBDA==",
-            10: "AAIAFAEAAAAAAACBCw==",
-            11: "AAIAFAEAAAAAAACBCg==",
-            12: "AAIAFAEAAAAAAACBCQ==",
-            13: "AAIAFAEAAAAAAACBCA==",
-            14: "AAIAFAEAAAAAAACBBw==",
-            15: "AAIAFAEAAAAAAACBBg==",
-            16: "AAIAFAEAAAAAAACBBQ==",
-            17: "AAIAFAEAAAAAAACBBA==",
-            18: "AAIAFAEAAAAAAACBAw==",
-            19: "AAIAFAEAAAAAAACBAg==",
-            20: "AAIAFAEAAAAAAACBAQ=="
-        }
-
-        for seg in inactive_segments:
-            key = f"61_{seg}"
-            if self.prev_colors.get(seg) != black_codes[seg]:
-                black_commands[key] = black_codes[seg]
+        black_codes = segment_codes(BLACK_HSV)
+        black_commands = {f"61_{seg}": black_codes[seg] for seg in inactive_segments}
 
         if black_commands:
             payload = self.device.generate_payload(tinytuya.CONTROL, black_commands)
             #print(f"Generated Payload for black commands: {payload}")      # DEBUG
             self.device._send_receive(payload)
             #print(f"Control Data Command Sent for inactive segments: {black_commands}")    # DEBUG
-            for seg in inactive_segments:
-                if seg in black_codes:
-                    self.prev_colors[seg] = black_codes[seg]
-        #else:      # DEBUG
-            #print("All inactive segments are already black. No command sent.")     # DEBUG
 
     def send_and_verify(self, sorted_commands):
         retries = self.advanced_retries
@@ -3098,7 +3384,10 @@ class ColorPicker(QMainWindow):
                 except Exception as e:
                     self.reconnect_device()
 
-            result = call_cpp_processor()
+            if self.analysis_service is not None:
+                result = read_analysis_service(self.analysis_service)
+            else:
+                result = call_cpp_processor(self.processor, self.frame_source)
             commands_result = result.get("commands", {})
             # Convert to dict if needed.
             if isinstance(commands_result, str):
@@ -3115,6 +3404,9 @@ class ColorPicker(QMainWindow):
 
             # Process the commands. sendAllCommands will filter out commands that haven't changed.
             self.sendAllCommands()
+            captured_at = result.get("captured_at")
+            if captured_at is not None:
+                self.frameAgeUpdated.emit(time.perf_counter() - captured_at)
 
             # Now check for device errors.
             try:
@@ -3141,17 +3433,10 @@ class ColorPicker(QMainWindow):
     def sendAllCommands(self):
         if not isinstance(self.commands, dict):
             self.commands = {}
+        # The engine only returns commands for segments whose color changed from the last one
+        # it recorded as sent (its previous-color table), so only inactive segments are dropped.
         active_segment_numbers = [seg for seg, cb in self.segment_checkboxes.items() if cb.isChecked()]
-        new_commands = {}
-        for k, v in self.commands.items():
-            seg = int(k.split('_')[1])
-            if seg in active_segment_numbers:
-                # Create a canonical version of the command for comparison.
-                new_val = json.dumps(v, sort_keys=True)
-                old_val = self.prev_colors.get(seg)
-                if old_val != new_val:
-                    new_commands[k] = v
-        self.commands = new_commands
+        self.commands = {k: v for k, v in self.commands.items() if int(k.split('_')[1]) in active_segment_numbers}
         if not self.commands:
             self.last_no_color_change_time = time.time()
             return
@@ -3159,11 +3444,47 @@ class ColorPicker(QMainWindow):
             k: self.commands[k] for k in sorted(self.commands.keys(), key=lambda x: int(x.split('_')[1]))
         }
         if self.send_and_verify(sorted_commands):
-            # Update prev_colors with the canonical version.
-            for k, v in sorted_commands.items():
-                seg = int(k.split('_')[1])
-                self.prev_colors[seg] = json.dumps(v, sort_keys=True)
             self.last_command_time = time.time()
+        elif self.processor is not None:
+            # The processor already recorded these colors as sent. Forget them so the
+            # segments are reported as changed again on the next frame.
+            self.processor.forget([int(k.split('_')[1]) for k in sorted_commands])
+        elif self.analysis_service is not None:
+            self.analysis_service.forget(int(k.split('_')[1]) for k in sorted_commands)
+
+    def open_frame_source(self):
+        """Open the capture source selected in the advanced settings, or None for the engine's own capture."""
+        return open_frame_source(**self.capture_options())
+
+    def capture_options(self):
+        """Keyword arguments of frame_sources.open_frame_source() for the advanced capture settings."""
+        options = {
+            "kind": self.advanced_capture_source,
+            "monitor_index": self.monitor_combobox.currentData() or 1,
+            "rate": self.advanced_capture_rate,
+            "record_to": self.advanced_recording_file if self.advanced_record_frames else None,
+        }
+        if self.advanced_capture_source == "replay":
+            options["path"] = self.advanced_recording_file
+        return options
+
+    def update_frame_age(self, age):
+        """Show how old the last synced frame was when its commands were sent, and the detected picture area."""
+        self.frame_age = age
+        tooltip = f"Frame age: {age * 1000:.0f} ms (capture to send)"
+        letterbox = getattr(self.processor, "letterbox", None)
+        if letterbox is not None:
+            x, y, width, height = letterbox
+            tooltip += f"\nPicture area: {width}x{height} at ({x}, {y})"
+        self.syncIndicator.setToolTip(tooltip)
+
+    def snapshot_prev_colors(self):
+        """Save the processor's in-memory previous colors to prev_colors.txt."""
+        if self.processor is not None:
+            try:
+                self.processor.snapshot()
+            except Exception as e:
+                print(f"Error saving previous colors: {e}")
 
 
 
@@ -3194,6 +3515,10 @@ class ColorPicker(QMainWindow):
         self.color_boost_spinbox.setValue(1.0)
         self.component_threshold_spinbox.setValue(250)
         self.manhattan_threshold_spinbox.setValue(150.0)
+        self.change_metric_combobox.setCurrentIndex(self.change_metric_combobox.findData("rgb"))
+        self.delta_e_threshold_spinbox.setValue(5.0)
+        self.smoothing_mode_combobox.setCurrentIndex(self.smoothing_mode_combobox.findData("off"))
+        self.smoothing_time_spinbox.setValue(150)
         self.letterbox_checkbox.setChecked(True)
 
         # Reset active segments (check all segments):
@@ -3231,6 +3556,23 @@ class ColorPicker(QMainWindow):
         self.advanced_command_elapsed_threshold = self.advanced_defaults["command_elapsed_threshold"]
         self.advanced_max_ping_time = self.advanced_defaults["max_ping_time"]
         self.advanced_overlay_opacity = self.advanced_defaults["overlay_opacity"]
+        self.advanced_analysis_backend = self.advanced_defaults["analysis_backend"]
+        self.advanced_analysis_mode = self.advanced_defaults["analysis_mode"]
+        self.advanced_sampling_mode = self.advanced_defaults["sampling_mode"]
+        self.advanced_sampling_stride = self.advanced_defaults["sampling_stride"]
+        self.advanced_sample_count = self.advanced_defaults["sample_count"]
+        self.advanced_color_method = self.advanced_defaults["color_method"]
+        self.advanced_palette_clusters = self.advanced_defaults["palette_clusters"]
+        self.advanced_palette_iterations = self.advanced_defaults["palette_iterations"]
+        self.advanced_analysis_scale = self.advanced_defaults["analysis_scale"]
+        self.advanced_capture_source = self.advanced_defaults["capture_source"]
+        self.advanced_capture_regions = self.advanced_defaults["capture_regions"]
+        self.advanced_capture_rate = self.advanced_defaults["capture_rate"]
+        self.advanced_signature_tolerance = self.advanced_defaults["signature_tolerance"]
+        self.advanced_edge_weighting = self.advanced_defaults["edge_weighting"]
+        self.advanced_record_frames = self.advanced_defaults["record_frames"]
+        self.advanced_recording_file = self.advanced_defaults["recording_file"]
+        self.advanced_analysis_process = self.advanced_defaults["analysis_process"]
 
         # Update the spin boxes to reflect these default values.
         self.retries_spinbox.setValue(self.advanced_retries)
@@ -3245,6 +3587,23 @@ class ColorPicker(QMainWindow):
         self.max_ping_time_spinbox.setValue(self.advanced_max_ping_time)
         self.overlay_opacity_spinbox.setValue(self.advanced_overlay_opacity)
         self.threshold_value_spinbox.setValue(self.advanced_defaults["threshold_value"])
+        self.analysis_backend_combobox.setCurrentIndex(self.analysis_backend_combobox.findData(self.advanced_analysis_backend))
+        self.analysis_mode_combobox.setCurrentIndex(self.analysis_mode_combobox.findData(self.advanced_analysis_mode))
+        self.sampling_mode_combobox.setCurrentIndex(self.sampling_mode_combobox.findData(self.advanced_sampling_mode))
+        self.sampling_stride_spinbox.setValue(self.advanced_sampling_stride)
+        self.sample_count_spinbox.setValue(self.advanced_sample_count)
+        self.color_method_combobox.setCurrentIndex(self.color_method_combobox.findData(self.advanced_color_method))
+        self.palette_clusters_spinbox.setValue(self.advanced_palette_clusters)
+        self.palette_iterations_spinbox.setValue(self.advanced_palette_iterations)
+        self.analysis_scale_combobox.setCurrentIndex(self.analysis_scale_combobox.findData(self.advanced_analysis_scale))
+        self.capture_source_combobox.setCurrentIndex(self.capture_source_combobox.findData(self.advanced_capture_source))
+        self.capture_regions_combobox.setCurrentIndex(self.capture_regions_combobox.findData(self.advanced_capture_regions))
+        self.capture_rate_spinbox.setValue(self.advanced_capture_rate)
+        self.signature_tolerance_spinbox.setValue(self.advanced_signature_tolerance)
+        self.edge_weighting_combobox.setCurrentIndex(self.edge_weighting_combobox.findData(self.advanced_edge_weighting))
+        self.record_frames_combobox.setCurrentIndex(self.record_frames_combobox.findData(self.advanced_record_frames))
+        self.recording_file_lineedit.setText(self.advanced_recording_file)
+        self.analysis_process_combobox.setCurrentIndex(self.analysis_process_combobox.findData(self.advanced_analysis_process))
 
         self.save_settings()
         #print("Advanced settings have been reset to defaults.")        # DEBUG
@@ -3278,6 +3637,40 @@ class ColorPicker(QMainWindow):
             self.advanced_max_ping_time = value
         elif key == 'overlay_opacity':
             self.advanced_overlay_opacity = value
+        elif key == 'analysis_backend':
+            self.advanced_analysis_backend = value
+        elif key == 'analysis_mode':
+            self.advanced_analysis_mode = value
+        elif key == 'sampling_mode':
+            self.advanced_sampling_mode = value
+        elif key == 'sampling_stride':
+            self.advanced_sampling_stride = value
+        elif key == 'sample_count':
+            self.advanced_sample_count = value
+        elif key == 'color_method':
+            self.advanced_color_method = value
+        elif key == 'palette_clusters':
+            self.advanced_palette_clusters = value
+        elif key == 'palette_iterations':
+            self.advanced_palette_iterations = value
+        elif key == 'analysis_scale':
+            self.advanced_analysis_scale = value
+        elif key == 'capture_source':
+            self.advanced_capture_source = value
+        elif key == 'capture_regions':
+            self.advanced_capture_regions = value
+        elif key == 'capture_rate':
+            self.advanced_capture_rate = value
+        elif key == 'signature_tolerance':
+            self.advanced_signature_tolerance = value
+        elif key == 'edge_weighting':
+            self.advanced_edge_weighting = value
+        elif key == 'record_frames':
+            self.advanced_record_frames = value
+        elif key == 'recording_file':
+            self.advanced_recording_file = value
+        elif key == 'analysis_process':
+            self.advanced_analysis_process = value
         self.save_settings()
 
     def save_device_setup(self):
@@ -3305,6 +3698,10 @@ class ColorPicker(QMainWindow):
             "color_boost_factor": self.color_boost_spinbox.value(),
             "component_threshold": self.component_threshold_spinbox.value(),
             "manhattan_threshold": self.manhattan_threshold_spinbox.value(),
+            "change_metric": self.change_metric_combobox.currentData(),
+            "delta_e_threshold": self.delta_e_threshold_spinbox.value(),
+            "smoothing_mode": self.smoothing_mode_combobox.currentData(),
+            "smoothing_time": self.smoothing_time_spinbox.value(),
             "enable_letterbox_detection": self.letterbox_checkbox.isChecked(),
             # Advanced settings:
             "retries": self.advanced_retries,
@@ -3319,6 +3716,23 @@ class ColorPicker(QMainWindow):
             "max_ping_time": self.advanced_max_ping_time,
             "overlay_opacity": self.advanced_overlay_opacity,
             "threshold_value": self.threshold_value_spinbox.value(),
+            "analysis_backend": self.advanced_analysis_backend,
+            "analysis_mode": self.advanced_analysis_mode,
+            "sampling_mode": self.advanced_sampling_mode,
+            "sampling_stride": self.advanced_sampling_stride,
+            "sample_count": self.advanced_sample_count,
+            "color_method": self.advanced_color_method,
+            "palette_clusters": self.advanced_palette_clusters,
+            "palette_iterations": self.advanced_palette_iterations,
+            "analysis_scale": self.advanced_analysis_scale,
+            "capture_source": self.advanced_capture_source,
+            "capture_regions": self.advanced_capture_regions,
+            "capture_rate": self.advanced_capture_rate,
+            "signature_tolerance": self.advanced_signature_tolerance,
+            "edge_weighting": self.advanced_edge_weighting,
+            "record_frames": self.advanced_record_frames,
+            "recording_file": self.advanced_recording_file,
+            "analysis_process": self.advanced_analysis_process,
 
             # Device Setup details:
             "device_id": self.device_id_lineedit.text(),
@@ -3367,6 +3781,10 @@ class ColorPicker(QMainWindow):
         self.color_boost_spinbox.setValue(settings.get("color_boost_factor", 1.0))
         self.component_threshold_spinbox.setValue(settings.get("component_threshold", 250))
         self.manhattan_threshold_spinbox.setValue(settings.get("manhattan_threshold", 150.0))
+        self.change_metric_combobox.setCurrentIndex(max(0, self.change_metric_combobox.findData(settings.get("change_metric", "rgb"))))
+        self.delta_e_threshold_spinbox.setValue(settings.get("delta_e_threshold", 5.0))
+        self.smoothing_mode_combobox.setCurrentIndex(max(0, self.smoothing_mode_combobox.findData(settings.get("smoothing_mode", "off"))))
+        self.smoothing_time_spinbox.setValue(settings.get("smoothing_time", 150))
         self.letterbox_checkbox.setChecked(settings.get("enable_letterbox_detection", True))
 
         # Load advanced settings.
@@ -3381,6 +3799,25 @@ class ColorPicker(QMainWindow):
         self.advanced_command_elapsed_threshold = settings.get("command_elapsed_threshold", self.advanced_defaults["command_elapsed_threshold"])
         self.advanced_max_ping_time = settings.get("max_ping_time", self.advanced_defaults["max_ping_time"])
         self.advanced_overlay_opacity = settings.get("overlay_opacity", self.advanced_defaults["overlay_opacity"])
+        self.advanced_analysis_backend = settings.get("analysis_backend", self.advanced_defaults["analysis_backend"])
+        self.advanced_analysis_mode = settings.get("analysis_mode", self.advanced_defaults["analysis_mode"])
+        if self.advanced_analysis_mode == "labelmap" and time_bindings is not time_numpy:
+            self.advanced_analysis_mode = "roi"  # Label maps are only available in the NumPy engine
+        self.advanced_sampling_mode = settings.get("sampling_mode", self.advanced_defaults["sampling_mode"])
+        self.advanced_sampling_stride = settings.get("sampling_stride", self.advanced_defaults["sampling_stride"])
+        self.advanced_sample_count = settings.get("sample_count", self.advanced_defaults["sample_count"])
+        self.advanced_color_method = settings.get("color_method", self.advanced_defaults["color_method"])
+        self.advanced_palette_clusters = settings.get("palette_clusters", self.advanced_defaults["palette_clusters"])
+        self.advanced_palette_iterations = settings.get("palette_iterations", self.advanced_defaults["palette_iterations"])
+        self.advanced_analysis_scale = settings.get("analysis_scale", self.advanced_defaults["analysis_scale"])
+        self.advanced_capture_source = settings.get("capture_source", self.advanced_defaults["capture_source"])
+        self.advanced_capture_regions = settings.get("capture_regions", self.advanced_defaults["capture_regions"])
+        self.advanced_capture_rate = settings.get("capture_rate", self.advanced_defaults["capture_rate"])
+        self.advanced_signature_tolerance = settings.get("signature_tolerance", self.advanced_defaults["signature_tolerance"])
+        self.advanced_edge_weighting = settings.get("edge_weighting", self.advanced_defaults["edge_weighting"])
+        self.advanced_record_frames = settings.get("record_frames", self.advanced_defaults["record_frames"])
+        self.advanced_recording_file = settings.get("recording_file", self.advanced_defaults["recording_file"])
+        self.advanced_analysis_process = settings.get("analysis_process", self.advanced_defaults["analysis_process"])
 
         self.retries_spinbox.setValue(self.advanced_retries)
         self.max_sleep_spinbox.setValue(self.advanced_max_sleep_interval)
@@ -3394,6 +3831,23 @@ class ColorPicker(QMainWindow):
         self.max_ping_time_spinbox.setValue(self.advanced_max_ping_time)
         self.overlay_opacity_spinbox.setValue(self.advanced_overlay_opacity)
         self.threshold_value_spinbox.setValue(settings.get("threshold_value", 10))
+        self.analysis_backend_combobox.setCurrentIndex(self.analysis_backend_combobox.findData(self.advanced_analysis_backend))
+        self.analysis_mode_combobox.setCurrentIndex(self.analysis_mode_combobox.findData(self.advanced_analysis_mode))
+        self.sampling_mode_combobox.setCurrentIndex(self.sampling_mode_combobox.findData(self.advanced_sampling_mode))
+        self.sampling_stride_spinbox.setValue(self.advanced_sampling_stride)
+        self.sample_count_spinbox.setValue(self.advanced_sample_count)
+        self.color_method_combobox.setCurrentIndex(self.color_method_combobox.findData(self.advanced_color_method))
+        self.palette_clusters_spinbox.setValue(self.advanced_palette_clusters)
+        self.palette_iterations_spinbox.setValue(self.advanced_palette_iterations)
+        self.analysis_scale_combobox.setCurrentIndex(self.analysis_scale_combobox.findData(self.advanced_analysis_scale))
+        self.capture_source_combobox.setCurrentIndex(self.capture_source_combobox.findData(self.advanced_capture_source))
+        self.capture_regions_combobox.setCurrentIndex(self.capture_regions_combobox.findData(self.advanced_capture_regions))
+        self.capture_rate_spinbox.setValue(self.advanced_capture_rate)
+        self.signature_tolerance_spinbox.setValue(self.advanced_signature_tolerance)
+        self.edge_weighting_combobox.setCurrentIndex(self.edge_weighting_combobox.findData(self.advanced_edge_weighting))
+        self.record_frames_combobox.setCurrentIndex(self.record_frames_combobox.findData(self.advanced_record_frames))
+        self.recording_file_lineedit.setText(self.advanced_recording_file)
+        self.analysis_process_combobox.setCurrentIndex(self.analysis_process_combobox.findData(self.advanced_analysis_process))
         theme_index = settings.get("theme_index", 0)
         self.theme_combobox.setCurrentIndex(theme_index)
         self.change_theme(theme_index)
@@ -3435,6 +3889,7 @@ class ColorPicker(QMainWindow):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # The analysis process re-runs this script in frozen builds
     app = QApplication(sys.argv)
 
     # Create a splash screen with an image 
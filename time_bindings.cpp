@@ -1,33 +1,163 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
+#include <cstring>
 #include <sstream>
 #include <iostream>
 #include "time.cpp"  // Include existing C++ code
 
 namespace py = pybind11;
 
-// Function to capture the C++ output and return it as a Python string
+// One-shot processing kept for existing callers. It shares a single Processor so the
+// settings, segments and worker threads are not rebuilt on every call.
 std::string process_screen() {
-    std::ostringstream buffer;
-    std::streambuf* oldCoutStreamBuf = std::cout.rdbuf();
-    std::cout.rdbuf(buffer.rdbuf());  // Redirect std::cout to buffer
-
-    int result = main();  // Call the original main function
+    // Intentionally never destroyed: joining worker threads during module unload can deadlock.
+    static Processor* processor = new Processor();
+    return processor->process();
+}
 
-    std::cout.rdbuf(oldCoutStreamBuf);  // Restore the original std::cout
+// Wrap a contiguous (rows, cols, 3) uint8 BGR array as a cv::Mat without copying.
+cv::Mat toMat(const py::array_t<uint8_t, py::array::c_style | py::array::forcecast>& image) {
+    if (image.ndim() != 3 || image.shape(2) != 3) {
+        throw std::invalid_argument("Expected a (rows, cols, 3) uint8 BGR array.");
+    }
+    return cv::Mat(static_cast<int>(image.shape(0)), static_cast<int>(image.shape(1)), CV_8UC3,
+                   const_cast<uint8_t*>(image.data()));
+}
 
-    if (result != 0) {
-        throw std::runtime_error("C++ process encountered an error.");
+// Copy a (rows, cols, 3 or 4) uint8 BGR/BGRA frame from a Python frame source into an owned
+// cv::Mat. Frames keep their channel layout; the engine reads both (see grayConversion()).
+// None means "capture".
+cv::Mat toFrame(const py::object& frame) {
+    if (frame.is_none()) {
+        return cv::Mat();
     }
+    auto array = py::array_t<uint8_t, py::array::c_style | py::array::forcecast>::ensure(frame);
+    if (!array || array.ndim() != 3 || (array.shape(2) != 3 && array.shape(2) != 4)) {
+        throw std::invalid_argument("Expected a (rows, cols, 3 or 4) uint8 BGR or BGRA frame.");
+    }
+    int channels = static_cast<int>(array.shape(2));
+    cv::Mat view(static_cast<int>(array.shape(0)), static_cast<int>(array.shape(1)), CV_8UC(channels),
+                 const_cast<uint8_t*>(array.data()));
+    return view.clone();  // Frame sources reuse their buffers
+}
 
-    return buffer.str();
+// Copy a CV_8UC3 cv::Mat into a new (rows, cols, 3) NumPy array.
+py::array_t<uint8_t> toArray(const cv::Mat& image) {
+    cv::Mat continuous = image.isContinuous() ? image : image.clone();
+    py::array_t<uint8_t> result({continuous.rows, continuous.cols, 3});
+    std::memcpy(result.mutable_data(), continuous.data, continuous.total() * continuous.elemSize());
+    return result;
 }
 
-PYBIND11_MODULE(time_bindings, m) {
-    m.def("process_screen", &process_screen, "Process screen and return JSON output");
-    m.def("set_letterbox_detection", &set_letterbox_detection, "Set letterbox detection flag");
-    m.def("initScreenCapture", &initScreenCapture, "Initialize screen capture resources");
-    m.def("switchMonitorCapture", &switchMonitorCapture, "Switch screen capture to the newly selected monitor");
+// Convert a FrameResult into a NumPy structured array of all segments and a dict of
+// ready-to-send DPS 61 commands keyed as "61_<segment>".
+py::tuple toPython(const FrameResult& result) {
+    py::array_t<SegmentRecord> segments(static_cast<py::ssize_t>(result.segments.size()));
+    if (!result.segments.empty()) {
+        std::memcpy(segments.mutable_data(), result.segments.data(),
+                    result.segments.size() * sizeof(SegmentRecord));
+    }
+    py::dict commands;
+    for (const auto& [segment, command] : result.commands) {
+        commands[py::str("61_" + std::to_string(segment))] = py::str(command);
+    }
+    return py::make_tuple(segments, commands);
 }
 
+PYBIND11_MODULE(time_bindings, m) {
+    PYBIND11_NUMPY_DTYPE(SegmentRecord, segment, r, g, b, h, s, v, changed);
 
+    py::class_<Processor>(m, "Processor")
+        .def(py::init<>(), "Load settings, segments and previous colors and start the worker threads")
+        .def("process", &Processor::process, py::call_guard<py::gil_scoped_release>(),
+             "Capture and process one frame and return JSON output")
+        .def("analyze", [](Processor& self, py::object frame) {
+                cv::Mat image = toFrame(frame);
+                FrameResult result;
+                {
+                    py::gil_scoped_release release;
+                    result = self.analyze(image);
+                }
+                return toPython(result);
+            }, py::arg("frame") = py::none(),
+            "Process a BGR/BGRA frame (or capture one) and return (segments, commands) without JSON")
+        .def("submit", [](Processor& self, py::object frame) {
+                cv::Mat image = toFrame(frame);  // Owned copy; frame sources reuse their buffers
+                py::gil_scoped_release release;
+                return self.submit(image);
+            }, py::arg("frame") = py::none(),
+            "Start analyzing the next frame in the background; False if one is already pending")
+        .def_property_readonly("letterbox", [](const Processor& self) -> py::object {
+                cv::Rect content = self.letterboxRect();
+                if (content.empty()) {
+                    return py::none();
+                }
+                return py::make_tuple(content.x, content.y, content.width, content.height);
+            }, "(x, y, width, height) of the picture inside the detected black bars in frame pixels, or None")
+        .def_property_readonly("pending", &Processor::hasPending,
+             "True while a submitted frame has not been collected with poll() or wait()")
+        .def("poll", [](Processor& self) -> py::object {
+                std::optional<FrameResult> result = self.poll();
+                if (!result) {
+                    return py::none();
+                }
+                return toPython(*result);
+            }, "Return (segments, commands) of the submitted frame if it is ready, otherwise None")
+        .def("wait", [](Processor& self) {
+                FrameResult result;
+                {
+                    py::gil_scoped_release release;
+                    result = self.wait();
+                }
+                return toPython(result);
+            }, "Block until the submitted frame is ready and return (segments, commands)")
+        .def("reload", &Processor::reload, py::call_guard<py::gil_scoped_release>(),
+             "Re-read settings.json and segments.json")
+        .def_property_readonly("prev_colors", [](py::object self) {
+                const ColorTable& table = self.cast<Processor&>().previousColors();
+                // Read-only view that keeps the Processor alive while it exists; use forget() to
+                // clear entries, since analyze() updates the table on another thread.
+                py::array_t<int16_t> view({kSegmentSlots, 3}, {3 * sizeof(int16_t), sizeof(int16_t)},
+                                          table[0].data(), self);
+                view.attr("setflags")(py::arg("write") = false);
+                return view;
+            }, "(21, 3) int16 read-only view of the previous RGB color of each segment; -1 means none")
+        .def("forget", &Processor::forget, py::arg("segments"), py::call_guard<py::gil_scoped_release>(),
+             "Drop the previous colors of the segments so they are reported as changed on the next frame")
+        .def("snapshot", &Processor::snapshot, py::call_guard<py::gil_scoped_release>(),
+             "Write the previous colors to prev_colors.txt")
+        .def("close", [](Processor& self) {
+                if (self.hasPending()) {
+                    self.wait();
+                }
+            }, py::call_guard<py::gil_scoped_release>(),
+            "Wait for a submitted frame; the worker threads stop when the Processor is destroyed");
+
+    m.def("process_screen", &process_screen, py::call_guard<py::gil_scoped_release>(),
+          "Process screen and return JSON output");
+    m.def("computeDominantColor", [](py::array_t<uint8_t, py::array::c_style | py::array::forcecast> roi) {
+            cv::Vec3b color = computeDominantColor(toMat(roi));
+            return py::make_tuple(color[0], color[1], color[2]);
+        }, "Compute the dominant color in the given region of interest (ROI) as a BGR tuple");
+    m.def("cropBlackBars", [](py::array_t<uint8_t, py::array::c_style | py::array::forcecast> image,
+                              int threshold_value, int margin) {
+            return toArray(cropBlackBars(toMat(image), threshold_value, margin));
+        }, py::arg("image"), py::arg("threshold_value") = 10, py::arg("margin") = 20,
+        "Remove symmetric black bars from the image and stretch the content back to full size");
+    m.def("encodeCommand", [](int segment, int hue, int sat, int val) {
+            return encodeCommand(segment, cv::Vec3i(hue, sat, val));
+        }, py::arg("segment"), py::arg("hue"), py::arg("sat"), py::arg("val"),
+        "Encode device HSV values (hue 0-360, saturation and value 0-1000) into the DPS 61 payload for a segment");
+    m.def("buildCommand", [](int segment, std::tuple<int, int, int> color) {
+            cv::Vec3b bgr(cv::saturate_cast<uchar>(std::get<0>(color)),
+                          cv::saturate_cast<uchar>(std::get<1>(color)),
+                          cv::saturate_cast<uchar>(std::get<2>(color)));
+            return buildCommand(segment, bgr);
+        }, "Build the command payload for a given segment and BGR color");
+    m.def("set_letterbox_detection", &set_letterbox_detection, "Set letterbox detection flag");
+    m.def("initScreenCapture", &initScreenCapture, py::call_guard<py::gil_scoped_release>(),
+          "Initialize screen capture resources");
+    m.def("switchMonitorCapture", &switchMonitorCapture, py::call_guard<py::gil_scoped_release>(),
+          "Switch screen capture to the newly selected monitor");
+}
@@ -0,0 +1,1436 @@
+"""Portable NumPy implementation of the time_bindings API.
+
+This module mirrors the functions and the Processor class exported by the compiled
+time_bindings module (built from time.cpp) so it can be used as a drop-in analysis
+backend on platforms without the Windows-only .pyd, and as a reference to compare the
+native engine against. Screen capture uses a persistent mss session (see frame_sources)
+instead of the Windows GDI API, and Processor.analyze/submit also accept frames from any
+other FrameSource.
+
+The dominant-color computation is vectorized across all segments: the pixels of every
+segment are gathered into one array and a single bincount builds all of the 180-bin
+hue histograms at once. Segments are split into one group per CPU core and the groups
+are analyzed in parallel. The "labelmap" analysis mode instead labels every pixel once
+with the segments covering it and analyzes all segments in a single pass (see LabelMap).
+"""
+import base64
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from frame_sources import MssFrameSource, pack_capture_regions, plan_capture_regions
+
+SETTINGS_FILE = "settings.json"
+SEGMENT_FILE = "segments.json"
+COLOR_FILE = "prev_colors.txt"
+
+DEVICE_SEGMENTS = 20  # The DPS 61 payload addresses segments 1-20; only those get commands
+MAX_SEGMENTS = 256  # Segments a layout may define; the others are analyzed but not sent
+SEGMENT_SLOTS = MAX_SEGMENTS + 1  # Rows of the previous-color table; row 0 is unused
+HUE_BINS = 180  # Hue values range from 0 to 179 (OpenCV 8-bit convention)
+SIGNATURE_GRID = 4  # Change signatures are the mean colors of a 4x4 grid over each segment
+MOTION_DIVISOR = 4  # Motion and edges are measured at 1/4 of the analysis resolution
+ONE_EURO_BETA = 0.05  # One-euro cutoff increase (Hz) per color unit per second of change
+ONE_EURO_DERIVATIVE_CUTOFF = 1.0  # Hz
+MAX_SMOOTHING_STEP = 1.0  # Longer gaps between frames are treated as one second
+LETTERBOX_INTERVAL = 30  # Frames between full letterbox detections while the edges look the same
+LETTERBOX_CONFIRM = 3  # Consecutive detections needed before the letterbox changes
+PALETTE_SAMPLES = 1024  # Samples per segment for the palette method without a sampling mode
+PALETTE_MAX_ITERATIONS = 8  # k-means iterations per segment and frame at most
+PALETTE_CONVERGENCE = 1.0  # Stop once no centroid moves further than this
+PALETTE_GRAY_WEIGHT = 16.0  # Weight of a gray pixel; saturated pixels weigh up to 271
+
+# Device HSV (hue 0-360, saturation and value 0-1000) of the fixed segment colors.
+BLACK_HSV = (0, 0, 0)
+HIGHLIGHT_HSV = (16, 1000, 1000)  # Orange, marks the selected segment in the editor
+
+# Same weights cv::cvtColor uses for BGR -> grayscale.
+GRAY_WEIGHTS = np.array([0.114, 0.587, 0.299])
+
+# sRGB -> CIE XYZ (D65) for linear R, G, B, and the D65 reference white.
+RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                       [0.2126729, 0.7151522, 0.0721750],
+                       [0.0193339, 0.1191920, 0.9503041]])
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+# Structured result layout, matching SegmentRecord in time.cpp.
+SEGMENT_DTYPE = np.dtype([
+    ("segment", np.int32),
+    ("r", np.uint8),
+    ("g", np.uint8),
+    ("b", np.uint8),
+    ("h", np.uint16),  # Device ranges: hue 0-360, saturation and value 0-1000
+    ("s", np.uint16),
+    ("v", np.uint16),
+    ("changed", np.bool_),
+], align=True)
+
+# Settings read from settings.json, with the same defaults as time.cpp.
+settings = {
+    "set_uniform_brightness": False,
+    "uniform_brightness": 500,
+    "set_color_boost": False,
+    "color_boost_factor": 1.0,
+    "component_threshold": 250,
+    "manhattan_threshold": 150.0,
+    "threshold_value": 10,
+    "analysis_mode": "roi",  # "roi" gathers each segment's pixels, "labelmap" uses a per-pixel label map,
+                             # "mean" averages each segment from an integral image
+    "sampling_mode": "full",  # "full", "stride", "blue_noise" or "count"
+    "sampling_stride": 4,
+    "sample_count": 2000,
+    "analysis_scale": 1,  # Analysis resolution divisor: 1, 2, 4 or 8
+    "capture_regions": True,  # Capture only the areas covered by segments (without letterbox detection)
+    "signature_tolerance": 2,  # Reuse a segment's color while its signature moves less than this; 0 disables
+    "smoothing_mode": "off",  # "off", "ema", "one_euro" or "spring"
+    "smoothing_time": 150,  # Smoothing time constant in milliseconds
+    "change_metric": "rgb",  # "rgb" uses the two thresholds above, "cie76" and "ciede2000" use delta_e_threshold
+    "delta_e_threshold": 5.0,  # Minimum perceptual (CIELAB delta E) difference for a change
+    "edge_weighting": True,  # Boost the saturation of segments with strong edges
+    "color_method": "histogram",  # "histogram" (most frequent hue) or "palette" (weighted k-means, always per ROI)
+    "palette_clusters": 4,  # Clusters per segment for the "palette" method
+    "palette_iterations": 64,  # k-means iterations per frame, shared by all segments
+}
+enable_letterbox_detection = True
+monitor_index = 1  # Default to primary monitor
+
+# Each thread keeps its own frame source; the generation forces a new one after a monitor switch.
+_capture = threading.local()
+_capture_generation = 0
+
+
+        ########################
+        #   SETTINGS & FILES   #
+        ########################
+
+def set_letterbox_detection(enable):
+    """Set letterbox detection flag."""
+    global enable_letterbox_detection
+    enable_letterbox_detection = bool(enable)
+
+
+def load_settings():
+    """Load settings from the JSON file saved by the UI."""
+    try:
+        with open(SETTINGS_FILE, "r") as file:
+            loaded = json.load(file)
+    except (IOError, ValueError):
+        print("Error: Unable to open settings.json. Using default settings.", file=sys.stderr)
+        return
+    for key in settings:
+        if key in loaded:
+            settings[key] = loaded[key]
+
+
+def load_segment_data(filename=SEGMENT_FILE):
+    """Load segment rectangles as {segment: (x, y, width, height)}, ordered by segment.
+
+    Layouts may define up to MAX_SEGMENTS segments; only segments 1-DEVICE_SEGMENTS are
+    sent to the device. A layout with other segment numbers is rejected as a whole, like an
+    unreadable file.
+    """
+    try:
+        with open(filename, "r") as file:
+            root = json.load(file)
+    except (IOError, ValueError):
+        return {}
+    segments = {}
+    for key in sorted(root, key=int):
+        data = root[key]
+        segments[int(key)] = (int(data["x"]), int(data["y"]), int(data["width"]), int(data["height"]))
+    invalid = [segment for segment in segments if not 1 <= segment <= MAX_SEGMENTS]
+    if invalid:
+        print(f"Error: {filename} uses segments {invalid}, but segments are numbered "
+              f"1-{MAX_SEGMENTS}. The segment layout is not loaded.", file=sys.stderr)
+        return {}
+    return segments
+
+
+def load_prev_colors(filename=COLOR_FILE):
+    """Load the previous colors as {segment: (r, g, b)}, defaulting all device segments to black."""
+    prev_colors = {}
+    try:
+        with open(filename, "r") as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 4:
+                    segment, r, g, b = (int(p) for p in parts)
+                    prev_colors[segment] = (r, g, b)
+    except (IOError, ValueError):
+        prev_colors = {segment: (0, 0, 0) for segment in range(1, DEVICE_SEGMENTS + 1)}
+    return prev_colors
+
+
+def save_prev_colors(prev_colors, filename=COLOR_FILE):
+    """Save the previous colors for the next run."""
+    try:
+        with open(filename, "w") as file:
+            for segment, (r, g, b) in sorted(prev_colors.items()):
+                file.write(f"{segment} {r} {g} {b}\n")
+    except IOError:
+        pass
+
+
+def to_color_table(prev_colors):
+    """Convert {segment: (r, g, b)} to the (SEGMENT_SLOTS, 3) int16 table; -1 marks no previous color."""
+    table = np.full((SEGMENT_SLOTS, 3), -1, dtype=np.int16)
+    for segment, color in prev_colors.items():
+        if 0 < segment < SEGMENT_SLOTS:
+            table[segment] = color
+    return table
+
+
+def to_color_map(table):
+    """Convert the previous-color table back to {segment: (r, g, b)}."""
+    return {segment: tuple(int(c) for c in table[segment])
+            for segment in range(1, SEGMENT_SLOTS) if table[segment, 0] >= 0}
+
+
+def file_stamp(filename):
+    """Return the modification time of a file, or None if it does not exist."""
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+        ########################
+        #    SCREEN CAPTURE    #
+        ########################
+
+def initScreenCapture():
+    """Initialize screen capture resources for the monitor selected in settings.json."""
+    global monitor_index, _capture_generation
+    try:
+        with open(SETTINGS_FILE, "r") as file:
+            monitor_index = int(json.load(file).get("selected_monitor_index", 1) or 1)
+    except (IOError, ValueError, TypeError):
+        print("Failed to open settings.json. Using default monitor.", file=sys.stderr)
+    _capture_generation += 1
+
+
+def switchMonitorCapture():
+    """Switch screen capture to the newly selected monitor."""
+    initScreenCapture()
+
+
+def capture_source():
+    """The calling thread's frame source for the selected monitor."""
+    source = getattr(_capture, "source", None)
+    if source is None or _capture.generation != _capture_generation:
+        source = _capture.source = MssFrameSource(monitor_index)
+        _capture.generation = _capture_generation
+    return source
+
+
+def capture_screen():
+    """Capture the selected monitor and return an HxWx3 BGR view of the frame, or None."""
+    return capture_source().grab()
+
+
+def capture_screen_regions(regions, canvas):
+    """Capture only the given regions of the selected monitor, packed into one frame (see plan_capture_regions)."""
+    return capture_source().grab_regions(regions, canvas)
+
+
+        ########################
+        #   COLOR CONVERSION   #
+        ########################
+
+def compute_hue(b, g, r):
+    """OpenCV-style hue (0-179) for broadcastable int16 B, G and R arrays."""
+    v = np.maximum(np.maximum(b, g), r)
+    diff = v - np.minimum(np.minimum(b, g), r)
+    safe_diff = np.maximum(diff, 1)
+    hue = np.where(v == r, 60.0 * (g - b) / safe_diff,
+                   np.where(v == g, 120.0 + 60.0 * (b - r) / safe_diff, 240.0 + 60.0 * (r - g) / safe_diff))
+    hue[diff == 0] = 0.0
+    hue[hue < 0] += 360.0
+    return np.rint(hue / 2).astype(np.int32) % HUE_BINS
+
+
+_hue_lut = None
+
+
+def hue_lut():
+    """Hue of every 24-bit BGR color, indexed by b | g << 8 | r << 16 (built once, 16 MB)."""
+    global _hue_lut
+    if _hue_lut is None:
+        lut = np.empty(1 << 24, np.uint8)
+        g = np.arange(256, dtype=np.int16)[:, None]
+        b = np.arange(256, dtype=np.int16)[None, :]
+        for r in range(256):
+            lut[r << 16:(r + 1) << 16] = compute_hue(b, g, np.int16(r)).reshape(-1)
+        _hue_lut = lut
+    return _hue_lut
+
+
+def hue_channel(pixels):
+    """Return the OpenCV-style hue (0-179) of an (..., 3) BGR uint8 array."""
+    index = pixels[..., 0].astype(np.int32)
+    index |= pixels[..., 1].astype(np.int32) << 8
+    index |= pixels[..., 2].astype(np.int32) << 16
+    return hue_lut()[index]
+
+
+def bgr_to_hsv(colors):
+    """Convert an (N, 3) BGR array to OpenCV-style HSV (H 0-179, S and V 0-255) as floats."""
+    colors = np.asarray(colors, dtype=np.float64)
+    v = colors.max(axis=-1)
+    diff = v - colors.min(axis=-1)
+    s = np.where(v > 0, 255.0 * diff / np.maximum(v, 1), 0.0)
+    h = hue_channel(np.clip(colors, 0, 255).astype(np.uint8)).astype(np.float64)
+    return np.stack([h, np.rint(s), v], axis=-1)
+
+
+def hsv_to_bgr(hsv):
+    """Convert OpenCV-style HSV (H 0-179, S and V 0-255) back to an (N, 3) BGR uint8 array."""
+    hsv = np.asarray(hsv, dtype=np.float64)
+    h = (hsv[..., 0] * 2.0 % 360.0) / 60.0
+    s = hsv[..., 1] / 255.0
+    v = hsv[..., 2]
+    sector = np.floor(h).astype(np.int32) % 6
+    f = h - np.floor(h)
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    r = np.choose(sector, [v, q, p, p, t, v])
+    g = np.choose(sector, [t, v, v, q, p, p])
+    b = np.choose(sector, [p, p, t, v, v, q])
+    return np.clip(np.rint(np.stack([b, g, r], axis=-1)), 0, 255).astype(np.uint8)
+
+
+def srgb_linear_table():
+    """Linear light of every 8-bit sRGB channel value (the sRGB transfer curve inverted)."""
+    c = np.arange(256) / 255.0
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+SRGB_LINEAR = srgb_linear_table()
+
+
+def rgb_to_lab(rgb):
+    """Convert an (N, 3) uint8 RGB array to CIELAB (D65) as floats."""
+    linear = SRGB_LINEAR[np.asarray(rgb, dtype=np.intp)]
+    xyz = linear @ RGB_TO_XYZ.T / D65_WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116.0 * f[..., 1] - 16.0,
+                     500.0 * (f[..., 0] - f[..., 1]),
+                     200.0 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def delta_e_76(lab1, lab2):
+    """CIE76 color difference: the Euclidean distance in CIELAB."""
+    return np.sqrt(((lab1 - lab2) ** 2).sum(axis=-1))
+
+
+def delta_e_2000(lab1, lab2):
+    """CIEDE2000 color difference (kL = kC = kH = 1) of two (N, 3) CIELAB arrays."""
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+    c_mean7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - np.sqrt(c_mean7 / (c_mean7 + 25.0 ** 7)))
+    a1, a2 = a1 * (1 + g), a2 * (1 + g)
+    c1, c2 = np.hypot(a1, b1), np.hypot(a2, b2)
+    h1 = np.degrees(np.arctan2(b1, a1)) % 360
+    h2 = np.degrees(np.arctan2(b2, a2)) % 360
+    chroma = c1 * c2 != 0
+
+    dh = h2 - h1
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(chroma, dh, 0.0)
+    dH = 2 * np.sqrt(c1 * c2) * np.sin(np.radians(dh / 2))
+    dL = L2 - L1
+    dC = c2 - c1
+
+    L_mean = (L1 + L2) / 2
+    c_mean = (c1 + c2) / 2
+    h_sum = h1 + h2
+    h_mean = np.where(np.abs(h1 - h2) <= 180, h_sum / 2,
+                      np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2))
+    h_mean = np.where(chroma, h_mean, h_sum)
+    t = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean))
+         + 0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63)))
+    rotation = 30 * np.exp(-((h_mean - 275) / 25) ** 2)
+    c_mean7 = c_mean ** 7
+    r_t = -2 * np.sqrt(c_mean7 / (c_mean7 + 25.0 ** 7)) * np.sin(np.radians(2 * rotation))
+    s_l = 1 + 0.015 * (L_mean - 50) ** 2 / np.sqrt(20 + (L_mean - 50) ** 2)
+    s_c = 1 + 0.045 * c_mean
+    s_h = 1 + 0.015 * c_mean * t
+    return np.sqrt((dL / s_l) ** 2 + (dC / s_c) ** 2 + (dH / s_h) ** 2 + r_t * (dC / s_c) * (dH / s_h))
+
+
+        ########################
+        #   FRAME  ANALYSIS    #
+        ########################
+
+def analysis_divisor(scale):
+    """Round a requested analysis scale down to a supported power-of-two divisor (1-8)."""
+    divisor = 1
+    while divisor < 8 and divisor * 2 <= scale:
+        divisor *= 2
+    return divisor
+
+
+def build_analysis_image(image, divisor):
+    """Downscale an image by a power-of-two divisor with a pyramid of 2x2 box filters.
+
+    A divisor of 1 returns the image itself without copying.
+    """
+    level = image
+    while divisor > 1 and level.shape[0] >= 2 and level.shape[1] >= 2:
+        rows, cols = level.shape[0] // 2 * 2, level.shape[1] // 2 * 2
+        total = level[0:rows:2, 0:cols:2, :3].astype(np.uint16)
+        total += level[1:rows:2, 0:cols:2, :3]
+        total += level[0:rows:2, 1:cols:2, :3]
+        total += level[1:rows:2, 1:cols:2, :3]
+        total += 2
+        level = (total >> 2).astype(np.uint8)
+        divisor //= 2
+    return level
+
+
+def scale_segments(segments, divisor):
+    """Segment rectangles at the analysis resolution, matching precomputeScaledSegments."""
+    return {segment: tuple(int(value / divisor) for value in rect) for segment, rect in segments.items()}
+
+
+def detect_content_rect(image, threshold_value=10, margin=20):
+    """Find the picture inside symmetric black bars, matching detectContentRect.
+
+    Returns ((x, y, width, height), conclusive). The rectangle is the whole image when no
+    letterbox is found; conclusive is False when every row is black, so a dark frame
+    cannot tell where the bars are.
+    """
+    rows, cols = image.shape[:2]
+
+    # Mean grayscale intensity of each row and column, estimated from every 4th pixel along
+    # the reduced axis and computed from the channel sums instead of a grayscale copy.
+    row_sampled = image[:, ::4]
+    col_sampled = image[::4]
+    row_sum = (row_sampled.sum(axis=1, dtype=np.uint32) @ GRAY_WEIGHTS) / row_sampled.shape[1]
+    col_sum = (col_sampled.sum(axis=0, dtype=np.uint32) @ GRAY_WEIGHTS) / col_sampled.shape[0]
+
+    # A row/column is considered "black" when its mean intensity is below the threshold.
+    row_threshold = threshold_value
+    col_threshold = threshold_value
+
+    # Scan from the edges inward, but only until the image center.
+    top = 0
+    while top < rows // 2 and row_sum[top] <= row_threshold:
+        top += 1
+    bottom = rows - 1
+    while bottom > rows // 2 and row_sum[bottom] <= row_threshold:
+        bottom -= 1
+    left = 0
+    while left < cols // 2 and col_sum[left] <= col_threshold:
+        left += 1
+    right = cols - 1
+    while right > cols // 2 and col_sum[right] <= col_threshold:
+        right -= 1
+    conclusive = not (top >= rows // 2 and bottom <= rows // 2)
+
+    top_crop, bottom_crop = top, rows - 1 - bottom
+    left_crop, right_crop = left, cols - 1 - right
+    crop_vertical = top_crop > margin and bottom_crop > margin and abs(top_crop - bottom_crop) <= margin
+    crop_horizontal = left_crop > margin and right_crop > margin and abs(left_crop - right_crop) <= margin
+
+    # Crop every axis with symmetric bars; letterbox and pillarbox bars can appear together.
+    if not conclusive:
+        return (0, 0, cols, rows), False
+    x, width = (left, right - left + 1) if crop_horizontal else (0, cols)
+    y, height = (top, bottom - top + 1) if crop_vertical else (0, rows)
+    return (x, y, width, height), True
+
+
+def remap_segments(segments, content, size):
+    """Move segment rectangles of a (width, height) frame into the content rectangle, matching remapSegments."""
+    x, y, width, height = content
+    cols, rows = size
+    remapped = {}
+    for segment, (sx, sy, sw, sh) in segments.items():
+        left = x + (sx * width + cols // 2) // cols
+        top = y + (sy * height + rows // 2) // rows
+        right = x + ((sx + sw) * width + cols // 2) // cols
+        bottom = y + ((sy + sh) * height + rows // 2) // rows
+        remapped[segment] = (left, top, max(right - left, 1), max(bottom - top, 1))
+    return remapped
+
+
+def crop_to_content(image, rect):
+    """Crop the image to rect and stretch the content back to full size."""
+    rows, cols = image.shape[:2]
+    x, y, width, height = rect
+    if (width, height) == (cols, rows):
+        return image
+    ys = y + np.arange(rows) * height // rows
+    xs = x + np.arange(cols) * width // cols
+    if width == cols:
+        return image[ys]
+    if height == rows:
+        return image[:, xs]
+    return image[ys[:, None], xs]
+
+
+def cropBlackBars(image, threshold_value=10, margin=20):
+    """Remove symmetric black bars from the image and stretch the content back to full size."""
+    rect, _ = detect_content_rect(image, threshold_value, margin)
+    return crop_to_content(image, rect)
+
+
+class LetterboxTracker:
+    """Cache the detected content rectangle between frames, matching LetterboxTracker in time.cpp.
+
+    Full detection runs every LETTERBOX_INTERVAL frames, or sooner when a row or column just
+    inside or outside the cached edges turns black or stops being black. A different
+    rectangle must be detected LETTERBOX_CONFIRM times in a row before it is used, and
+    frames too dark to tell keep the current one, so the bars do not flicker during fades.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.content = None  # (x, y, width, height) at the analysis resolution
+        self.frame_size = None
+        self.candidate = None
+        self.confirmations = 0
+        self.frames_since_check = 0
+        self.edges = None
+
+    def current(self):
+        """The cached content rectangle, or None before the first frame."""
+        with self.lock:
+            return self.content
+
+    def edge_state(self, image, threshold_value):
+        """Black-or-not flags of the lines on either side of each cached edge."""
+        rows, cols = image.shape[:2]
+        x, y, width, height = self.content
+        row_lines = sorted({y, max(y - 1, 0), y + height - 1, min(y + height, rows - 1)})
+        col_lines = sorted({x, max(x - 1, 0), x + width - 1, min(x + width, cols - 1)})
+        row_means = image[row_lines, ::4].mean(axis=1) @ GRAY_WEIGHTS
+        col_means = image[::4, col_lines].mean(axis=0) @ GRAY_WEIGHTS
+        return tuple(row_means <= threshold_value) + tuple(col_means <= threshold_value)
+
+    def update(self, image, threshold_value=10, margin=20):
+        """Return the content rectangle to use for this frame."""
+        rows, cols = image.shape[:2]
+        if self.frame_size != (rows, cols):
+            self.reset()
+            self.frame_size = (rows, cols)
+            rect, _ = detect_content_rect(image, threshold_value, margin)
+            with self.lock:
+                self.content = rect
+            self.edges = self.edge_state(image, threshold_value)
+            return rect
+
+        self.frames_since_check += 1
+        edges = self.edge_state(image, threshold_value)
+        if self.frames_since_check < LETTERBOX_INTERVAL and edges == self.edges and not self.confirmations:
+            return self.content
+        self.edges = edges
+        self.frames_since_check = 0
+
+        rect, conclusive = detect_content_rect(image, threshold_value, margin)
+        if not conclusive or same_content(rect, self.content, margin):
+            self.confirmations = 0
+            return self.content
+        if self.confirmations and same_content(rect, self.candidate, margin):
+            self.confirmations += 1
+        else:
+            self.candidate, self.confirmations = rect, 1
+        if self.confirmations >= LETTERBOX_CONFIRM:
+            with self.lock:
+                self.content = self.candidate
+            self.confirmations = 0
+            self.edges = self.edge_state(image, threshold_value)
+        return self.content
+
+
+def same_content(a, b, margin):
+    """True if no edge of the two rectangles differs by more than margin."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return max(abs(ax - bx), abs(ay - by), abs(ax + aw - bx - bw), abs(ay + ah - by - bh)) <= margin
+
+
+@functools.lru_cache(maxsize=256)
+def sample_points(width, height, segment, mode, stride, count):
+    """Sample coordinates (ys, xs) inside a segment, or None when every pixel should be used.
+
+    Matches computeSamplePoints in time.cpp: "stride" uses a fixed pixel step, "count" a
+    regular grid sized for the target sample count and "blue_noise" jitters one sample inside
+    every cell of that grid. Cached, so the coordinates are computed once per layout.
+    """
+    if mode == "full" or width * height == 0:
+        return None
+    step = stride if mode == "stride" else int(np.sqrt(width * height / max(1, count)))
+    if step <= 1:
+        return None
+    if mode == "blue_noise":
+        cell_y, cell_x = np.meshgrid(np.arange(0, height, step), np.arange(0, width, step), indexing="ij")
+        rng = np.random.default_rng(segment)  # Fixed seed so the pattern is stable between frames
+        ys = cell_y + (rng.random(cell_y.shape) * np.minimum(step, height - cell_y)).astype(np.intp)
+        xs = cell_x + (rng.random(cell_x.shape) * np.minimum(step, width - cell_x)).astype(np.intp)
+    else:
+        ys, xs = np.meshgrid(np.arange(min(step // 2, height - 1), height, step),
+                             np.arange(min(step // 2, width - 1), width, step), indexing="ij")
+    return ys.reshape(-1), xs.reshape(-1)
+
+
+def gather_segments(image, segments):
+    """Gather the pixels of every segment into one (N, 3) array.
+
+    Returns the segment ids, their ROIs, the gathered pixels, the start offset of each
+    segment in the pixel array and a per-pixel segment index. Only the sample points are
+    gathered when a sampling mode is set. The palette method always samples, with a grid of
+    PALETTE_SAMPLES points when no sampling mode is set.
+    """
+    ids, rois = [], []
+    for segment, (x, y, width, height) in segments.items():
+        if x + width > image.shape[1] or y + height > image.shape[0]:
+            print(f"Warning: Segment {segment} exceeds scaled image bounds. Skipping.", file=sys.stderr)
+            continue
+        roi = image[y:y + height, x:x + width]
+        if roi.size == 0:
+            print(f"Error: Segment image capture failed for segment {segment}", file=sys.stderr)
+            continue
+        ids.append(segment)
+        rois.append(roi)
+    if not rois:
+        return ids, rois, np.empty((0, 3), np.uint8), np.empty(0, np.int64), np.empty(0, np.int64)
+    mode, count = settings["sampling_mode"], settings["sample_count"]
+    if settings["color_method"] == "palette" and mode == "full":
+        mode, count = "count", PALETTE_SAMPLES
+    samples = []
+    for segment, roi in zip(ids, rois):
+        points = sample_points(roi.shape[1], roi.shape[0], segment, mode, settings["sampling_stride"], count)
+        samples.append(roi.reshape(-1, 3) if points is None else roi[points])
+    sizes = [len(sample) for sample in samples]
+    pixels = np.concatenate(samples)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    labels = np.repeat(np.arange(len(rois)), sizes)
+    return ids, rois, pixels, offsets, labels
+
+
+def dominant_colors(pixels, labels, count):
+    """Compute the dominant BGR color of every segment from gathered pixels.
+
+    All segments' hue histograms are built with one bincount; the dominant color is the mean
+    of the pixels in each segment's most frequent hue bin. Pixels must be grouped by segment.
+    """
+    if count == 0:
+        return np.empty((0, 3), np.uint8)
+    hue = hue_channel(pixels)
+    hist = np.bincount(labels * HUE_BINS + hue, minlength=count * HUE_BINS).reshape(count, HUE_BINS)
+    dominant_hue = hist.argmax(axis=1)
+
+    # Mean color of the pixels with the dominant hue. Every segment has at least one such
+    # pixel, so the selected pixels stay grouped into non-empty runs per segment.
+    mask = hue == dominant_hue[labels]
+    totals = hist[np.arange(count), dominant_hue]
+    starts = np.concatenate([[0], np.cumsum(totals)[:-1]])
+    sums = np.add.reduceat(pixels[mask], starts, axis=0, dtype=np.uint64)
+    return np.rint(sums / totals[:, None]).astype(np.uint8)  # Rounded like cv::mean into a Vec3b
+
+
+def palette_colors(pixels, labels, count, centroids, iterations):
+    """Dominant BGR color of every segment from a palette, matching computePaletteColor in time.cpp.
+
+    Runs up to `iterations` rounds of k-means over the gathered pixels of all segments at
+    once, each pixel weighted by its chroma so grays and black bars count less than colors.
+    `centroids` is a (count, clusters, 3) array holding the previous frame's palettes. Returns
+    the center of each segment's cluster with the largest weight and the new palettes.
+    """
+    clusters = centroids.shape[1]
+    if count == 0:
+        return np.empty((0, 3), np.uint8), centroids
+    weights = (pixels.max(axis=1) - pixels.min(axis=1)).astype(np.float64) + PALETTE_GRAY_WEIGHT
+    pixels = pixels.astype(np.float32)
+    for _ in range(max(1, iterations)):
+        offsets = pixels[:, None, :] - centroids[labels]
+        key = labels * clusters + np.einsum("nkc,nkc->nk", offsets, offsets).argmin(axis=1)
+        totals = np.bincount(key, weights=weights, minlength=count * clusters)
+        sums = np.stack([np.bincount(key, weights=weights * pixels[:, c], minlength=count * clusters)
+                         for c in range(3)], axis=1)
+        previous = centroids.reshape(-1, 3)
+        updated = previous.copy()
+        filled = totals > 0  # Empty clusters keep their center
+        updated[filled] = sums[filled] / totals[filled, None]
+        centroids = updated.reshape(count, clusters, 3)
+        if np.abs(updated - previous).max() < PALETTE_CONVERGENCE:
+            break
+    salient = totals.reshape(count, clusters).argmax(axis=1)
+    colors = np.clip(np.rint(centroids[np.arange(count), salient]), 0, 255).astype(np.uint8)
+    return colors, centroids
+
+
+def palette_seeds(pixels, clusters):
+    """Cold-start palette of one segment: the most saturated pixel, then repeatedly the pixel
+    farthest from all centers so far."""
+    pixels = pixels.astype(np.float32)
+    chroma = pixels.max(axis=1) - pixels.min(axis=1)
+    seeds = [pixels[chroma.argmax()]]
+    nearest = np.full(len(pixels), np.inf, np.float32)
+    while len(seeds) < clusters:
+        nearest = np.minimum(nearest, ((pixels - seeds[-1]) ** 2).sum(axis=1))
+        seeds.append(pixels[nearest.argmax()])
+    return np.array(seeds, np.float32)
+
+
+def computeDominantColor(roi):
+    """Compute the dominant color in the given region of interest (ROI) as a BGR tuple."""
+    roi = np.asarray(roi)
+    if roi.size == 0:
+        return (0, 0, 0)
+    pixels = roi[..., :3].reshape(-1, 3)
+    color = dominant_colors(pixels, np.zeros(len(pixels), np.int64), 1)[0]
+    return tuple(int(c) for c in color)
+
+
+class MotionBuffer:
+    """Frame-level motion, edge energy and mean color, matching MotionBuffer in time.cpp.
+
+    Every frame is reduced to grayscale at 1/MOTION_DIVISOR of the analysis resolution, in
+    two preallocated buffers that swap roles each frame. The absolute difference of the two,
+    and optionally the gradient magnitude of the newer one, are summed into integral images
+    once per frame, and so are the color channels of the frame itself at the analysis
+    resolution, so small segments keep their own pixels. The motion, edge intensity and mean
+    color of any segment are then O(1) lookups instead of passes over its pixels.
+    """
+
+    def __init__(self):
+        self.luma = [None, None]
+        self.current = 0
+        self.integral = None  # Summed difference, one row and column larger than the buffers
+        self.edge_integral = None  # Summed gradient magnitude, same layout
+        self.color_integral = None  # Summed B, G and R, with a trailing channel axis
+        self.valid = False  # A previous frame of the same size exists
+        self.edges_valid = False  # edge_integral belongs to the current frame
+        self.colors_valid = False  # color_integral belongs to the current frame
+
+    def reset(self):
+        self.luma = [None, None]
+        self.valid = False
+        self.edges_valid = False
+        self.colors_valid = False
+
+    def update(self, image, edges=True, colors=False):
+        """Take the next frame and difference it against the previous one.
+
+        With edges, also measure its gradient magnitude, and with colors sum its color channels.
+        """
+        reduced = build_analysis_image(image, MOTION_DIVISOR)
+        self.colors_valid = colors
+        if colors:
+            self.color_integral = summed_area(image[..., :3], self.color_integral)
+        shape = reduced.shape[:2]
+        self.current ^= 1
+        luma = self.luma[self.current]
+        if luma is None or luma.shape != shape:
+            luma = self.luma[self.current] = np.empty(shape, np.float32)
+        np.matmul(reduced, GRAY_WEIGHTS.astype(np.float32), out=luma)
+        previous = self.luma[self.current ^ 1]
+        self.valid = previous is not None and previous.shape == shape
+        if self.valid:
+            self.integral = summed_area(np.abs(luma - previous), self.integral)
+        self.edges_valid = edges
+        if edges:
+            self.edge_integral = summed_area(gradient_magnitude(luma), self.edge_integral)
+
+    def intensities(self, rects):
+        """Mean grayscale change inside each (x, y, width, height) of the analysis image."""
+        if not self.valid or not rects:
+            return np.zeros(len(rects))
+        return self.mean_inside(self.integral, rects)
+
+    def edge_intensities(self, rects):
+        """Mean gradient magnitude (roughly 0-255) inside each rectangle of the analysis image.
+
+        All zeros when the last update did not measure edges.
+        """
+        if not self.edges_valid or not rects:
+            return np.zeros(len(rects))
+        return self.mean_inside(self.edge_integral, rects)
+
+    def mean_colors(self, rects):
+        """Mean BGR color inside each rectangle of the analysis image as an (N, 3) uint8 array.
+
+        All black when the last update did not sum the colors.
+        """
+        if not self.colors_valid or not rects:
+            return np.zeros((len(rects), 3), np.uint8)
+        return np.clip(np.rint(self.mean_inside(self.color_integral, rects, 1)), 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def mean_inside(table, rects, divisor=MOTION_DIVISOR):
+        """Mean of an image summed in table over the cells covering each analysis rectangle.
+
+        The image is 1/divisor of the analysis resolution; every rectangle covers at least
+        one cell. Tables with a trailing channel axis give one mean per channel.
+        """
+        rows, cols = table.shape[0] - 1, table.shape[1] - 1
+        x, y, width, height = np.array(rects, dtype=np.intp).T
+        left = np.clip(x // divisor, 0, cols - 1)
+        top = np.clip(y // divisor, 0, rows - 1)
+        right = np.clip(-(-(x + width) // divisor), left + 1, cols)
+        bottom = np.clip(-(-(y + height) // divisor), top + 1, rows)
+        sums = table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+        area = (right - left) * (bottom - top)
+        return sums / area.reshape(area.shape + (1,) * (sums.ndim - 1))
+
+
+def summed_area(values, out=None):
+    """Integral image of an array over its first two axes, with a leading row and column of
+    zeros like cv::integral. Further axes (channels) are summed separately.
+
+    out is reused when it already has the right shape.
+    """
+    shape = (values.shape[0] + 1, values.shape[1] + 1) + values.shape[2:]
+    if out is None or out.shape != shape:
+        out = np.zeros(shape, np.float64)
+    np.cumsum(values, axis=0, out=out[1:, 1:])
+    np.cumsum(out[1:, 1:], axis=1, out=out[1:, 1:])
+    return out
+
+
+def gradient_magnitude(gray):
+    """|dx| + |dy| of the 3x3 Sobel operator, each scaled by 1/8, capped at 255.
+
+    Matches cv::Sobel with its default reflected border, cv::convertScaleAbs (which rounds
+    each axis to uint8) and the saturating uint8 cv::add of the two.
+    """
+    padded = np.pad(gray, 1, mode="reflect")
+    smooth_rows = padded[:-2] + 2 * padded[1:-1] + padded[2:]
+    smooth_cols = padded[:, :-2] + 2 * padded[:, 1:-1] + padded[:, 2:]
+    gx = smooth_rows[:, 2:] - smooth_rows[:, :-2]
+    gy = smooth_cols[2:] - smooth_cols[:-2]
+    return np.minimum(np.rint(np.abs(gx) * 0.125) + np.rint(np.abs(gy) * 0.125), 255.0)
+
+
+def adjust_colors(colors, motion, edges):
+    """Apply uniform brightness, color boost and the motion/edge boost in one HSV round trip."""
+    if len(colors) == 0:
+        return colors
+    hsv = bgr_to_hsv(colors)
+    s, v = hsv[:, 1], hsv[:, 2]
+    if settings["set_uniform_brightness"]:
+        # Avoid over-brightening very dark colors
+        scaled = np.minimum(np.floor(v * settings["uniform_brightness"] / 255.0), 255)
+        v = np.where(v < 30, v, scaled)
+    if settings["set_color_boost"]:
+        s = np.minimum(255, np.floor(s * settings["color_boost_factor"]))
+
+    # Boost brightness if there is motion and saturation if edges are strong.
+    brightness_boost = 1.0 + np.minimum(0.5, motion / 50.0)
+    saturation_boost = 1.0 if settings["set_color_boost"] else 1.0 + np.minimum(0.1, edges / 50.0)
+    hsv[:, 2] = np.minimum(255, np.floor(v * brightness_boost))
+    hsv[:, 1] = np.minimum(255, np.floor(s * saturation_boost))
+    return hsv_to_bgr(hsv)
+
+
+class SmoothingFilter:
+    """Per-segment temporal smoothing of the adjusted colors, matching SmoothingFilter in time.cpp.
+
+    The state of every segment slot is kept in (SEGMENT_SLOTS, 3) arrays and all segments
+    of a frame are filtered in one vector operation. The filters, selected by
+    settings["smoothing_mode"], all use settings["smoothing_time"] as their time constant:
+
+        ema      - exponential moving average
+        one_euro - one-euro filter: heavy smoothing of small jitter, fast on large changes
+        spring   - critically damped spring: smooth, without overshoot
+    """
+
+    def __init__(self):
+        self.mode = "off"
+        self.value = np.zeros((SEGMENT_SLOTS, 3))
+        self.rate = np.zeros((SEGMENT_SLOTS, 3))  # Filtered derivative or spring velocity
+        self.primed = np.zeros(SEGMENT_SLOTS, dtype=bool)
+
+    def reset(self):
+        self.primed[:] = False
+        self.rate[:] = 0.0
+
+    def forget(self, segments):
+        """Drop the history of the segments, so they restart at their next color."""
+        segments = np.asarray(segments, dtype=np.intp)
+        self.primed[segments[(segments > 0) & (segments < SEGMENT_SLOTS)]] = False
+
+    def apply(self, segments, colors, dt):
+        """Return the smoothed BGR colors of the segments; dt is seconds since the last frame."""
+        mode, tau = settings["smoothing_mode"], settings["smoothing_time"] / 1000.0
+        if mode != self.mode:
+            self.mode = mode
+            self.reset()
+        segments = np.asarray(segments, dtype=np.intp)
+        in_table = (segments > 0) & (segments < SEGMENT_SLOTS)
+        if mode not in ("ema", "one_euro", "spring") or tau <= 0 or not in_table.any():
+            return colors
+        rows = segments[in_table]
+        target = colors[in_table].astype(np.float64)
+
+        # Segments without history start at their current color.
+        fresh = ~self.primed[rows]
+        self.value[rows[fresh]] = target[fresh]
+        self.rate[rows[fresh]] = 0.0
+        self.primed[rows] = True
+
+        dt = min(max(dt, 1e-3), MAX_SMOOTHING_STEP)
+        value, rate = self.value[rows], self.rate[rows]
+        if mode == "ema":
+            value += (1.0 - np.exp(-dt / tau)) * (target - value)
+        elif mode == "one_euro":
+            rate += smoothing_alpha(dt, ONE_EURO_DERIVATIVE_CUTOFF) * ((target - value) / dt - rate)
+            cutoff = 1.0 / (2.0 * np.pi * tau) + ONE_EURO_BETA * np.abs(rate)
+            value += smoothing_alpha(dt, cutoff) * (target - value)
+        else:
+            omega = 2.0 / tau
+            decay = np.exp(-omega * dt)
+            delta = value - target
+            step = (rate + omega * delta) * dt
+            rate = (rate - omega * step) * decay
+            value = target + (delta + step) * decay
+        self.value[rows], self.rate[rows] = value, rate
+
+        smoothed = colors.copy()
+        smoothed[in_table] = np.clip(np.rint(value), 0, 255).astype(np.uint8)
+        return smoothed
+
+
+def smoothing_alpha(dt, cutoff):
+    """Low-pass filter gain for a time step and cutoff frequency (one-euro filter)."""
+    return 1.0 / (1.0 + 1.0 / (2.0 * np.pi * cutoff * dt))
+
+
+def to_device_hsv(colors):
+    """Convert BGR colors to the device HSV ranges (hue 0-360, saturation and value 0-1000)."""
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    hsv = bgr_to_hsv(colors)
+    hue = np.clip(hsv[:, 0].astype(np.int32) * 2, 0, 360)
+    sat = np.clip((hsv[:, 1] / 255.0 * 1000).astype(np.int32), 0, 1000)
+    val = np.clip((hsv[:, 2] / 255.0 * 1000).astype(np.int32), 0, 1000)
+
+    # Exclude near black colors from high brightness
+    near_black_threshold = 50
+    near_black = (colors < near_black_threshold).all(axis=1) | (val < int(near_black_threshold * 1000.0 / 255))
+    if settings["set_uniform_brightness"]:
+        val = np.where(near_black, np.minimum(val, 100), settings["uniform_brightness"])
+    else:
+        val = np.where(near_black, np.minimum(val, 100), val)
+    return np.stack([hue, sat, val], axis=1)
+
+
+@functools.lru_cache(maxsize=4096)
+def encodeCommand(segment, hue, sat, val):
+    """Encode device HSV values into the base64 DPS 61 payload for a segment (memoized)."""
+    if not 1 <= segment <= DEVICE_SEGMENTS:
+        raise ValueError(f"Segment must be between 1 and {DEVICE_SEGMENTS}.")
+    hue, sat, val = min(max(hue, 0), 360), min(max(sat, 0), 1000), min(max(val, 0), 1000)
+    payload = bytes([0x00, 0x02, 0x00, 0x14, 0x01,
+                     hue >> 8, hue & 0xFF, sat >> 8, sat & 0xFF, val >> 8, val & 0xFF,
+                     0x81, 21 - segment])  # Segments are addressed 20-1, top-down
+    return base64.b64encode(payload).decode("ascii")
+
+
+def buildCommand(segment, color):
+    """Build the command payload for a given segment and BGR color."""
+    hue, sat, val = (int(c) for c in to_device_hsv([color])[0])
+    return encodeCommand(segment, hue, sat, val)
+
+
+def segment_codes(hsv, encode=encodeCommand):
+    """DPS 61 commands that set every device segment to a device HSV color.
+
+    encode is the encodeCommand of the engine in use, so the UI's fixed colors are encoded
+    the same way as the analyzed ones.
+    """
+    return {segment: encode(segment, *hsv) for segment in range(1, DEVICE_SEGMENTS + 1)}
+
+
+        ########################
+        #      LABEL MAP       #
+        ########################
+
+class LabelMap:
+    """Per-pixel segment labels for a frame size, built once from the segment rectangles.
+
+    Segment rectangles may overlap, so every covered pixel is labelled with the region formed
+    by the exact set of segments covering it. Histograms and sums are accumulated per region
+    in one pass over the covered pixels and then combined into per-segment values through the
+    (segments x regions) membership matrix, so shared pixels are converted and counted once.
+    """
+
+    def __init__(self, segments, shape):
+        rows, cols = self.shape = shape[:2]
+        self.ids, self.rois = [], []
+        for segment, (x, y, width, height) in segments.items():
+            if x + width > cols or y + height > rows:
+                print(f"Warning: Segment {segment} exceeds scaled image bounds. Skipping.", file=sys.stderr)
+                continue
+            if width <= 0 or height <= 0:
+                print(f"Error: Segment image capture failed for segment {segment}", file=sys.stderr)
+                continue
+            self.ids.append(segment)
+            self.rois.append((slice(y, y + height), slice(x, x + width)))
+
+        # One membership bit per segment, packed into 64-bit words.
+        words = max(1, (len(self.ids) + 63) // 64)
+        keys = np.zeros((rows, cols, words), np.uint64)
+        for i, roi in enumerate(self.rois):
+            keys[roi + (i // 64,)] |= np.uint64(1 << (i % 64))
+        keys = keys.reshape(-1, words)
+        covered = np.flatnonzero(keys.any(axis=1))
+        regions, self.labels = np.unique(keys[covered], axis=0, return_inverse=True)
+        self.labels = self.labels.reshape(-1)
+        self.covered = covered
+        self.region_count = len(regions)
+
+        # membership[i, r] is 1 if segment i covers region r.
+        bits = np.arange(len(self.ids))
+        self.membership = ((regions[:, bits // 64] >> (bits % 64).astype(np.uint64)) & np.uint64(1)).T.astype(np.int64)
+
+    def pixels(self, image):
+        """Gather the covered pixels of a frame in label order."""
+        flat = image.reshape(-1, image.shape[2])  # Only copies if the frame is a strided view
+        return np.take(flat, self.covered, axis=0)[:, :3]
+
+    def dominant_colors(self, pixels):
+        """Dominant BGR color of every segment, in two passes over the covered pixels."""
+        count = len(self.ids)
+        if count == 0:
+            return np.empty((0, 3), np.uint8)
+
+        # First pass: all regions' hue histograms in one bincount, combined per segment.
+        hue = hue_channel(pixels)
+        bins = self.labels * HUE_BINS + hue
+        region_hist = np.bincount(bins, minlength=self.region_count * HUE_BINS).reshape(-1, HUE_BINS)
+        dominant_hue = (self.membership @ region_hist).argmax(axis=1)
+
+        # Second pass: color sums of only the (region, hue) bins that are dominant for a
+        # segment covering the region.
+        dominant = np.zeros((count, HUE_BINS), np.int64)
+        dominant[np.arange(count), dominant_hue] = 1
+        needed = (self.membership.T @ dominant).astype(bool).reshape(-1)
+        mask = needed[bins]
+        selected = bins[mask]
+        length = self.region_count * HUE_BINS
+        sums = np.stack([np.bincount(selected, weights=pixels[mask, c], minlength=length) for c in range(3)], axis=1)
+        totals = np.bincount(selected, minlength=length)
+
+        # Combine the regions of each segment at its dominant hue.
+        region_bins = np.arange(self.region_count) * HUE_BINS
+        index = region_bins[None, :] + dominant_hue[:, None]
+        segment_sums = np.einsum("sr,src->sc", self.membership, sums[index])
+        segment_totals = (self.membership * totals[index]).sum(axis=1)
+        return np.rint(segment_sums / np.maximum(segment_totals, 1)[:, None]).astype(np.uint8)
+
+
+        ########################
+        #      PROCESSOR       #
+        ########################
+
+def segment_signature(roi):
+    """Cheap change signature of a segment: the mean color of each cell of a SIGNATURE_GRID grid."""
+    rows, cols = roi.shape[:2]
+    ys = np.linspace(0, rows, min(SIGNATURE_GRID, rows) + 1).astype(np.intp)
+    xs = np.linspace(0, cols, min(SIGNATURE_GRID, cols) + 1).astype(np.intp)
+    sums = np.add.reduceat(np.add.reduceat(roi, ys[:-1], axis=0, dtype=np.uint32), xs[:-1], axis=1)
+    counts = np.diff(ys)[:, None, None] * np.diff(xs)[None, :, None]
+    return sums / counts
+
+
+def analyze_segments(image, segments, palettes=None, iterations=1):
+    """Dominant color of a group of segments.
+
+    With `palettes` (a dict of each segment's previous palette), colors come from
+    palette_colors() with at most `iterations` k-means rounds, and the new palettes are
+    returned as a third value.
+    """
+    ids, rois, pixels, offsets, labels = gather_segments(image, segments)
+    if palettes is None:
+        return ids, dominant_colors(pixels, labels, len(ids)), {}
+    clusters = max(1, settings["palette_clusters"])
+    sizes = np.diff(np.append(offsets, len(pixels)))
+    centroids = np.empty((len(ids), clusters, 3), np.float32)
+    for i, segment in enumerate(ids):
+        previous = palettes.get(segment)
+        if previous is not None and len(previous) == clusters:
+            centroids[i] = previous
+        else:
+            centroids[i] = palette_seeds(pixels[offsets[i]:offsets[i] + sizes[i]], clusters)
+    colors, centroids = palette_colors(pixels, labels, len(ids), centroids, iterations)
+    return ids, colors, dict(zip(ids, centroids))
+
+
+def analyze_group(image, segments, cache, tolerance, palettes=None, iterations=1):
+    """analyze_segments() for the segments whose change signature moved beyond `tolerance`.
+
+    `cache` maps segments to the (signature, color) of their last full analysis. The other
+    segments reuse that color, skipping gathering and the hue histograms or palettes.
+    Returns the results, the cache entries and the new palettes of the analyzed segments.
+    """
+    signatures, reused = {}, {}
+    if tolerance > 0:
+        for segment, (x, y, width, height) in segments.items():
+            roi = image[y:y + height, x:x + width]
+            if roi.size == 0 or roi.shape[:2] != (height, width):
+                continue
+            signature = signatures[segment] = segment_signature(roi)
+            cached = cache.get(segment)
+            if (cached is not None and cached[0].shape == signature.shape and
+                    np.abs(signature - cached[0]).max() <= tolerance):
+                reused[segment] = cached
+    changed = {segment: rect for segment, rect in segments.items() if segment not in reused}
+    ids, colors, new_palettes = analyze_segments(image, changed, palettes, iterations)
+    updates = {segment: (signatures[segment], colors[i])
+               for i, segment in enumerate(ids) if segment in signatures}
+    if reused:
+        ids = ids + list(reused)
+        colors = np.concatenate([colors, np.array([entry[1] for entry in reused.values()], np.uint8)])
+    return ids, colors, updates, new_palettes
+
+
+class Processor:
+    """Long-lived screen processor with the same interface as time_bindings.Processor."""
+
+    def __init__(self):
+        self.original_segments = {}
+        self.capture_layout = ([], (0, 0), {})  # Packed capture regions of original_segments
+        self.region_mode = False  # Segments are in packed-frame coordinates
+        self.scaled_segment_cache = {}  # Keyed by analysis divisor
+        self.scaled_segments = {}  # Rectangles at the current divisor
+        self.segments = {}  # scaled_segments moved into the picture area inside black bars
+        self.content_rect = None  # Picture area the segments were moved into
+        self.divisor = 1
+        # Previous colors live in memory and are only written to prev_colors.txt by snapshot().
+        self.color_table = to_color_table(load_prev_colors())
+        self.colors_lock = threading.Lock()
+        self.forgotten = []  # Segments whose smoothing restarts on the next frame, under colors_lock
+        self.groups = []
+        self.motion = MotionBuffer()
+        self.smoothing = SmoothingFilter()
+        self.last_frame_time = None  # perf_counter() of the previous frame, for smoothing
+        self.segment_cache = {}  # (signature, color) of each segment's last full analysis
+        self.palettes = {}  # Each segment's palette of the last frame, to warm-start k-means
+        self.label_map = None
+        self.letterbox_tracker = LetterboxTracker()
+        self.settings_stamp = None
+        self.segments_stamp = None
+        self.frame_lock = threading.Lock()  # One frame is analyzed at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Segment groups are analyzed in parallel; NumPy releases the GIL for the heavy work.
+        self.worker_count = max(1, os.cpu_count() or 1)
+        self.workers = ThreadPoolExecutor(max_workers=self.worker_count)
+        self.future = None
+        self.reload()
+
+    def close(self):
+        """Wait for a submitted frame and shut down the worker threads."""
+        self.executor.shutdown(wait=True)
+        self.workers.shutdown(wait=True)
+        self.future = None
+
+    def __del__(self):
+        executor, workers = getattr(self, "executor", None), getattr(self, "workers", None)
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if workers is not None:
+            workers.shutdown(wait=False)
+
+    def reload(self):
+        """Re-read settings.json and segments.json."""
+        self.reload_settings()
+        self.reload_segments()
+
+    def reload_settings(self):
+        load_settings()
+        self.settings_stamp = file_stamp(SETTINGS_FILE)
+        self.apply_analysis_scale()
+
+    def reload_segments(self):
+        self.original_segments = load_segment_data()
+        self.capture_layout = plan_capture_regions(self.original_segments)
+        self.scaled_segment_cache = {}
+        self.motion.reset()  # The packed capture layout may have moved
+        self.segments_stamp = file_stamp(SEGMENT_FILE)
+        self.apply_analysis_scale(force=True)
+
+    def use_region_capture(self):
+        """Letterbox detection needs the whole frame, so regions are only captured without it."""
+        return bool(settings["capture_regions"]) and not enable_letterbox_detection and bool(self.capture_layout[0])
+
+    def apply_analysis_scale(self, force=False):
+        """Select the segment rectangles for the current capture mode and analysis resolution.
+
+        Scaled positions are cached per divisor until segments.json or the capture mode changes.
+        """
+        region_mode = self.use_region_capture()
+        if region_mode != self.region_mode:
+            self.region_mode = region_mode
+            self.scaled_segment_cache = {}
+        self.divisor = analysis_divisor(settings["analysis_scale"])
+        if self.divisor not in self.scaled_segment_cache:
+            base = self.capture_layout[2] if self.region_mode else self.original_segments
+            self.scaled_segment_cache[self.divisor] = scale_segments(base, self.divisor)
+        segments = self.scaled_segment_cache[self.divisor]
+        self.segment_cache = {}  # Cached colors depend on the settings and the layout
+        self.palettes = {}
+        if segments == self.scaled_segments and not force:
+            return
+        self.scaled_segments = segments
+        self.content_rect = None
+        self.set_segments(segments)
+
+    def apply_content_rect(self, content, size):
+        """Move the segments into the picture area of the frame (the whole frame without black bars)."""
+        if content == self.content_rect:
+            return
+        self.content_rect = content
+        if content[2:] == size:
+            self.set_segments(self.scaled_segments)
+        else:
+            self.set_segments(remap_segments(self.scaled_segments, content, size))
+        self.segment_cache = {}
+
+    def set_segments(self, segments):
+        """Use the segment rectangles for analysis, dropping state that depends on their positions."""
+        self.segments = segments
+        items = list(self.segments.items())
+        count = min(len(items), self.worker_count)
+        self.groups = [dict(items[i::count]) for i in range(count)]
+        self.label_map = None
+
+    def refresh_if_changed(self):
+        """Only re-parse the settings and segment files when they change on disk."""
+        if file_stamp(SETTINGS_FILE) != self.settings_stamp:
+            self.reload_settings()
+        if file_stamp(SEGMENT_FILE) != self.segments_stamp:
+            self.reload_segments()
+
+    def is_significant_change(self, segments, colors):
+        """Vectorized check against the previous colors.
+
+        The "rgb" change metric uses the Manhattan and per-channel thresholds; "cie76" and
+        "ciede2000" compare the delta E of the colors in CIELAB with delta_e_threshold.
+        """
+        segments = np.asarray(segments, dtype=np.intp)
+        changed = np.ones(len(segments), dtype=bool)
+        in_table = (segments > 0) & (segments < SEGMENT_SLOTS)
+        known = np.flatnonzero(in_table)
+        known = known[self.color_table[segments[known], 0] >= 0]
+        if len(known):
+            prev_rgb = self.color_table[segments[known]].astype(np.int32)
+            new_rgb = colors[known][:, ::-1].astype(np.int32)
+            metric = settings["change_metric"]
+            if metric in ("cie76", "ciede2000"):
+                delta_e = delta_e_76 if metric == "cie76" else delta_e_2000
+                changed[known] = delta_e(rgb_to_lab(prev_rgb), rgb_to_lab(new_rgb)) > settings["delta_e_threshold"]
+            else:
+                diff = np.abs(prev_rgb - new_rgb)
+                changed[known] = ((diff.sum(axis=1) > settings["manhattan_threshold"]) |
+                                  (diff > settings["component_threshold"]).any(axis=1))
+        return changed
+
+    def analyze(self, frame=None):
+        """Process one frame and return (segments, commands).
+
+        `frame` is an HxWx3 (or HxWx4) BGR uint8 array from a FrameSource; without it the
+        selected monitor is captured.
+        """
+        with self.frame_lock:
+            self.refresh_if_changed()
+            if self.use_region_capture() != self.region_mode:
+                self.apply_analysis_scale()  # Letterbox detection was toggled
+
+            regions, canvas, _ = self.capture_layout
+            if frame is None:
+                image = capture_screen_regions(regions, canvas) if self.region_mode else capture_screen()
+            else:
+                image = pack_capture_regions(frame, regions, canvas) if self.region_mode else frame[:, :, :3]
+            if image is None:
+                raise RuntimeError("Screen capture failed.")
+
+            # Reduce to the analysis resolution first so letterbox detection, segments, motion
+            # and edges all work on the smaller image.
+            image = build_analysis_image(image, self.divisor)
+
+            # Use letterbox detection only if enabled. Segments are moved into the picture
+            # area instead of stretching the picture over the whole frame.
+            rows, cols = image.shape[:2]
+            if enable_letterbox_detection:
+                content = self.letterbox_tracker.update(image, settings["threshold_value"], max(1, 20 // self.divisor))
+            else:
+                self.letterbox_tracker.reset()
+                content = (0, 0, cols, rows)
+            self.apply_content_rect(content, (cols, rows))
+
+            # Motion and edges of every segment come from one pass over the whole frame. In the
+            # "mean" analysis mode so do the colors.
+            mean_mode = settings["analysis_mode"] == "mean"
+            self.motion.update(image, settings["edge_weighting"], mean_mode)
+            if mean_mode:
+                ids, colors = self.analyze_means(image)
+            elif settings["analysis_mode"] == "labelmap" and settings["color_method"] != "palette":
+                ids, colors = self.analyze_label_map(image)
+            else:
+                ids, colors = self.analyze_groups(image)
+            rects = [self.segments[segment] for segment in ids]
+            motion = self.motion.intensities(rects)
+            edges = self.motion.edge_intensities(rects)
+            count = len(ids)
+
+            colors = adjust_colors(colors, motion, edges)
+            now = time.perf_counter()
+            dt = 0.0 if self.last_frame_time is None else now - self.last_frame_time
+            self.last_frame_time = now
+            with self.colors_lock:
+                forgotten, self.forgotten = self.forgotten, []
+            self.smoothing.forget(forgotten)
+            colors = self.smoothing.apply(ids, colors, dt)
+            device = to_device_hsv(colors)
+
+            records = np.zeros(count, dtype=SEGMENT_DTYPE)
+            records["segment"] = ids
+            records["r"], records["g"], records["b"] = colors[:, 2], colors[:, 1], colors[:, 0]
+            records["h"], records["s"], records["v"] = device[:, 0], device[:, 1], device[:, 2]
+
+            commands = {}
+            with self.colors_lock:
+                changed = records["changed"] = self.is_significant_change(ids, colors)
+                for record in records[changed]:
+                    segment = int(record["segment"])
+                    if 0 < segment < SEGMENT_SLOTS:
+                        self.color_table[segment] = (record["r"], record["g"], record["b"])
+                    if segment <= DEVICE_SEGMENTS:  # Further segments are analyzed, not sent
+                        commands[f"61_{segment}"] = encodeCommand(segment, int(record["h"]), int(record["s"]), int(record["v"]))
+            return records, commands
+
+    def snapshot(self):
+        """Write the previous colors to prev_colors.txt."""
+        with self.colors_lock:
+            colors = to_color_map(self.color_table)
+        save_prev_colors(colors)
+
+    @property
+    def prev_colors(self):
+        """(SEGMENT_SLOTS, 3) int16 read-only view of the previous RGB color of each segment; -1 means none."""
+        view = self.color_table.view()
+        view.flags.writeable = False
+        return view
+
+    def forget(self, segments):
+        """Drop the previous colors of the segments, e.g. after their commands failed to send,
+        so they are reported as changed on the next frame. Their smoothing restarts at the
+        current color, which is sent as is."""
+        with self.colors_lock:
+            for segment in segments:
+                if 0 < segment < SEGMENT_SLOTS:
+                    self.color_table[segment] = -1
+                    self.forgotten.append(segment)
+
+    def analyze_groups(self, image):
+        """Analyze the segment groups in parallel and merge the results in segment order."""
+        count = len(self.groups)
+        tolerance = settings["signature_tolerance"]
+        palettes, iterations = None, 1
+        if settings["color_method"] == "palette":
+            # The iteration budget is shared by all segments; warm-started segments need one or two.
+            palettes = self.palettes
+            iterations = int(np.clip(settings["palette_iterations"] // max(1, len(self.segments)),
+                                     1, PALETTE_MAX_ITERATIONS))
+        results = list(self.workers.map(analyze_group, [image] * count, self.groups,
+                                        [self.segment_cache] * count, [tolerance] * count,
+                                        [palettes] * count, [iterations] * count))
+        for result in results:
+            self.segment_cache.update(result[2])
+            self.palettes.update(result[3])
+        ids = [segment for result in results for segment in result[0]]
+        order = np.argsort(ids, kind="stable")
+        colors = np.concatenate([result[1] for result in results] or [np.empty((0, 3), np.uint8)])[order]
+        return [ids[i] for i in order], colors
+
+    def analyze_means(self, image):
+        """Mean color of every segment from the frame's color integral image."""
+        rows, cols = image.shape[:2]
+        ids = [segment for segment, (x, y, width, height) in self.segments.items()
+               if x + width <= cols and y + height <= rows and width > 0 and height > 0]
+        ids.sort()
+        return ids, self.motion.mean_colors([self.segments[segment] for segment in ids])
+
+    def analyze_label_map(self, image):
+        """Analyze all segments in one pass over the frame's label map."""
+        if self.label_map is None or self.label_map.shape != image.shape[:2]:
+            self.label_map = LabelMap(self.segments, image.shape)
+        label_map = self.label_map
+        tolerance = settings["signature_tolerance"]
+        if tolerance > 0:
+            # One pass covers every segment, so it is only skipped when no signature moved.
+            signatures = [segment_signature(image[roi]) for roi in label_map.rois]
+            cached = [self.segment_cache.get(segment) for segment in label_map.ids]
+            if cached and all(entry is not None and entry[0].shape == signature.shape and
+                              np.abs(signature - entry[0]).max() <= tolerance
+                              for entry, signature in zip(cached, signatures)):
+                colors = np.array([entry[1] for entry in cached], dtype=np.uint8)
+                return label_map.ids, colors
+        pixels = label_map.pixels(image)
+        colors = label_map.dominant_colors(pixels)
+        if tolerance > 0:
+            self.segment_cache = {segment: (signature, colors[i])
+                                  for i, (segment, signature) in enumerate(zip(label_map.ids, signatures))}
+        return label_map.ids, colors
+
+    def process(self):
+        """Capture and process one frame and return the JSON output of the native module."""
+        records, commands = self.analyze()
+        segments = [
+            {"segment": int(record["segment"]), "dominantColor": [int(record["r"]), int(record["g"]), int(record["b"])]}
+            for record in records[records["changed"]]
+        ]
+        return json.dumps({"commands": commands, "segments": segments}, separators=(",", ":"))
+
+    @property
+    def letterbox(self):
+        """(x, y, width, height) of the picture inside the detected black bars in frame pixels, or None."""
+        content = self.letterbox_tracker.current()
+        if content is None:
+            return None
+        return tuple(value * self.divisor for value in content)
+
+    @property
+    def pending(self):
+        """True while a submitted frame has not been collected with poll() or wait()."""
+        return self.future is not None
+
+    def submit(self, frame=None):
+        """Start analyzing the next frame in the background; False if one is already pending.
+
+        The frame is copied because frame sources reuse their buffers between grabs.
+        """
+        if self.future is not None:
+            return False
+        if frame is not None:
+            frame = np.array(frame[:, :, :3])  # Always a copy, even of a contiguous frame
+        self.future = self.executor.submit(self.analyze, frame)
+        return True
+
+    def poll(self):
+        """Return (segments, commands) of the submitted frame if it is ready, otherwise None."""
+        if self.future is None or not self.future.done():
+            return None
+        return self.wait()
+
+    def wait(self):
+        """Block until the submitted frame is ready and return (segments, commands)."""
+        if self.future is None:
+            raise RuntimeError("No frame has been submitted.")
+        future, self.future = self.future, None
+        return future.result()